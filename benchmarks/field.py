@@ -0,0 +1,66 @@
+"""Runs a reduced field scenario (the first days of a preprocessed site scenario) with given wrapper options, for
+benchmarks.
+
+The scenario must have been preprocessed (`grapevine-traits preprocess --site <site> --clim <clim>`).
+"""
+
+from datetime import datetime, timedelta
+from json import load
+
+from pandas import DataFrame
+
+from grapevine_stomatal_traits.sims.preprocess_functions import FMT_DATES
+from grapevine_stomatal_traits.sims.sim_functions import load_preprocessed_mtg, load_static_inputs
+from grapevine_stomatal_traits.sims.sites import get_site
+from grapevine_stomatal_traits.simulator import hydroshoot_wrapper
+from grapevine_stomatal_traits.simulator.canopy import LeafIrradiance
+from grapevine_stomatal_traits.simulator.clustering import LeafClusters, reduce_canopy
+
+
+def run_field(site: str = 'fresno', clim: str = 'historical', orient: str = 'north_south', nb_days: int = 2,
+              nb_leaf_clusters: int = None, **kwargs) -> (DataFrame, float):
+    """Runs the first `nb_days` of a field scenario with baseline traits.
+
+    Args:
+        nb_leaf_clusters: if provided, the reduced canopy of this number of leaf clusters is simulated
+        kwargs: options passed to `hydroshoot_wrapper.run`
+
+    Returns:
+        hourly outputs and the simulation runtime [s]
+    """
+    site_scenarios = get_site(site)
+    path_root = site_scenarios.path_root
+    scenario_dates = site_scenarios.get_scenario_dates(clim)
+    path_preprocessed_dir = path_root / 'preprocessed_inputs' / clim / orient
+
+    g, scene = load_preprocessed_mtg(path_preprocessed_dir=path_preprocessed_dir)
+    static_inputs = load_static_inputs(path_preprocessed_dir=path_preprocessed_dir, g=g)
+    with open(path_preprocessed_dir / 'dynamic.json') as f:
+        leaf_ppfd = LeafIrradiance.from_dict(load(f), leaf_index=static_inputs.leaf_index)
+    if nb_leaf_clusters is not None:
+        g, static_inputs, leaf_ppfd = reduce_canopy(
+            g=g, static_inputs=static_inputs, leaf_irradiance=leaf_ppfd,
+            leaf_clusters=LeafClusters.from_inputs(g=g, static_inputs=static_inputs, leaf_irradiance=leaf_ppfd,
+                                                   nb_clusters=nb_leaf_clusters))
+    with open(path_preprocessed_dir / 'params.json', mode='r') as f:
+        params = load(f)
+    date_beg = datetime.strptime(params['simulation']['sdate'], FMT_DATES)
+    params['simulation']['edate'] = (date_beg + timedelta(days=nb_days, hours=-1)).strftime(FMT_DATES)
+
+    time_on = datetime.now()
+    res = hydroshoot_wrapper.run(
+        g=g,
+        wd=path_preprocessed_dir,
+        params=params,
+        path_weather=path_root / f'weather_{path_root.stem}_{clim}.csv',
+        scene=scene,
+        write_result=False,
+        is_save_mtg=False,
+        gdd_since_budbreak=scenario_dates[1].gdd_since_budbreak,
+        static_inputs=static_inputs,
+        leaf_ppfd=leaf_ppfd,
+        drip_rate=3.8,
+        replacement_fraction=0.6,
+        irrigation_freq=7,
+        **kwargs)
+    return res, (datetime.now() - time_on).total_seconds()
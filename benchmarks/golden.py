@@ -0,0 +1,144 @@
+"""Golden-output regression harness: compares execution modes of the simulation against stored reference outputs.
+
+Reference (golden) hourly outputs of the exact execution mode are stored, with their runtime, in `benchmarks/golden`
+for the potted grapevine example and a reduced field scenario (the first days of a preprocessed site scenario). Any
+execution mode is then run on the same cases and compared to them, variable by variable, with absolute and relative
+tolerances; its speedup is reported next to its accuracy. The outputs of coarse time-step modes are linearly
+interpolated to the golden hours before comparison. The script exits with a non-zero status if a mode exceeds a
+tolerance.
+
+    python -m benchmarks.golden --update              # (re)builds the golden outputs with the exact mode
+    python -m benchmarks.golden                       # checks all modes
+    python -m benchmarks.golden --case potted --mode exact night_mode
+
+Golden outputs must only be updated on purpose, when a change of results is intended. They are built from
+preprocessed inputs (see `benchmarks.potted` and `benchmarks.field`), so that the preprocessing must also be rerun when
+it changes.
+"""
+
+import sys
+from argparse import ArgumentParser
+from json import dump, load
+from pathlib import Path
+
+from pandas import DataFrame, read_csv
+
+from grapevine_stomatal_traits.simulator.convergence import SolverSettings
+from grapevine_stomatal_traits.simulator.time_step import TimeSampling, interpolate_to_hourly
+
+PATH_GOLDEN = Path(__file__).parent / 'golden'
+
+# variable: (absolute tolerance, relative tolerance), a variable passes if |mode - golden| <= abs + rel * |golden|
+TOLERANCES = {
+    'Rg': (1., 0.01),
+    'An': (0.05, 0.02),
+    'E': (0.5, 0.02),
+    'Tleaf': (0.2, 0.),
+    'psi_soil': (0.005, 0.01),
+    'psi_collar': (0.02, 0.02),
+    'psi_leaf': (0.02, 0.02),
+}
+
+
+def _run_potted(**kwargs):
+    from benchmarks.potted import run_potted
+    return run_potted(**kwargs)
+
+
+def _run_field(**kwargs):
+    from benchmarks.field import run_field
+    return run_field(site='fresno', clim='historical', orient='north_south', nb_days=2, **kwargs)
+
+
+CASES = {
+    'potted': _run_potted,
+    'field': _run_field,
+}
+
+# execution mode: options passed to the case runner (and to `hydroshoot_wrapper.run`)
+MODES = {
+    'exact': {},
+    'night_mode': {'is_night_mode': True},
+    'leaf_clusters_20': {'nb_leaf_clusters': 20},
+    'time_step_1h_day_6h_night': {'time_sampling': TimeSampling(step=1, night_step=6)},
+    'leaf_lod_quad': {'leaf_lod': 'quad'},
+    'solver_loose_psi': {'solver_settings': SolverSettings(psi_error_threshold=0.1)},
+}
+
+# cases on which a mode can run, if not all: leaf levels of detail are preprocessed on the fly for the potted example
+# only, field scenarios being preprocessed with detailed leaves
+MODE_CASES = {
+    'leaf_lod_quad': ('potted',),
+}
+
+
+def update_golden(case: str):
+    res, runtime = CASES[case]()
+    PATH_GOLDEN.mkdir(parents=True, exist_ok=True)
+    res.loc[:, list(TOLERANCES)].to_csv(PATH_GOLDEN / f'{case}.csv', sep=';', decimal='.')
+    with open(PATH_GOLDEN / f'{case}.json', mode='w') as f:
+        dump({'runtime': runtime}, f, indent=2)
+    print(f'golden outputs of "{case}" written ({runtime:.1f} s)')
+    pass
+
+
+def compare_to_golden(case: str, res: DataFrame) -> DataFrame:
+    """Returns, per variable, the maximum absolute and root mean squared errors, the number of hours exceeding the
+    tolerance and whether the variable passes.
+
+    Hours are matched by date: golden hours missing from `res` and NaN values count as exceeding the tolerance, and
+    no variable passes if `res` holds hours that are not in the golden outputs. Sampled outputs (coarse time step, see
+    `simulator.time_step`) are first interpolated to the golden hours."""
+    golden = read_csv(PATH_GOLDEN / f'{case}.csv', sep=';', decimal='.', index_col=0, parse_dates=True)
+    if 'duration' in res.columns and (res['duration'] > 1).any():
+        res = interpolate_to_hourly(results=res, dates=golden.index)
+    is_extra_hours = not res.index.isin(golden.index).all()
+    rows = []
+    for var, (abs_tol, rel_tol) in TOLERANCES.items():
+        error = res[var].reindex(golden.index) - golden[var]
+        nb_exceeding = int((~(error.abs() <= abs_tol + rel_tol * golden[var].abs())).sum())
+        rows.append({'variable': var, 'max_abs': error.abs().max(), 'rmse': (error ** 2).mean() ** 0.5,
+                     'nb_hours_exceeding': nb_exceeding, 'is_ok': nb_exceeding == 0 and not is_extra_hours})
+    return DataFrame(rows).set_index('variable')
+
+
+def check(case: str, mode: str) -> bool:
+    with open(PATH_GOLDEN / f'{case}.json') as f:
+        runtime_golden = load(f)['runtime']
+    res, runtime = CASES[case](**MODES[mode])
+    comparison = compare_to_golden(case=case, res=res)
+    is_ok = bool(comparison['is_ok'].all())
+    print(f'{"ok  " if is_ok else "FAIL"} {case} / {mode}: {runtime:.1f} s, speedup x{runtime_golden / runtime:.2f}')
+    print(comparison.to_string(float_format='{:.4g}'.format))
+    return is_ok
+
+
+def main(cases: list, modes: list, is_update: bool = False) -> int:
+    """Returns the number of failed (case, mode) checks.
+
+    Raises:
+        FileNotFoundError: if the golden outputs of a case are missing (they must first be built with `--update`)
+    """
+    if is_update:
+        for case in cases:
+            update_golden(case=case)
+        return 0
+    missing = [case for case in cases if not (PATH_GOLDEN / f'{case}.csv').is_file()]
+    if missing:
+        raise FileNotFoundError(
+            f'no golden outputs of {", ".join(missing)} in "{PATH_GOLDEN}": build them on a reference version with '
+            f'`python -m benchmarks.golden --update --case {" ".join(missing)}`')
+    return sum(not check(case=case, mode=mode) for case in cases for mode in modes
+               if case in MODE_CASES.get(mode, CASES))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--case', nargs='+', choices=list(CASES), default=list(CASES))
+    parser.add_argument('--mode', nargs='+', choices=list(MODES), default=list(MODES))
+    parser.add_argument('--update', action='store_true', help='(re)build the golden outputs with the exact mode')
+    args = parser.parse_args()
+    try:
+        sys.exit(1 if main(cases=args.case, modes=args.mode, is_update=args.update) else 0)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
@@ -0,0 +1,91 @@
+"""Measures the import time of the package entry modules and the runtime of the command-line planning path
+(`grapevine-traits ... --dry-run`) in fresh interpreters, and guards against regressions.
+
+Each module is imported in its own subprocess (as a spawned pool worker would do), with `-X importtime`, and each
+command line is run in its own subprocess. The script exits with a non-zero status if a module or command takes longer
+than its budget or pulls in a module that must only be loaded lazily (e.g. matplotlib on the simulation path, or
+HydroShoot and PlantGL when only planning a sweep).
+
+    python benchmarks/import_time.py [--budget-scale 1.5] [--repeat 3]
+"""
+
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# module: (import time budget [s], modules that must not be loaded by importing it)
+IMPORT_BUDGETS = {
+    'grapevine_stomatal_traits.simulator.hydroshoot_wrapper': (3.0, ('matplotlib',)),
+    'grapevine_stomatal_traits.sims.sim_functions': (3.0, ('matplotlib',)),
+    'grapevine_stomatal_traits.sims.preprocess_functions': (3.0, ('matplotlib',)),
+    'grapevine_stomatal_traits.sources.mockups.main_mockups': (3.0, ('matplotlib',)),
+    'grapevine_stomatal_traits.analysis.plots': (2.0, ('matplotlib',)),
+}
+
+# command-line arguments: (runtime budget [s], modules that must not be loaded by running them)
+CLI_BUDGETS = {
+    ('simulate', '--dry-run'): (1.0, ('hydroshoot', 'openalea', 'matplotlib')),
+    ('preprocess', '--dry-run'): (1.0, ('hydroshoot', 'openalea', 'matplotlib')),
+}
+
+
+def measure_import(module_name: str, forbidden: tuple) -> (float, list):
+    """Returns the cumulative import time [s] of `module_name` and the forbidden modules it loaded."""
+    code = '; '.join((
+        f'import {module_name}',
+        'import sys',
+        f'print(",".join(m for m in {forbidden!r} if m in sys.modules))'))
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+
+    cumulative_us = 0
+    for line in res.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if name.strip() == module_name:
+                cumulative_us = int(cumulative)
+    loaded = [s for s in res.stdout.strip().split(',') if s]
+    return cumulative_us * 1.e-6, loaded
+
+
+def measure_cli(argv: tuple, forbidden: tuple) -> (float, list):
+    """Returns the runtime [s] of `grapevine-traits <argv>`, imports included, and the forbidden modules it loaded."""
+    code = '\n'.join((
+        'import sys, time',
+        'time_on = time.perf_counter()',
+        'from grapevine_stomatal_traits.cli import main',
+        f'main({list(argv)!r})',
+        f'print(time.perf_counter() - time_on, ",".join(m for m in {forbidden!r} if m in sys.modules), sep=";")'))
+    res = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    duration, loaded = res.stdout.splitlines()[-1].split(';')
+    return float(duration), [s for s in loaded.split(',') if s]
+
+
+def _check(name: str, measures: list, budget: float, budget_scale: float) -> bool:
+    durations, loaded = zip(*measures)
+    duration = min(durations)
+    loaded = sorted(set(sum(loaded, [])))
+    is_ok = duration <= budget * budget_scale and not loaded
+    print(f'{"ok  " if is_ok else "FAIL"} {name}: {duration:.3f} s (budget {budget * budget_scale:.1f} s)'
+          f'{", loads " + ", ".join(loaded) if loaded else ""}')
+    return is_ok
+
+
+def main(budget_scale: float = 1., repeat: int = 3) -> int:
+    nb_failures = 0
+    for module_name, (budget, forbidden) in IMPORT_BUDGETS.items():
+        nb_failures += not _check(
+            name=module_name, budget=budget, budget_scale=budget_scale,
+            measures=[measure_import(module_name=module_name, forbidden=forbidden) for _ in range(repeat)])
+    for argv, (budget, forbidden) in CLI_BUDGETS.items():
+        nb_failures += not _check(
+            name=f'grapevine-traits {" ".join(argv)}', budget=budget, budget_scale=budget_scale,
+            measures=[measure_cli(argv=argv, forbidden=forbidden) for _ in range(repeat)])
+    return nb_failures
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--budget-scale', type=float, default=1., help='multiplies all budgets (slow machines)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of measurements, the fastest is kept')
+    args = parser.parse_args()
+    sys.exit(1 if main(budget_scale=args.budget_scale, repeat=args.repeat) else 0)
@@ -0,0 +1,117 @@
+"""Validates the reduced-canopy mode against the full canopy, for several numbers of leaf clusters: hourly bias and
+errors per output variable, and bias of the seasonal carbon gain and transpiration.
+
+Before running the simulations, the reduced mockups of the potted example are checked: each representative must
+carry the total leaf area of its cluster, its own segments must have their length divided by the same area ratio (so
+that their conductance is multiplied by it), and no other segment length may change.
+
+The potted grapevine example is always run. A field mockup is run in addition when a site scenario is given (it must
+have been preprocessed):
+
+    python -m benchmarks.leaf_clustering --clusters 5 10 20
+    python -m benchmarks.leaf_clustering --clusters 50 100 200 --site fresno --clim historical --orient north_south \
+        --output-root /tmp/leaf_clustering
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from pandas import DataFrame, read_csv
+
+from benchmarks.potted import load_potted, run_potted, compare_outputs
+from grapevine_stomatal_traits.sims.sim_functions import run_simulations
+from grapevine_stomatal_traits.sims.sites import get_site
+from grapevine_stomatal_traits.simulator.clustering import LeafClusters, calc_leaf_area, iter_leaf_segments
+from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits
+
+
+def print_comparison(reference: DataFrame, other: DataFrame):
+    print(compare_outputs(reference=reference, other=other))
+    print(', '.join(f"seasonal {var} {(other[var].sum() / reference[var].sum() - 1) * 100:+.2f} %"
+                    for var in ('An', 'E')) + ' vs full canopy')
+    pass
+
+
+def check_reduced_mtg(nb_clusters: int) -> bool:
+    """Checks the leaf area and segment lengths of the reduced potted mockup of `nb_clusters` leaf clusters."""
+    g, _, static_inputs, leaf_ppfd = load_potted()
+    leaf_clusters = LeafClusters.from_inputs(g=g, static_inputs=static_inputs, leaf_irradiance=leaf_ppfd,
+                                             nb_clusters=nb_clusters)
+    length_full = dict(g.property('length'))
+    own_segments = {vid: list(iter_leaf_segments(g=g, vid=vid)) for vid in leaf_clusters.representatives.tolist()}
+
+    g = leaf_clusters.reduce_mtg(g)
+    representative_index = leaf_clusters.representative_index
+    area = representative_index.to_dict(calc_leaf_area(g=g, leaf_index=representative_index))
+    cluster_area = np.bincount(leaf_clusters.labels, weights=leaf_clusters.leaf_area)
+    leaf_area = leaf_clusters.leaf_index.to_dict(leaf_clusters.leaf_area)
+    area_ratio = {}
+    area_errors = []
+    for k, vid in enumerate(leaf_clusters.representatives.tolist()):
+        area_ratio[vid] = cluster_area[k] / leaf_area[vid]
+        area_errors.append(abs(area[vid] / cluster_area[k] - 1))
+
+    length_reduced = g.property('length')
+    expected_length = {vid: length_full[vid] for vid in length_reduced}
+    for vid, segments in own_segments.items():
+        expected_length.update({vid_segment: length_full[vid_segment] / area_ratio[vid] for vid_segment in segments})
+    length_errors = [abs(length_reduced[vid] - value) / value for vid, value in expected_length.items() if value > 0]
+
+    is_ok = max(area_errors) <= 1.e-6 and max(length_errors, default=0.) <= 1.e-9
+    print(f'potted, {nb_clusters} clusters: {len(area)} leaves, '
+          f'max leaf area error {max(area_errors):.1e}, max segment length error {max(length_errors, default=0.):.1e}, '
+          f'{sum(map(len, own_segments.values()))} rescaled segments: {"ok" if is_ok else "FAILED"}')
+    return is_ok
+
+
+def validate_potted(nb_clusters: list):
+    res_full, runtime_full = run_potted()
+    for nb in nb_clusters:
+        res, runtime = run_potted(nb_leaf_clusters=nb)
+        print(f'potted, {nb} clusters: speedup x{runtime_full / runtime:.2f}')
+        print_comparison(reference=res_full, other=res)
+    pass
+
+
+def validate_field(nb_clusters: list, site: str, clim: str, orient: str, path_output_root: Path):
+    site_scenarios = get_site(site)
+    runtimes = {}
+    for nb in [None] + list(nb_clusters):
+        time_on = datetime.now()
+        run_simulations(
+            path_root=site_scenarios.path_root,
+            scenario_dates=site_scenarios.get_scenario_dates(clim),
+            scenario_angle=ScenariosRowAngle[orient],
+            scenario_traits=ScenariosTraits.baseline,
+            path_output_root=path_output_root / ('full' if nb is None else f'clusters_{nb}'),
+            nb_leaf_clusters=nb)
+        runtimes[nb] = (datetime.now() - time_on).total_seconds()
+
+    def _read(name: str):
+        return read_csv(path_output_root / name / site / clim / orient / ScenariosTraits.baseline.name /
+                        'time_series.csv', sep=';', decimal='.', index_col=0)
+
+    res_full = _read('full')
+    for nb in nb_clusters:
+        print(f'{site}, {nb} clusters: speedup x{runtimes[None] / runtimes[nb]:.2f}')
+        print_comparison(reference=res_full, other=_read(f'clusters_{nb}'))
+    pass
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clusters', type=int, nargs='+', default=[5, 10, 20], help='numbers of leaf clusters')
+    parser.add_argument('--site', default=None, help='site of the field mockup (default: potted example only)')
+    parser.add_argument('--clim', default='historical')
+    parser.add_argument('--orient', default=ScenariosRowAngle.north_south.name)
+    parser.add_argument('--output-root', type=Path, default=Path('leaf_clustering'))
+    args = parser.parse_args()
+
+    if not all([check_reduced_mtg(nb_clusters=nb) for nb in args.clusters]):
+        raise SystemExit('reduced mockups are inconsistent, simulations not run')
+    validate_potted(nb_clusters=args.clusters)
+    if args.site is not None:
+        validate_field(nb_clusters=args.clusters, site=args.site, clim=args.clim, orient=args.orient,
+                       path_output_root=args.output_root)
@@ -0,0 +1,81 @@
+"""Compares the leaf irradiance inputs held as the plain dicts read from 'dynamic.json' (as before
+`simulator.canopy.LeafIrradiance`) and as `LeafIrradiance`: memory held by the inputs, and time of the hourly access
+by HydroShoot (`init_hourly` reads the diffuse ratio, Ei and Eabs of the simulated hour).
+
+The potted grapevine example is used if it was preprocessed (`python -m example.potted_grapevine.main_preprocess`
+from the repository root), otherwise or with `--synthetic`, random irradiance of the given numbers of hours and leaves.
+
+    python -m benchmarks.leaf_irradiance [--synthetic 720 3000]
+"""
+
+import gc
+import random
+import tracemalloc
+from argparse import ArgumentParser
+from json import load
+from pathlib import Path
+from timeit import timeit
+
+from grapevine_stomatal_traits.simulator.canopy import LeafIrradiance
+
+PATH_POTTED = Path(__file__).parents[1] / 'example' / 'potted_grapevine'
+NB_REPEATS = 5
+
+
+def read_hours(leaf_ppfd) -> float:
+    """Reads each hour of `leaf_ppfd` as `init_hourly` does, returns a checksum of the values read."""
+    total = 0.
+    for date in leaf_ppfd:
+        total += leaf_ppfd[date]['diffuse_to_total_irradiance_ratio']
+        total += sum(leaf_ppfd[date]['Ei'].values())
+        total += sum(leaf_ppfd[date]['Eabs'].values())
+    return total
+
+
+def build_synthetic(nb_hours: int, nb_leaves: int) -> dict:
+    """Returns random leaf irradiance with the layout of 'dynamic.json' (string vertex ids, as read from JSON)."""
+    rng = random.Random(0)
+    vids = [str(vid) for vid in range(2, 2 + nb_leaves)]
+    return {f'2012{i_hour // 24 + 1:04d}{i_hour % 24:02d}0000': {
+        'diffuse_to_total_irradiance_ratio': rng.random(),
+        'Ei': {vid: rng.random() * 1000. for vid in vids},
+        'Eabs': {vid: rng.random() * 900. for vid in vids}} for i_hour in range(nb_hours)}
+
+
+def measure_memory(build) -> (object, float):
+    """Returns the object built by `build()` and the memory [MB] it holds once built."""
+    gc.collect()
+    tracemalloc.start()
+    res = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] / 2 ** 20
+    tracemalloc.stop()
+    return res, size
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--synthetic', type=int, nargs=2, default=None, metavar=('NB_HOURS', 'NB_LEAVES'),
+                        help='use random irradiance of this size instead of the potted grapevine example')
+    args = parser.parse_args()
+
+    if args.synthetic is None and (PATH_POTTED / 'preprocessed_inputs' / 'dynamic.json').exists():
+        def _build_dict() -> dict:
+            with open(PATH_POTTED / 'preprocessed_inputs' / 'dynamic.json') as f:
+                return load(f)
+    else:
+        def _build_dict() -> dict:
+            return build_synthetic(*(args.synthetic or (240, 300)))
+
+    leaf_ppfd_dict, size_dict = measure_memory(_build_dict)
+    leaf_ppfd_array, size_array = measure_memory(lambda: LeafIrradiance.from_dict(_build_dict()))
+    checksum_dict, checksum_array = read_hours(leaf_ppfd_dict), read_hours(leaf_ppfd_array)
+    print(f"{len(leaf_ppfd_array)} hours, {len(leaf_ppfd_array.leaf_index)} shapes")
+    print(f"same values: {abs(checksum_dict - checksum_array) <= 1.e-9 * abs(checksum_dict)}")
+    print(f"memory held: dicts {size_dict:.1f} MB, LeafIrradiance {size_array:.1f} MB (x{size_dict / size_array:.1f})")
+
+    runtime_dict = timeit(lambda: read_hours(leaf_ppfd_dict), number=NB_REPEATS) / NB_REPEATS
+    runtime_array = timeit(lambda: read_hours(leaf_ppfd_array), number=NB_REPEATS) / NB_REPEATS
+    print(f"hourly reads of the whole period: dicts {runtime_dict * 1000:.1f} ms, LeafIrradiance "
+          f"{runtime_array * 1000:.1f} ms (x{runtime_dict / runtime_array:.2f}), "
+          f"{(runtime_array - runtime_dict) / len(leaf_ppfd_array) * 1000:+.2f} ms per hour")
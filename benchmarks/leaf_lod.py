@@ -0,0 +1,218 @@
+"""Compares leaf irradiance preprocessed with simplified leaf shapes (`sources.mockups.leaf_lod`) to that of detailed
+leaves on the potted grapevine example, and the preprocessing runtimes.
+
+With `--synthetic`, HydroShoot and Caribu are not used: the sunlit area of each leaf of a random hedge of lobed, cupped
+leaves is rasterised (z-buffer, parallel projection) for the sun positions of a clear summer day and for a uniform
+overcast sky, with the detailed leaf meshes and with their polygons (`calc_leaf_polygon`). This bounds the error due
+to the leaf shapes alone (direct and diffuse irradiance intercepted without scattering); the raster error is given by
+the same comparison of detailed leaves at two pixel sizes.
+
+    python -m benchmarks.leaf_lod
+    python -m benchmarks.leaf_lod --synthetic [NB_LEAVES]
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime
+from json import load
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy as np
+
+from benchmarks.potted import PATH_POTTED
+from grapevine_stomatal_traits.simulator.canopy import LeafIndex, LeafIrradiance
+from grapevine_stomatal_traits.sources.mockups.leaf_lod import LEAF_LOD_NB_VERTICES, calc_leaf_polygon, set_leaf_lod
+
+LEAF_RADIUS = 0.07  # [m] synthetic leaves
+PIXEL_SIZE = 0.002  # [m]
+LATITUDE = 38.  # [°] sun positions of the synthetic comparison
+SOLAR_DECLINATION = 17.  # [°] early August
+
+
+def preprocess_potted(leaf_lod: str = None, leaf_index: LeafIndex = None) -> (LeafIrradiance, float):
+    """Returns the preprocessed leaf irradiance of the potted grapevine example (along `leaf_index`, if provided)
+    and the preprocessing runtime [s]."""
+    from example.potted_grapevine.main_preprocess import build_mtg
+    from grapevine_stomatal_traits.sims.preprocess_functions import preprocess_inputs
+
+    g, scene = build_mtg(path_file=PATH_POTTED / 'digit.csv', is_show_scene=False)
+    set_leaf_lod(g=g, leaf_lod=leaf_lod)
+    with TemporaryDirectory() as path_temp:
+        time_on = datetime.now()
+        preprocess_inputs(
+            grapevine_mtg=g,
+            path_project_dir=PATH_POTTED,
+            path_preprocessed_inputs_dir=Path(path_temp),
+            path_weather=PATH_POTTED / 'weather.csv',
+            psi_soil=-0.5,
+            scene=scene,
+            gdd_since_budbreak=1000.)
+        runtime = (datetime.now() - time_on).total_seconds()
+        with open(Path(path_temp) / 'dynamic.json') as f:
+            return LeafIrradiance.from_dict(load(f), leaf_index=leaf_index), runtime
+
+
+def build_synthetic_leaf(rng: np.random.Generator, nb_rings: int = 4,
+                         nb_sectors: int = 24) -> (np.ndarray, np.ndarray):
+    """Returns the (points, triangles) mesh of a five-lobed leaf with a petiolar sinus, cupped and folded along its
+    midrib at random, in its local frame (normal along z)."""
+    theta = 2 * np.pi * np.arange(nb_sectors) / nb_sectors
+    outline = (1 + 0.2 * np.cos(5 * (theta - np.pi / 2))) * (1 - 0.5 * np.exp(-((theta - 1.5 * np.pi) / 0.3) ** 2))
+    rings = [np.zeros((1, 2))] + [k / nb_rings * LEAF_RADIUS * np.column_stack(
+        [outline * np.cos(theta), outline * np.sin(theta)]) for k in range(1, nb_rings + 1)]
+    xy = np.concatenate(rings)
+    z = rng.uniform(-0.3, 0.3) * (xy ** 2).sum(axis=1) / LEAF_RADIUS + rng.uniform(0., 0.3) * np.abs(xy[:, 0])
+    j = np.arange(nb_sectors)
+    triangles = [np.column_stack([np.zeros(nb_sectors, dtype=int), 1 + j, 1 + (j + 1) % nb_sectors])]
+    for k in range(nb_rings - 1):
+        inner, outer = 1 + k * nb_sectors, 1 + (k + 1) * nb_sectors
+        triangles += [np.column_stack([inner + j, inner + (j + 1) % nb_sectors, outer + (j + 1) % nb_sectors]),
+                      np.column_stack([inner + j, outer + (j + 1) % nb_sectors, outer + j])]
+    return np.column_stack([xy, z]), np.concatenate(triangles)
+
+
+def _rotation_z(angle: float) -> np.ndarray:
+    return np.array([[np.cos(angle), -np.sin(angle), 0.], [np.sin(angle), np.cos(angle), 0.], [0., 0., 1.]])
+
+
+def build_synthetic_canopy(nb_leaves: int, random_state: int = 0) -> list:
+    """Returns the (points, triangles) meshes of `nb_leaves` leaves spread in a 1 m long, 0.4 m wide and 0.8 m high
+    hedge, with random inclinations (up to 80°), azimuths and spins."""
+    rng = np.random.default_rng(random_state)
+    meshes = []
+    for _ in range(nb_leaves):
+        points, triangles = build_synthetic_leaf(rng)
+        inclination = np.radians(rng.uniform(0., 80.))
+        tilt = np.array([[np.cos(inclination), 0., np.sin(inclination)], [0., 1., 0.],
+                         [-np.sin(inclination), 0., np.cos(inclination)]])
+        rotation = _rotation_z(rng.uniform(0., 2 * np.pi)) @ tilt @ _rotation_z(rng.uniform(0., 2 * np.pi))
+        position = rng.uniform([-0.5, -0.2, 1.], [0.5, 0.2, 1.8])
+        meshes.append((points @ rotation.T + position, triangles))
+    return meshes
+
+
+def simplify_meshes(meshes: list, nb_vertices: int) -> list:
+    return [(calc_leaf_polygon(points=points, triangles=triangles, nb_vertices=nb_vertices),
+             np.array([(0, i, i + 1) for i in range(1, nb_vertices - 1)])) for points, triangles in meshes]
+
+
+def calc_mesh_area(points: np.ndarray, triangles: np.ndarray) -> float:
+    a, b, c = (points[triangles[:, i]] for i in range(3))
+    return 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1).sum()
+
+
+def calc_sunlit_area(meshes: list, direction: np.ndarray, pixel_size: float = PIXEL_SIZE) -> np.ndarray:
+    """Returns, for each mesh, its area seen from `direction` (towards the light source) and not hidden by the other
+    meshes, projected normal to `direction` [m2]."""
+    direction = direction / np.linalg.norm(direction)
+    u = np.cross(direction, [0., 0., 1.] if abs(direction[2]) < 0.99 else [1., 0., 0.])
+    u /= np.linalg.norm(u)
+    frame = np.array([u, np.cross(direction, u), direction]).T
+    projected = [points @ frame for points, _ in meshes]
+    origin = np.concatenate(projected)[:, :2].min(axis=0)
+    shape = np.ceil((np.concatenate(projected)[:, :2].max(axis=0) - origin) / pixel_size).astype(int) + 1
+    depth = np.full(shape, -np.inf)
+    owner = np.full(shape, -1)
+    for i_mesh, (uvw, (_, triangles)) in enumerate(zip(projected, meshes)):
+        uvw = np.column_stack([(uvw[:, :2] - origin) / pixel_size, uvw[:, 2]])
+        for (x0, y0, z0), (x1, y1, z1), (x2, y2, z2) in uvw[triangles]:
+            denominator = (y1 - y2) * (x0 - x2) + (x2 - x1) * (y0 - y2)
+            i_min, i_max = int(np.floor(min(x0, x1, x2))), int(np.ceil(max(x0, x1, x2)))
+            j_min, j_max = int(np.floor(min(y0, y1, y2))), int(np.ceil(max(y0, y1, y2)))
+            if abs(denominator) < 1.e-12:
+                continue
+            xs, ys = np.meshgrid(np.arange(i_min, i_max) + 0.5, np.arange(j_min, j_max) + 0.5, indexing='ij')
+            w0 = ((y1 - y2) * (xs - x2) + (x2 - x1) * (ys - y2)) / denominator
+            w1 = ((y2 - y0) * (xs - x2) + (x0 - x2) * (ys - y2)) / denominator
+            w2 = 1 - w0 - w1
+            z = w0 * z0 + w1 * z1 + w2 * z2
+            depth_box, owner_box = depth[i_min:i_max, j_min:j_max], owner[i_min:i_max, j_min:j_max]
+            is_closer = (w0 >= 0) & (w1 >= 0) & (w2 >= 0) & (z > depth_box)
+            depth_box[is_closer] = z[is_closer]
+            owner_box[is_closer] = i_mesh
+    return np.bincount(owner[owner >= 0], minlength=len(meshes)) * pixel_size ** 2
+
+
+def get_light_directions() -> dict:
+    """Returns the directions towards the light and their weights: hourly sun positions of a clear summer day
+    (weight: 1, unit irradiance normal to the beam) and a uniform overcast sky (20 directions, weights summing to a
+    unit irradiance on a horizontal plane)."""
+    def _to_vector(elevation: np.ndarray, azimuth: np.ndarray) -> np.ndarray:
+        return np.column_stack([np.cos(elevation) * np.sin(azimuth), np.cos(elevation) * np.cos(azimuth),
+                                np.sin(elevation)])
+
+    latitude, declination = np.radians(LATITUDE), np.radians(SOLAR_DECLINATION)
+    hour_angle = np.radians(15. * (np.arange(5, 20) - 12))
+    elevation = np.arcsin(np.sin(latitude) * np.sin(declination) +
+                          np.cos(latitude) * np.cos(declination) * np.cos(hour_angle))
+    azimuth = np.arctan2(np.sin(hour_angle), np.cos(hour_angle) * np.sin(latitude) -
+                         np.tan(declination) * np.cos(latitude)) + np.pi
+    is_up = elevation > np.radians(5.)
+    sun = _to_vector(elevation[is_up], azimuth[is_up])
+
+    sky_vectors, sky_weights = [], []
+    for (bottom, top), nb_azimuths in zip(((0., 30.), (30., 60.), (60., 90.)), (8, 8, 4)):
+        elevation = np.radians((bottom + top) / 2.)
+        solid_angle = 2 * np.pi * (np.sin(np.radians(top)) - np.sin(np.radians(bottom))) / nb_azimuths
+        azimuths = 2 * np.pi * (np.arange(nb_azimuths) + 0.5) / nb_azimuths
+        sky_vectors.append(_to_vector(np.full(nb_azimuths, elevation), azimuths))
+        sky_weights.append(np.full(nb_azimuths, solid_angle * np.sin(elevation)))
+    sky_weights = np.concatenate(sky_weights)
+    return {'sun': (sun, np.ones(len(sun))),
+            'sky': (np.concatenate(sky_vectors), sky_weights / sky_weights.sum())}
+
+
+def calc_synthetic_ei(meshes: list, directions: np.ndarray, weights: np.ndarray,
+                      pixel_size: float = PIXEL_SIZE) -> np.ndarray:
+    """Returns the (direction x leaf) irradiance per unit leaf area intercepted from each direction."""
+    area = np.array([calc_mesh_area(*mesh) for mesh in meshes])
+    return np.array([w * calc_sunlit_area(meshes=meshes, direction=d, pixel_size=pixel_size) / area
+                     for d, w in zip(directions, weights)])
+
+
+def compare_synthetic(nb_leaves: int):
+    meshes = build_synthetic_canopy(nb_leaves=nb_leaves)
+    area = np.array([calc_mesh_area(*mesh) for mesh in meshes])
+    for light, (directions, weights) in get_light_directions().items():
+        time_on = datetime.now()
+        ei_full = calc_synthetic_ei(meshes=meshes, directions=directions, weights=weights)
+        runtime_full = (datetime.now() - time_on).total_seconds()
+        if light == 'sky':
+            ei_full = ei_full.sum(axis=0, keepdims=True)
+        others = {'detailed, pixel x0.5': (meshes, PIXEL_SIZE / 2)}
+        others.update({lod: (simplify_meshes(meshes, nb_vertices=nb), PIXEL_SIZE)
+                       for lod, nb in LEAF_LOD_NB_VERTICES.items()})
+        print(f'--- {light}: {len(directions)} directions, {nb_leaves} leaves, mean Ei {ei_full.mean():.3f} '
+              f'(fraction of the {"beam" if light == "sun" else "horizontal"} irradiance), '
+              f'raster {runtime_full:.1f} s')
+        for name, (other_meshes, pixel_size) in others.items():
+            ei = calc_synthetic_ei(meshes=other_meshes, directions=directions, weights=weights, pixel_size=pixel_size)
+            if light == 'sky':
+                ei = ei.sum(axis=0, keepdims=True)
+            diff = (ei - ei_full) / ei_full.mean()
+            canopy_bias = (ei * area).sum() / (ei_full * area).sum() - 1
+            print(f"{name}: leaf Ei rmse {np.sqrt((diff ** 2).mean()) * 100:.1f} %, max |diff| "
+                  f"{np.abs(diff).max() * 100:.0f} % of the mean leaf Ei, canopy total {canopy_bias * 100:+.2f} %")
+    pass
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--synthetic', type=int, nargs='?', const=250, default=None, metavar='NB_LEAVES',
+                        help='compare leaf shapes on a synthetic hedge (default: 250 leaves) instead of the potted '
+                             'example')
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        compare_synthetic(nb_leaves=args.synthetic)
+    else:
+        irradiance_full, runtime_full = preprocess_potted()
+        is_day = irradiance_full.ei.sum(axis=1) > 0
+        for leaf_lod in LEAF_LOD_NB_VERTICES:
+            irradiance, runtime = preprocess_potted(leaf_lod=leaf_lod)
+            diff = (irradiance.ei - irradiance_full.ei)[is_day]
+            canopy_bias = irradiance.ei[is_day].sum() / irradiance_full.ei[is_day].sum() - 1
+            print(f"{leaf_lod}: Ei max |diff| {np.abs(diff).max():.1f}, rmse {np.sqrt((diff ** 2).mean()):.1f} "
+                  f"umol m-2 s-1, canopy total {canopy_bias * 100:+.2f} %")
+            print(f"runtime: detailed {runtime_full:.1f} s, {leaf_lod} {runtime:.1f} s "
+                  f"(speedup x{runtime_full / runtime:.2f})")
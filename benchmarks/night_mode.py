@@ -0,0 +1,17 @@
+"""Compares the reduced night-time solve (`is_night_mode=True`) to the full solve on the potted grapevine example.
+
+    python -m benchmarks.night_mode
+"""
+
+from benchmarks.potted import run_potted, compare_outputs
+
+if __name__ == '__main__':
+    res_full, runtime_full = run_potted()
+    res_night, runtime_night = run_potted(is_night_mode=True)
+
+    print(compare_outputs(reference=res_full, other=res_night))
+    is_night = res_full['Rg'] <= 0
+    print(f"night hours: {is_night.sum()} / {len(is_night)}")
+    print(f"max |dTleaf| at night: {(res_night['Tleaf'] - res_full['Tleaf'])[is_night].abs().max():.3f} °C")
+    print(f"runtime: full {runtime_full:.1f} s, night mode {runtime_night:.1f} s "
+          f"(speedup x{runtime_full / runtime_night:.2f})")
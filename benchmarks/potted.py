@@ -0,0 +1,87 @@
+"""Runs the potted grapevine example (`example/potted_grapevine`) with given wrapper options, for benchmarks.
+
+Preprocessed inputs must exist: run `python -m example.potted_grapevine.main_preprocess` from the repository root
+first.
+"""
+
+from datetime import datetime
+from json import load
+from pathlib import Path
+
+from openalea.mtg.mtg import MTG
+from openalea.plantgl.scenegraph import Scene
+from pandas import DataFrame
+
+from example.potted_grapevine.main_preprocess import build_mtg
+from grapevine_stomatal_traits.sims.sim_functions import load_static_inputs
+from grapevine_stomatal_traits.simulator import hydroshoot_wrapper
+from grapevine_stomatal_traits.simulator.canopy import LeafIrradiance, LeafStaticInputs
+from grapevine_stomatal_traits.simulator.clustering import LeafClusters, reduce_canopy
+
+PATH_POTTED = Path(__file__).parents[1] / 'example' / 'potted_grapevine'
+
+
+def load_potted() -> (MTG, Scene, LeafStaticInputs, LeafIrradiance):
+    """Returns the mockup, scene and preprocessed inputs of the potted grapevine example."""
+    path_preprocessed_data = PATH_POTTED / 'preprocessed_inputs'
+    g, scene = build_mtg(path_file=PATH_POTTED / 'digit.csv', is_show_scene=False)
+    static_inputs = load_static_inputs(path_preprocessed_dir=path_preprocessed_data, g=g)
+    with open(path_preprocessed_data / 'dynamic.json') as f:
+        leaf_ppfd = LeafIrradiance.from_dict(load(f), leaf_index=static_inputs.leaf_index)
+    return g, scene, static_inputs, leaf_ppfd
+
+
+def run_potted(params_update: dict = None, nb_leaf_clusters: int = None, leaf_lod: str = None,
+               **kwargs) -> (DataFrame, float):
+    """Runs the potted grapevine example.
+
+    Args:
+        params_update: {section: {name: value}} updates of the example parameters
+        nb_leaf_clusters: if provided, the reduced canopy of this number of leaf clusters is simulated
+        leaf_lod: if provided, leaf irradiance is preprocessed again with this leaf level of detail (see
+            `benchmarks.leaf_lod`) instead of read from the preprocessed inputs
+        kwargs: options passed to `hydroshoot_wrapper.run`
+
+    Returns:
+        hourly outputs and the simulation runtime [s]
+    """
+    g, scene, static_inputs, leaf_ppfd = load_potted()
+    if leaf_lod is not None:
+        from benchmarks.leaf_lod import preprocess_potted
+        leaf_ppfd = preprocess_potted(leaf_lod=leaf_lod, leaf_index=static_inputs.leaf_index)[0]
+    if nb_leaf_clusters is not None:
+        g, static_inputs, leaf_ppfd = reduce_canopy(
+            g=g, static_inputs=static_inputs, leaf_irradiance=leaf_ppfd,
+            leaf_clusters=LeafClusters.from_inputs(g=g, static_inputs=static_inputs, leaf_irradiance=leaf_ppfd,
+                                                   nb_clusters=nb_leaf_clusters))
+    with open(PATH_POTTED / 'params.json', mode='r') as f:
+        params = load(f)
+    for section, values in (params_update or {}).items():
+        params[section].update(values)
+
+    time_on = datetime.now()
+    res = hydroshoot_wrapper.run(
+        g=g,
+        wd=PATH_POTTED,
+        params=params,
+        path_weather=PATH_POTTED / 'weather.csv',
+        scene=scene,
+        write_result=False,
+        is_save_mtg=False,
+        gdd_since_budbreak=1000.,
+        static_inputs=static_inputs,
+        leaf_ppfd=leaf_ppfd,
+        drip_rate=3.8,
+        replacement_fraction=0.6,
+        irrigation_freq=2,
+        **kwargs)
+    return res, (datetime.now() - time_on).total_seconds()
+
+
+SOLVER_COLUMNS = ('n_iter', 'solve_time')
+
+
+def compare_outputs(reference: DataFrame, other: DataFrame) -> DataFrame:
+    """Returns the mean (bias), maximum absolute and root mean squared differences per output variable."""
+    diff = (other - reference).loc[:, [s for s in reference.columns if s not in SOLVER_COLUMNS]]
+    return DataFrame({'bias': diff.mean(), 'max_abs': diff.abs().max(), 'rmse': (diff ** 2).mean() ** 0.5})
@@ -0,0 +1,105 @@
+"""Runs the potted grapevine example in row-scale mode (`simulator.row`) for increasing row lengths, and reports the
+preprocessing and simulation runtimes, the peak RSS growth and the irradiance of each plant of the row relative to the
+isolated plant, preprocessed over the same period. The infinite-canopy lattice replicating the whole row, the row
+plants should get the Ei of the isolated plant: larger deviations mean that neighbours are counted twice.
+
+    python -m benchmarks.row_scale
+"""
+
+import resource
+from datetime import datetime
+from json import load
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from benchmarks.potted import PATH_POTTED
+from example.potted_grapevine.main_preprocess import build_mtg
+from grapevine_stomatal_traits.sims.preprocess_functions import preprocess_inputs
+from grapevine_stomatal_traits.sims.sim_functions import load_row_leaf_ppfd, load_static_inputs
+from grapevine_stomatal_traits.simulator import hydroshoot_wrapper
+from grapevine_stomatal_traits.simulator.canopy import LeafIrradiance
+
+ROW_LENGTHS = (3, 5, 7)
+
+
+def _rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+def calc_isolated_ei() -> float:
+    """Preprocesses the isolated potted grapevine, returns its total irradiance [umol m-2 s-1]."""
+    with TemporaryDirectory() as path_temp:
+        g, scene = build_mtg(path_file=PATH_POTTED / 'digit.csv', is_show_scene=False)
+        preprocess_inputs(
+            grapevine_mtg=g,
+            path_project_dir=PATH_POTTED,
+            path_preprocessed_inputs_dir=Path(path_temp),
+            path_weather=PATH_POTTED / 'weather.csv',
+            psi_soil=-0.5,
+            scene=scene,
+            gdd_since_budbreak=1000.)
+        with open(Path(path_temp) / 'dynamic.json') as f:
+            return LeafIrradiance.from_dict(load(f)).ei.sum()
+
+
+def run_potted_row(nb_row_plants: int) -> dict:
+    """Preprocesses and simulates a row of `nb_row_plants` potted grapevines, returns runtimes [s], peak RSS growth
+    [MB] and the total irradiance of each plant [umol m-2 s-1]."""
+    with open(PATH_POTTED / 'params.json', mode='r') as f:
+        params = load(f)
+
+    with TemporaryDirectory() as path_temp:
+        path_temp = Path(path_temp)
+        g, scene = build_mtg(path_file=PATH_POTTED / 'digit.csv', is_show_scene=False)
+
+        rss_on, time_on = _rss(), datetime.now()
+        preprocess_inputs(
+            grapevine_mtg=g,
+            path_project_dir=PATH_POTTED,
+            path_preprocessed_inputs_dir=path_temp,
+            path_weather=PATH_POTTED / 'weather.csv',
+            psi_soil=-0.5,
+            scene=scene,
+            gdd_since_budbreak=1000.,
+            nb_row_plants=nb_row_plants)
+        runtime_preprocess = (datetime.now() - time_on).total_seconds()
+
+        g, scene = build_mtg(path_file=PATH_POTTED / 'digit.csv', is_show_scene=False)
+        static_inputs = load_static_inputs(path_preprocessed_dir=path_temp, g=g)
+        with open(path_temp / 'dynamic.json') as f:
+            leaf_ppfd = LeafIrradiance.from_dict(load(f), leaf_index=static_inputs.leaf_index)
+        row_leaf_ppfd, reference_plant = load_row_leaf_ppfd(path_preprocessed_dir=path_temp, leaf_irradiance=leaf_ppfd)
+
+        time_on = datetime.now()
+        hydroshoot_wrapper.run_row(
+            g=g,
+            row_leaf_ppfd=row_leaf_ppfd,
+            reference_plant=reference_plant,
+            write_result=False,
+            wd=PATH_POTTED,
+            params=params,
+            path_weather=PATH_POTTED / 'weather.csv',
+            scene=scene,
+            is_save_mtg=False,
+            gdd_since_budbreak=1000.,
+            static_inputs=static_inputs,
+            drip_rate=3.8,
+            replacement_fraction=0.6,
+            irrigation_freq=7)
+        runtime_simulation = (datetime.now() - time_on).total_seconds()
+
+    return {'runtime_preprocess': runtime_preprocess, 'runtime_simulation': runtime_simulation,
+            'rss': _rss() - rss_on, 'reference_plant': reference_plant,
+            'ei': {plant: irradiance.ei.sum() for plant, irradiance in row_leaf_ppfd.items()}}
+
+
+if __name__ == '__main__':
+    ei_isolated = calc_isolated_ei()
+    for nb_plants in ROW_LENGTHS:
+        res = run_potted_row(nb_row_plants=nb_plants)
+        deviations = {plant: (ei / ei_isolated - 1) * 100 for plant, ei in sorted(res['ei'].items())}
+        print(f"{nb_plants} plants: preprocessing {res['runtime_preprocess']:.1f} s, simulation "
+              f"{res['runtime_simulation']:.1f} s ({res['runtime_simulation'] / nb_plants:.1f} s per plant), "
+              f"peak RSS growth {res['rss']:.0f} MB")
+        print(f"    Ei vs isolated plant: reference plant {deviations[res['reference_plant']]:+.1f} %, "
+              f"per plant: {', '.join(f'{p}: {d:+.1f} %' for p, d in deviations.items())}")
@@ -0,0 +1,24 @@
+"""Compares solver tolerances on the potted grapevine example: total number of iterations, runtime and departure of
+outputs from the default solve.
+
+    python -m benchmarks.solver_tolerances
+"""
+
+from benchmarks.potted import run_potted, compare_outputs
+from grapevine_stomatal_traits.simulator.convergence import SolverSettings
+
+SETTINGS = {
+    'loose psi': SolverSettings(psi_error_threshold=0.1),
+    'loose psi and temperature': SolverSettings(psi_error_threshold=0.1, t_error_threshold=0.1),
+}
+
+if __name__ == '__main__':
+    res_ref, runtime_ref = run_potted(is_solver_diagnostics=True)
+    print(f"default: {res_ref['n_iter'].sum()} iterations, {runtime_ref:.1f} s")
+    for name, solver_settings in SETTINGS.items():
+        res, runtime = run_potted(solver_settings=solver_settings, is_solver_diagnostics=True)
+        hot_hours = res_ref['Tleaf'] >= res_ref['Tleaf'].quantile(0.9)
+        print(f"{name}: {res['n_iter'].sum()} iterations ({res['n_iter'][hot_hours].mean():.1f} vs "
+              f"{res_ref['n_iter'][hot_hours].mean():.1f} per hot hour), {runtime:.1f} s "
+              f"(speedup x{runtime_ref / runtime:.2f})")
+        print(compare_outputs(reference=res_ref, other=res))
@@ -0,0 +1,35 @@
+"""Compares coarse time-step simulations (`simulator.time_step`) to the hourly simulation on the potted grapevine
+example: hourly-interpolated outputs, bias of the seasonal carbon gain and transpiration (also over night hours only,
+which daylight-weighted samplings simulate coarsely), and runtimes.
+
+    python -m benchmarks.time_step
+"""
+
+from benchmarks.potted import run_potted, compare_outputs
+from grapevine_stomatal_traits.simulator.time_step import TimeSampling, calc_totals, interpolate_to_hourly
+
+SAMPLINGS = {
+    '2h': TimeSampling(step=2),
+    '3h': TimeSampling(step=3),
+    '6h': TimeSampling(step=6),
+    '1h day / 6h night': TimeSampling(step=1, night_step=6),
+    '2h day / 12h night': TimeSampling(step=2, night_step=12)}
+
+if __name__ == '__main__':
+    res_hourly, runtime_hourly = run_potted()
+    totals_hourly = calc_totals(res_hourly)
+
+    for name, time_sampling in SAMPLINGS.items():
+        res, runtime = run_potted(time_sampling=time_sampling)
+        totals = calc_totals(res)
+        print(f'--- {name}: {len(res)} / {len(res_hourly)} simulated hours')
+        res_interpolated = interpolate_to_hourly(results=res, dates=res_hourly.index)
+        print(compare_outputs(reference=res_hourly[res_interpolated.columns], other=res_interpolated))
+        print('seasonal totals bias: ' + ', '.join(
+            f"{k}: {(totals[k] / totals_hourly[k] - 1) * 100:+.1f} %" for k in totals))
+        totals_night_hourly = calc_totals(res_hourly[res_hourly['Rg'] <= 0])
+        totals_night = calc_totals(res[res['Rg'] <= 0])
+        print('night totals: ' + ', '.join(
+            f"{k}: {totals_night[k]:.4g} vs {totals_night_hourly[k]:.4g} hourly" for k in totals))
+        print(f"runtime: hourly {runtime_hourly:.1f} s, {name} {runtime:.1f} s "
+              f"(speedup x{runtime_hourly / runtime:.2f})")
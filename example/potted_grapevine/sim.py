@@ -6,6 +6,7 @@ from json import load
 from pathlib import Path
 
 from example.potted_grapevine.main_preprocess import build_mtg
+from grapevine_stomatal_traits.sims.sim_functions import load_static_inputs
 from grapevine_stomatal_traits.simulator import hydroshoot_wrapper
 
 if __name__ == '__main__':
@@ -14,8 +15,6 @@ if __name__ == '__main__':
 
     g, scene = build_mtg(path_file=path_project / 'digit.csv', is_show_scene=False)
 
-    with open(path_preprocessed_data / 'static.json') as f:
-        static_inputs = load(f)
     with open(path_preprocessed_data / 'dynamic.json') as f:
         dynamic_inputs = load(f)
     with open(path_project / 'params.json', mode='r') as f:
@@ -29,8 +28,7 @@ if __name__ == '__main__':
         scene=scene,
         path_output=path_project / 'output' / 'time_series_with_preprocessed_data.csv',
         gdd_since_budbreak=1000.,
-        form_factors=static_inputs['form_factors'],
-        leaf_nitrogen=static_inputs['Na'],
+        static_inputs=load_static_inputs(path_preprocessed_dir=path_preprocessed_data, g=g),
         leaf_ppfd=dynamic_inputs,
         # psi_soil_init=-0.5,
         drip_rate=3.8,
@@ -0,0 +1,155 @@
+"""Materialised summary cubes of the scenarios sweep.
+
+The hourly time series of all scenarios are aggregated once into a small SQLite file, indexed on the scenario key
+(site, clim, orient, trait), from which plot functions query only the cells they draw:
+    - 'daily': daily sums of An and E, daily extrema and means of leaf and air temperature, daily minimum water
+      potentials;
+    - 'seasonal': seasonal An, E, water use efficiency and maximum leaf temperature, with their ratios
+      ('<var>_rel') or differences ('Tleaf_delta') to the baseline trait of the same site, climate and orientation;
+    - 'water_potential': hourly soil and leaf water potentials, by hour since the start of the simulation;
+    - 'daily_leaf_temperature' (optional): daily maxima of leaf temperature quantiles.
+
+Example:
+    build_summary_cubes(path_db=path_db, data=get_all_time_series(...), weather=get_weather_data(...))
+    seasonal = SummaryCubes(path_db).query('seasonal', site='fresno', clim='rcp85')
+"""
+
+import sqlite3
+from contextlib import closing
+from os import replace
+from pathlib import Path
+from typing import Iterable
+
+from pandas import DataFrame, read_csv, read_sql_query
+
+SCENARIO_KEYS = ('site', 'clim', 'orient', 'trait')
+BASELINE_TRAIT = 'baseline'
+
+
+def calc_daily_cube(data: DataFrame, weather: DataFrame = None) -> DataFrame:
+    keys = list(SCENARIO_KEYS)
+    df = data[[*keys, 'time', 'An', 'E', 'Tleaf', 'psi_soil', 'psi_leaf']]
+    if weather is not None:
+        df = df.merge(weather[['site', 'clim', 'time', 'Tac']], on=['site', 'clim', 'time'], how='left')
+    df = df.assign(date=df['time'].dt.floor('D'))
+    aggregations = dict(
+        An=('An', 'sum'),
+        E=('E', 'sum'),
+        Tleaf_max=('Tleaf', 'max'),
+        Tleaf_mean=('Tleaf', 'mean'),
+        Tleaf_min=('Tleaf', 'min'),
+        psi_soil_min=('psi_soil', 'min'),
+        psi_leaf_min=('psi_leaf', 'min'))
+    if weather is not None:
+        aggregations.update(Tac_max=('Tac', 'max'), Tac_mean=('Tac', 'mean'), Tac_min=('Tac', 'min'))
+    return df.groupby([*keys, 'date']).agg(**aggregations).reset_index()
+
+
+def calc_seasonal_cube(data: DataFrame) -> DataFrame:
+    keys = list(SCENARIO_KEYS)
+    res = data.groupby(keys).agg(An=('An', 'sum'), E=('E', 'sum'), Tleaf_max=('Tleaf', 'max')).reset_index()
+    res['wue'] = res['An'] / res['E']
+
+    baseline = res[res['trait'] == BASELINE_TRAIT].drop(columns='trait')
+    res = res.merge(baseline, on=keys[:-1], how='left', suffixes=('', '_baseline'))
+    for var_name in ('An', 'E', 'wue'):
+        res[f'{var_name}_rel'] = res[var_name] / res[f'{var_name}_baseline']
+    res['Tleaf_delta'] = res['Tleaf_max'] - res['Tleaf_max_baseline']
+    return res.drop(columns=[c for c in res.columns if c.endswith('_baseline')])
+
+
+def calc_water_potential_cube(data: DataFrame) -> DataFrame:
+    keys = list(SCENARIO_KEYS)
+    res = data[[*keys, 'time', 'psi_soil', 'psi_leaf']].sort_values([*keys, 'time'])
+    return res.assign(hour=res.groupby(keys).cumcount())
+
+
+def calc_daily_leaf_temperature_cube(path_data: Path) -> DataFrame:
+    """Daily maxima of the leaf temperature statistics of `path_data` (';'-separated, 'dt' time column)."""
+    keys = list(SCENARIO_KEYS)
+    df = read_csv(path_data, sep=';', decimal='.', parse_dates=['dt'])
+    df = df.assign(date=df['dt'].dt.floor('D')).drop(columns='dt')
+    return df.groupby([*keys, 'date']).max(numeric_only=True).reset_index()
+
+
+def build_summary_cubes(path_db: Path, data: DataFrame, weather: DataFrame = None,
+                        path_temperature_data: Path = None) -> Path:
+    """Writes the summary cubes of `data` (all time series, see `plots.get_all_time_series`) to `path_db`.
+
+    Args:
+        path_db: SQLite file, replaced atomically if it exists
+        data: hourly outputs of all scenarios, with 'time' and scenario key columns
+        weather: weather of all sites and climates (see `plots.get_weather_data`), for air temperature aggregates
+        path_temperature_data: leaf temperature quantiles file, for the 'daily_leaf_temperature' cube
+
+    Returns:
+        path_db
+    """
+    path_db = Path(path_db)
+    tables = {
+        'daily': calc_daily_cube(data=data, weather=weather),
+        'seasonal': calc_seasonal_cube(data=data),
+        'water_potential': calc_water_potential_cube(data=data)}
+    if path_temperature_data is not None:
+        tables['daily_leaf_temperature'] = calc_daily_leaf_temperature_cube(path_data=path_temperature_data)
+
+    path_temp = path_db.with_name(f'.{path_db.name}.tmp')
+    if path_temp.exists():
+        path_temp.unlink()
+    with closing(sqlite3.connect(str(path_temp))) as con:
+        for name, df in tables.items():
+            df.to_sql(name, con, index=False)
+            con.execute(f'CREATE INDEX idx_{name}_scenario ON {name} ({", ".join(SCENARIO_KEYS)})')
+        con.commit()
+    replace(path_temp, path_db)
+    return path_db
+
+
+def is_stale(path_db: Path, paths_sources: Iterable) -> bool:
+    """Returns True if `path_db` is missing or older than any of `paths_sources`."""
+    path_db = Path(path_db)
+    if not path_db.exists():
+        return True
+    mtime = path_db.stat().st_mtime
+    return any(Path(p).stat().st_mtime > mtime for p in paths_sources)
+
+
+class SummaryCubes(object):
+    def __init__(self, path_db: Path):
+        """
+        Args:
+            path_db: SQLite file written by `build_summary_cubes`
+
+        Raises:
+            FileNotFoundError: if `path_db` does not exist
+        """
+        self.path_db = Path(path_db)
+        if not self.path_db.exists():
+            raise FileNotFoundError(f'no summary cubes at "{self.path_db}", see `build_summary_cubes`')
+
+    @property
+    def tables(self) -> list:
+        with closing(sqlite3.connect(str(self.path_db))) as con:
+            return [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def query(self, table: str, columns: Iterable = None, **filters) -> DataFrame:
+        """Returns the rows of `table` matching `filters` (column=value, or column=list of values).
+
+        Raises:
+            KeyError: if `table` is not a cube of the file
+        """
+        if table not in self.tables:
+            raise KeyError(f'unknown summary cube "{table}", available: {self.tables}')
+        conditions, params = [], []
+        for column, value in filters.items():
+            values = [value] if isinstance(value, str) or not isinstance(value, Iterable) else list(value)
+            conditions.append(f'"{column}" IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+        sql = (f'SELECT {"*" if columns is None else ", ".join(columns)} FROM {table}' +
+               (f' WHERE {" AND ".join(conditions)}' if conditions else ''))
+        with closing(sqlite3.connect(str(self.path_db))) as con:
+            res = read_sql_query(sql, con, params=params)
+        for column in ('date', 'time'):
+            if column in res.columns:
+                res[column] = res[column].astype('datetime64[ns]')
+        return res
@@ -0,0 +1,185 @@
+"""Emulator of daily simulation outputs, trained on the accumulated sweep results, to screen stomatal traits.
+
+Daily An, E, WUE and maximum Tleaf are regressed on the stomatal parameters (`par_gs`: g0, m0, psi0), the site, the
+row orientation and the daily weather. Gaussian-process regression (default) or gradient-boosted quantile regression
+(scikit-learn, CPU) provide predictions with uncertainty, which is used to rank the trait combinations whose full
+simulation would be the most informative.
+
+Example:
+    data = get_all_time_series(path_time_series=...)
+    table = build_training_table(data=data, weather=get_weather_data(path_sims=...))
+    emulator = TraitEmulator().fit(table)
+    candidates = DataFrame(product(linspace(1, 8, 8), linspace(-1.8, -0.6, 7)), columns=['m0', 'psi0'])
+    candidates['g0'] = 0.0115
+    suggest_simulations(emulator=emulator, table=table, candidate_traits=candidates)
+"""
+
+from datetime import datetime
+
+import numpy as np
+from pandas import DataFrame, merge
+
+from grapevine_stomatal_traits.sims.sites import SITES
+from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits
+
+TRAIT_NAMES = ('g0', 'm0', 'psi0')
+WEATHER_FEATURES = ('Tac_max', 'Tac_mean', 'hs_mean', 'u_mean', 'Rg_sum')
+FEATURES = TRAIT_NAMES + ('latitude', 'row_angle', 'doy') + WEATHER_FEATURES
+TARGETS = ('An', 'E', 'wue', 'Tleaf')
+
+
+def build_training_table(data: DataFrame, weather: DataFrame) -> DataFrame:
+    """Aggregates hourly simulation outputs into one row per scenario and day, with its features.
+
+    Args:
+        data: hourly outputs of all scenarios, as returned by `plots.get_all_time_series`
+        weather: hourly weather of all sites and climates, as returned by `plots.get_weather_data`
+
+    Returns:
+        daily table holding the scenario keys, `FEATURES` and `TARGETS`
+    """
+    df = data.assign(date=data['time'].dt.floor('D'))
+    keys = ['site', 'clim', 'orient', 'trait', 'date']
+    res = df.groupby(keys).agg(An=('An', 'sum'), E=('E', 'sum'), Tleaf=('Tleaf', 'max')).reset_index()
+    res['wue'] = res['An'] / res['E']
+
+    w = weather.assign(date=weather['time'].dt.floor('D')).groupby(['site', 'clim', 'date']).agg(
+        Tac_max=('Tac', 'max'), Tac_mean=('Tac', 'mean'), hs_mean=('hs', 'mean'), u_mean=('u', 'mean'),
+        Rg_sum=('Rg', 'sum')).reset_index()
+    res = merge(left=res, right=w, on=['site', 'clim', 'date'], how='inner')
+
+    traits = DataFrame([{'trait': s.name, **s.value} for s in ScenariosTraits])
+    res = merge(left=res, right=traits, on='trait', how='left')
+    res['latitude'] = res['site'].map({name: _get_latitude(name) for name in SITES})
+    res['row_angle'] = res['orient'].map({s.name: s.value for s in ScenariosRowAngle})
+    res['doy'] = res['date'].dt.dayofyear
+    return res
+
+
+def _get_latitude(site_name: str) -> float:
+    site = SITES[site_name]
+    dates = site.scenarios_dates[0][1]
+    return site.get_site_data(dates).latitude
+
+
+class TraitEmulator(object):
+    def __init__(self, method: str = 'gp', max_samples: int = 3000, random_state: int = 0):
+        """
+        Args:
+            method: one of 'gp' (Gaussian-process regression) or 'gbr' (gradient-boosted quantile regression)
+            max_samples: maximum number of training rows (randomly subsampled above), bounds the GP fitting cost
+            random_state: seed of subsampling and fitting
+        """
+        if method not in ('gp', 'gbr'):
+            raise KeyError(f'unknown emulator method: "{method}"')
+        self.method = method
+        self.max_samples = max_samples
+        self.random_state = random_state
+        self.models = {}
+        self._x_mean = None
+        self._x_std = None
+
+    def _scale(self, table: DataFrame) -> np.ndarray:
+        return (table.loc[:, FEATURES].to_numpy(dtype=float) - self._x_mean) / self._x_std
+
+    def fit(self, table: DataFrame) -> 'TraitEmulator':
+        table = table.dropna(subset=list(FEATURES + TARGETS))
+        if table.shape[0] > self.max_samples:
+            table = table.sample(n=self.max_samples, random_state=self.random_state)
+        x = table.loc[:, FEATURES].to_numpy(dtype=float)
+        self._x_mean = x.mean(axis=0)
+        self._x_std = np.where(x.std(axis=0) > 0, x.std(axis=0), 1.)
+        x = self._scale(table)
+        for target in TARGETS:
+            self.models[target] = self._fit_target(x=x, y=table[target].to_numpy(dtype=float))
+        return self
+
+    def _fit_target(self, x: np.ndarray, y: np.ndarray):
+        if self.method == 'gp':
+            from sklearn.gaussian_process import GaussianProcessRegressor
+            from sklearn.gaussian_process.kernels import ConstantKernel, RBF, WhiteKernel
+
+            kernel = ConstantKernel() * RBF(length_scale=np.ones(x.shape[1])) + WhiteKernel()
+            model = GaussianProcessRegressor(kernel=kernel, normalize_y=True, random_state=self.random_state)
+            return model.fit(x, y)
+        else:
+            from sklearn.ensemble import GradientBoostingRegressor
+
+            return {q: GradientBoostingRegressor(loss='quantile', alpha=q, random_state=self.random_state).fit(x, y)
+                    for q in (0.1, 0.5, 0.9)}
+
+    def predict(self, table: DataFrame) -> DataFrame:
+        """Predicts the daily targets of the rows of `table` (which must hold `FEATURES`).
+
+        Returns:
+            '<target>' (mean) and '<target>_std' (standard deviation) columns, indexed as `table`
+        """
+        x = self._scale(table)
+        res = {}
+        for target, model in self.models.items():
+            if self.method == 'gp':
+                mean, std = model.predict(x, return_std=True)
+            else:
+                mean = model[0.5].predict(x)
+                std = (model[0.9].predict(x) - model[0.1].predict(x)) / (2 * 1.2816)
+            res[target] = mean
+            res[f'{target}_std'] = np.abs(std)
+        return DataFrame(res, index=table.index)
+
+    def predict_traits(self, table: DataFrame, traits: dict) -> DataFrame:
+        """Predicts the daily targets in the conditions (site, orientation, days) of `table` for another set of
+        stomatal parameters ({'g0': .., 'm0': .., 'psi0': ..})."""
+        return self.predict(table.assign(**traits))
+
+
+def suggest_simulations(emulator: TraitEmulator, table: DataFrame, candidate_traits: DataFrame,
+                        target: str = 'wue', nb_suggestions: int = 5) -> DataFrame:
+    """Ranks candidate trait combinations by the emulator uncertainty on `target`.
+
+    Each candidate is predicted in the conditions of the baseline rows of `table` (all sites, climates, orientations
+    and days); candidates are ranked by their mean relative predictive standard deviation, the most uncertain
+    ones being those whose full simulation would best reduce the emulator uncertainty.
+
+    Args:
+        emulator: fitted emulator
+        table: training table, as returned by `build_training_table`
+        candidate_traits: one row per candidate, with columns g0, m0 and psi0
+        target: one of `TARGETS`
+        nb_suggestions: number of candidates to return
+
+    Returns:
+        the `nb_suggestions` most uncertain candidates, with their mean predicted target and relative uncertainty
+    """
+    conditions = table[table['trait'] == ScenariosTraits.baseline.name]
+    res = []
+    for _, traits in candidate_traits.iterrows():
+        prediction = emulator.predict_traits(table=conditions, traits=traits[list(TRAIT_NAMES)].to_dict())
+        res.append({
+            **traits.to_dict(),
+            target: prediction[target].mean(),
+            'relative_std': (prediction[f'{target}_std'] / prediction[target].abs()).mean()})
+    return DataFrame(res).sort_values('relative_std', ascending=False).head(nb_suggestions)
+
+
+def evaluate_emulator(table: DataFrame, method: str = 'gp', **kwargs) -> DataFrame:
+    """Leave-one-trait-out validation: for each trait scenario, the emulator is trained on the others and scored on
+    it, which mimics predicting an unseen trait combination.
+
+    Returns:
+        root mean squared error and the fraction of observations within the predicted ±2 std, per trait and target
+    """
+    res = []
+    for trait in table['trait'].unique():
+        time_on = datetime.now()
+        emulator = TraitEmulator(method=method, **kwargs).fit(table[table['trait'] != trait])
+        test = table[table['trait'] == trait]
+        prediction = emulator.predict(test)
+        for target in TARGETS:
+            error = prediction[target] - test[target]
+            res.append({
+                'trait': trait,
+                'target': target,
+                'rmse': float(np.sqrt((error ** 2).mean())),
+                'coverage_2std': float((error.abs() <= 2 * prediction[f'{target}_std']).mean()),
+                'runtime_s': (datetime.now() - time_on).total_seconds()})
+    return DataFrame(res)
@@ -1,15 +1,14 @@
 from datetime import timedelta, datetime
 from itertools import product
 from pathlib import Path
-from typing import Callable
 
-import matplotlib.dates as mdates
 from hydroshoot import constants
-from matplotlib import pyplot
-from pandas import DataFrame, read_csv, concat, merge
+from pandas import DataFrame, read_csv, concat
 
+from grapevine_stomatal_traits.analysis.cubes import SummaryCubes, build_summary_cubes, is_stale
 from grapevine_stomatal_traits.sims.fresno.config import ScenariosDatesFresno
 from grapevine_stomatal_traits.sims.oakville.config import ScenariosDatesOakville
+from grapevine_stomatal_traits.simulator.weather import read_weather
 
 SITES = ('fresno', 'oakville')
 SCEN_CLIM = ('historical', 'rcp45', 'rcp85')
@@ -54,7 +53,7 @@ def get_all_time_series(path_time_series: Path, path_output: Path = None) -> Dat
                 res = concat([res, df])
     res.rename(columns={'Unnamed: 0': 'time'}, inplace=True)
     # umol(CO2) s-1 -> g(CO2) h-1
-    res.loc[:, 'An'] = res.apply(lambda x: x['An'] * 1.e-6 * constants.co2_molar_mass * 3600., axis=1)
+    res.loc[:, 'An'] = res['An'] * 1.e-6 * constants.co2_molar_mass * 3600.
     if path_output is not None:
         res.to_csv(path_output, decimal='.', sep=';')
     return res
@@ -63,7 +62,7 @@ def get_all_time_series(path_time_series: Path, path_output: Path = None) -> Dat
 def get_weather_data(path_sims: Path) -> DataFrame:
     res = None
     for cmb in list(product(SITES, SCEN_CLIM)):
-        df = read_csv(path_sims / cmb[0] / f'weather_{cmb[0]}_{cmb[1]}.csv', sep=';', decimal='.', parse_dates=[0])
+        df = read_weather(path_weather=path_sims / cmb[0] / f'weather_{cmb[0]}_{cmb[1]}.csv').reset_index()
         df.loc[:, ['site', 'clim']] = list(zip(*[[v] * df.shape[0] for v in cmb]))
         if res is None:
             res = df
@@ -72,9 +71,15 @@ def get_weather_data(path_sims: Path) -> DataFrame:
     return res.sort_values('time')
 
 
-def plot_trait_effect(data: DataFrame, path_fig: Path, is_relative: bool, var_name: str = 'wue') -> None:
+def plot_trait_effect(cubes: SummaryCubes, path_fig: Path, is_relative: bool, var_name: str = 'wue') -> None:
+    from matplotlib import pyplot
+
     is_wue = var_name == 'wue'
     is_temperature = var_name == 'Tleaf'
+    if is_relative:
+        column = 'Tleaf_delta' if is_temperature else f'{var_name}_rel'
+    else:
+        column = 'Tleaf_max' if is_temperature else var_name
     fig, axs = pyplot.subplots(nrows=len(SCEN_CLIM), ncols=len(SITES), sharex='all', sharey='all', figsize=(5, 5))
 
     for j, site in enumerate(SITES):
@@ -87,33 +92,15 @@ def plot_trait_effect(data: DataFrame, path_fig: Path, is_relative: bool, var_na
                     ax.text(*xy_text, 'baseline', color='r')
 
             for scen_orient in SCEN_ORIENT:
-                df = data[(data['site'] == site) &
-                          (data['clim'] == scen_clim) &
-                          (data['orient'] == scen_orient)]
+                df = cubes.query('seasonal', columns=('trait', column), site=site, clim=scen_clim,
+                                 orient=scen_orient)
                 if not df.empty:
-                    if is_temperature:
-                        gdf = df.groupby(by='trait').max(numeric_only=True)
-                    else:
-                        gdf = df.groupby(by='trait').sum(numeric_only=True)
-                    gdf_var = (gdf['An'] / gdf['E']) if is_wue else gdf[var_name]
-                    res = dict()
-                    for s in SCEN_TRAIT:
-                        try:
-                            res[s] = gdf_var.loc[s]
-                        except KeyError:
-                            res[s] = None
+                    res = df.set_index('trait')[column].to_dict()
                     lbl = {'north_south': 'NS', 'northeast_southwest': 'NE-SW', 'east_west': 'EW'}
+                    traits = ('high_gmax', 'low_gsp50', 'low_gmax', 'high_gsp50', 'elite')
                     if not is_relative:
-                        x, y = zip(*[(s, res[s])
-                                     for s in
-                                     ('baseline', 'high_gmax', 'low_gsp50', 'low_gmax', 'high_gsp50', 'elite')])
-                    else:
-                        if is_temperature:
-                            x, y = zip(*[(s, res[s] - res['baseline'])
-                                         for s in ('high_gmax', 'low_gsp50', 'low_gmax', 'high_gsp50', 'elite')])
-                        else:
-                            x, y = zip(*[(s, res[s] / res['baseline'])
-                                         for s in ('high_gmax', 'low_gsp50', 'low_gmax', 'high_gsp50', 'elite')])
+                        traits = ('baseline',) + traits
+                    x, y = zip(*[(s, res.get(s)) for s in traits])
                     ax.plot(x, y, marker='.', linestyle='-', label=lbl[scen_orient])
 
     for j, site in enumerate(SITES):
@@ -134,7 +121,9 @@ def plot_trait_effect(data: DataFrame, path_fig: Path, is_relative: bool, var_na
     pass
 
 
-def plot_water_potential(data: DataFrame, path_fig: Path) -> None:
+def plot_water_potential(cubes: SummaryCubes, path_fig: Path) -> None:
+    from matplotlib import pyplot
+
     for site in SITES:
         fig, axs = pyplot.subplots(nrows=len(SCEN_CLIM), ncols=len(SCEN_TRAIT), sharex='all', sharey='all',
                                    figsize=(10, 5))
@@ -142,13 +131,10 @@ def plot_water_potential(data: DataFrame, path_fig: Path) -> None:
         for j, trait in enumerate(SCEN_TRAIT):
             for i, clim in enumerate(SCEN_CLIM):
                 for orient in ('north_south',):
-                    df = data[(data['site'] == site) &
-                              (data['clim'] == clim) &
-                              (data['orient'] == orient) &
-                              (data['trait'] == trait)]
+                    df = cubes.query('water_potential', site=site, clim=clim, orient=orient, trait=trait)
                     if not df.empty:
                         for v in ('psi_soil', 'psi_leaf'):
-                            axs[i, j].plot(df.index.values, df[v], label=v.split("_")[1])
+                            axs[i, j].plot(df['hour'].values, df[v], label=v.split("_")[1])
 
         for j, trait in enumerate(SCEN_TRAIT):
             axs[0, j].set_title(trait)
@@ -165,8 +151,11 @@ def plot_water_potential(data: DataFrame, path_fig: Path) -> None:
     pass
 
 
-def plot_output(data: DataFrame, var_name: str, path_fig: Path) -> None:
-    func = max if var_name == 'Tleaf' else sum if var_name in ('An', 'E') else None
+def plot_output(cubes: SummaryCubes, var_name: str, path_fig: Path) -> None:
+    """Plots daily sums (An, E) or maxima (Tleaf) of `var_name`, or its hourly values (psi_soil, psi_leaf)."""
+    from matplotlib import pyplot
+
+    daily_column = {'An': 'An', 'E': 'E', 'Tleaf': 'Tleaf_max'}.get(var_name)
     for site in SITES:
         fig, axs = pyplot.subplots(nrows=len(SCEN_CLIM), ncols=len(SCEN_TRAIT), sharex='row', sharey='all',
                                    figsize=(10, 5))
@@ -174,19 +163,17 @@ def plot_output(data: DataFrame, var_name: str, path_fig: Path) -> None:
         for j, trait in enumerate(SCEN_TRAIT):
             for i, clim in enumerate(SCEN_CLIM):
                 for orient in SCEN_ORIENT:
-                    df = data[(data['site'] == site) &
-                              (data['clim'] == clim) &
-                              (data['orient'] == orient) &
-                              (data['trait'] == trait)]
-                    df.set_index('time', inplace=True)
-                    if not df.empty:
-                        if func is not None:
-                            gdf = df.resample('D').aggregate(func)
-                            axs[i, j].plot(gdf.index.day_of_year, gdf[var_name].values, label=get_unit(orient))
-                            # gdf = df.groupby(df['time'].dt.date)[var_name].aggregate(func)
-                            # axs[i, j].plot(range(gdf.index.shape[0]), gdf.values, label=get_unit(orient))
-                        else:
-                            axs[i, j].plot(df.index.values, df[var_name], label=var_name)
+                    if daily_column is not None:
+                        df = cubes.query('daily', columns=('date', daily_column), site=site, clim=clim,
+                                         orient=orient, trait=trait)
+                        if not df.empty:
+                            axs[i, j].plot(df['date'].dt.day_of_year, df[daily_column].values,
+                                           label=get_unit(orient))
+                    else:
+                        df = cubes.query('water_potential', columns=('time', var_name), site=site, clim=clim,
+                                         orient=orient, trait=trait)
+                        if not df.empty:
+                            axs[i, j].plot(df['time'].values, df[var_name], label=var_name)
 
         for j, trait in enumerate(SCEN_TRAIT):
             axs[0, j].set_title(trait)
@@ -204,28 +191,26 @@ def plot_output(data: DataFrame, var_name: str, path_fig: Path) -> None:
     pass
 
 
-def plot_temperature(data: DataFrame, weather: DataFrame, path_fig: Path, func: Callable = None, is_dt: bool = False):
+def plot_temperature(cubes: SummaryCubes, path_fig: Path, stat: str = 'max', is_dt: bool = False):
+    """Plots daily `stat` ('max', 'mean' or 'min') leaf and air temperatures, or their difference."""
+    from matplotlib import pyplot
+
     for site in SITES:
         fig, axs = pyplot.subplots(nrows=len(SCEN_CLIM), ncols=len(SCEN_TRAIT), sharex='row', sharey='all',
                                    figsize=(10, 5))
 
         for j, trait in enumerate(SCEN_TRAIT):
             for i, clim in enumerate(SCEN_CLIM):
-                w = weather[(weather['site'] == site) & (weather['clim'] == clim)]
                 for orient in SCEN_ORIENT:
-                    df = data[(data['site'] == site) &
-                              (data['clim'] == clim) &
-                              (data['orient'] == orient) &
-                              (data['trait'] == trait)]
-                    if not df.empty:
-                        mdf = merge(left=df[['Tleaf', 'time']], right=w[['Tac', 'time']], how='inner').set_index('time')
-                        gdf = mdf.resample('D').aggregate(max if func is None else func)
-                        x = gdf.index.day_of_year
+                    gdf = cubes.query('daily', columns=('date', f'Tleaf_{stat}', f'Tac_{stat}'), site=site,
+                                      clim=clim, orient=orient, trait=trait)
+                    if not gdf.empty:
+                        x = gdf['date'].dt.day_of_year
                         if is_dt:
-                            axs[i, j].plot(x, gdf['Tleaf'] - gdf['Tac'], label=orient)
+                            axs[i, j].plot(x, gdf[f'Tleaf_{stat}'] - gdf[f'Tac_{stat}'], label=orient)
                         else:
-                            axs[i, j].plot(x, gdf['Tleaf'], 'g-', label=orient)
-                            axs[i, j].plot(x, gdf['Tac'], 'b-', label=orient)
+                            axs[i, j].plot(x, gdf[f'Tleaf_{stat}'], 'g-', label=orient)
+                            axs[i, j].plot(x, gdf[f'Tac_{stat}'], 'b-', label=orient)
 
         for j, trait in enumerate(SCEN_TRAIT):
             axs[0, j].set_title(trait)
@@ -237,13 +222,16 @@ def plot_temperature(data: DataFrame, weather: DataFrame, path_fig: Path, func:
             axs[-1, -1].legend()
         else:
             axs[0, 0].set_ylim(-2, 0)
-        fig.suptitle(f'{site.capitalize()}: max daily {"Tleaf-Tair" if is_dt else "Tleaf"}')
+        fig.suptitle(f'{site.capitalize()}: {stat} daily {"Tleaf-Tair" if is_dt else "Tleaf"}')
         fig.tight_layout()
         fig.savefig(path_fig / f'{"dTleaf" if is_dt else "Tleaf"}_{site}.png')
     pass
 
 
 def plot_weather_conditions(weather: DataFrame, path_fig: Path):
+    import matplotlib.dates as mdates
+    from matplotlib import pyplot
+
     weather.set_index('time', inplace=True)
     fig, axs = pyplot.subplots(ncols=len(SCEN_CLIM), nrows=len(SITES), sharex='all', sharey='all')
     for j, clim in enumerate(SCEN_CLIM):
@@ -286,20 +274,21 @@ def plot_weather_conditions(weather: DataFrame, path_fig: Path):
     pass
 
 
-def plot_temperature_data(path_data: Path, path_fig: Path):
+def plot_temperature_data(cubes: SummaryCubes, path_fig: Path):
+    """Plots daily maxima of the 90th percentile of leaf temperature (cube built with `path_temperature_data`)."""
+    from matplotlib import pyplot
+
     fig, axs = pyplot.subplots(nrows=len(SITES), ncols=len(SCEN_CLIM), sharey='all', sharex='all')
 
     traits_ordered = ('baseline', 'high_gmax', 'low_gsp50', 'low_gmax', 'high_gsp50', 'elite')
-    df = read_csv(path_data, sep=';', decimal='.', parse_dates=['dt'])
     for i, site in enumerate(SITES):
         for j, clim in enumerate(SCEN_CLIM):
             ax = axs[i, j]
             for k, trait in enumerate(traits_ordered):
-                pdf = df[(df['site'] == site) & (df['clim'] == clim) & (df['trait'] == trait)]
                 for l, orient in enumerate(SCEN_ORIENT):
                     c = {'north_south': 'yellow', 'northeast_southwest': 'orange', 'east_west': 'red'}[orient]
-                    ppdf = pdf[pdf['orient'] == orient].set_index('dt')
-                    gppdf = ppdf.resample('D').aggregate(max)
+                    gppdf = cubes.query('daily_leaf_temperature', columns=('t_q90',), site=site, clim=clim,
+                                        orient=orient, trait=trait)
                     bp = ax.boxplot(gppdf['t_q90'], positions=[k], patch_artist=True, sym='')
                     for patch, color in zip(bp['boxes'], [c]):
                         patch.set_facecolor(color)
@@ -320,26 +309,40 @@ def plot_temperature_data(path_data: Path, path_fig: Path):
     pass
 
 
+def plot_all(path_time_series: Path, path_fig: Path, path_sims: Path = None, is_rebuild_cubes: bool = False) -> None:
+    """Builds the figures of all scenarios found under `path_time_series` (site/clim/orient/trait/time_series.csv).
+
+    The hourly time series are aggregated into 'summary_cubes.sqlite' (see `analysis.cubes`), which is rebuilt only
+    if missing, older than any time series, or if `is_rebuild_cubes` is True.
+    """
+    path_fig.mkdir(parents=True, exist_ok=True)
+    weather_all = get_weather_data(path_sims=Path(__file__).parents[1] / 'sims' if path_sims is None else path_sims)
+
+    path_cubes = path_time_series / 'summary_cubes.sqlite'
+    if is_rebuild_cubes or is_stale(path_db=path_cubes, paths_sources=path_time_series.glob('*/*/*/*/time_series.csv')):
+        data_all = get_all_time_series(
+            path_time_series=path_time_series,
+            path_output=path_time_series / 'time_series_all.csv')
+        build_summary_cubes(path_db=path_cubes, data=data_all, weather=weather_all)
+    cubes = SummaryCubes(path_db=path_cubes)
+
+    plot_weather_conditions(weather=weather_all, path_fig=path_fig)
+    # plot_temperature_data(cubes=cubes, path_fig=path_fig)
+
+    plot_trait_effect(cubes=cubes, path_fig=path_fig, is_relative=True)
+    plot_trait_effect(cubes=cubes, path_fig=path_fig, is_relative=False)
+    plot_trait_effect(cubes=cubes, path_fig=path_fig, var_name='An', is_relative=True)
+    plot_trait_effect(cubes=cubes, path_fig=path_fig, var_name='An', is_relative=False)
+    # plot_trait_effect(cubes=cubes, path_fig=path_fig, var_name='Tleaf', is_relative=True)
+    # plot_trait_effect(cubes=cubes, path_fig=path_fig, var_name='Tleaf', is_relative=False)
+    plot_water_potential(cubes=cubes, path_fig=path_fig)
+    plot_output(cubes=cubes, var_name='An', path_fig=path_fig)
+    plot_output(cubes=cubes, var_name='E', path_fig=path_fig)
+    # plot_temperature(cubes=cubes, path_fig=path_fig, is_dt=True)
+    # plot_temperature(cubes=cubes, path_fig=path_fig, is_dt=False)
+    pass
+
+
 if __name__ == '__main__':
     path_root = Path(__file__).parent
-    path_figs = path_root / 'figs'
-    path_figs.mkdir(exist_ok=True)
-    weather_all = get_weather_data(path_sims=path_root.parent / 'sims')
-    data_all = get_all_time_series(
-        path_time_series=path_root / 'outputs/time_series',
-        path_output=path_root / 'outputs/time_series/time_series_all.csv')
-
-    plot_weather_conditions(weather=weather_all, path_fig=path_figs)
-    # plot_temperature_data(path_data=path_root / 'outputs/summary_temperature.csv', path_fig=path_figs)
-
-    plot_trait_effect(data=data_all, path_fig=path_figs, is_relative=True)
-    plot_trait_effect(data=data_all, path_fig=path_figs, is_relative=False)
-    plot_trait_effect(data=data_all, path_fig=path_figs, var_name='An', is_relative=True)
-    plot_trait_effect(data=data_all, path_fig=path_figs, var_name='An', is_relative=False)
-    # plot_trait_effect(data=data_all, path_fig=path_figs, var_name='Tleaf', is_relative=True)
-    # plot_trait_effect(data=data_all, path_fig=path_figs, var_name='Tleaf', is_relative=False)
-    plot_water_potential(data=data_all, path_fig=path_figs)
-    plot_output(data=data_all, var_name='An', path_fig=path_figs)
-    plot_output(data=data_all, var_name='E', path_fig=path_figs)
-    # plot_temperature(data=data_all, weather=weather_all, path_fig=path_figs, is_dt=True)
-    # plot_temperature(data=data_all, weather=weather_all, path_fig=path_figs, is_dt=False)
+    plot_all(path_time_series=path_root / 'outputs/time_series', path_fig=path_root / 'figs')
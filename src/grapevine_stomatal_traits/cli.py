@@ -0,0 +1,277 @@
+"""Command-line entry point to preprocess, simulate and analyse (parts of) the scenarios sweep.
+
+Examples:
+    grapevine-traits preprocess --site fresno --jobs 4
+    grapevine-traits simulate --site oakville --clim rcp85 --trait baseline elite --jobs 12 --output-root /data/sims
+    grapevine-traits simulate --dry-run --sec-per-hour 40
+    grapevine-traits simulate --site fresno --jobs auto                  # as many workers as memory allows
+    grapevine-traits analyse --output-root /data/sims --fig-dir figs
+
+    # sweep spread over several hosts sharing /shared
+    grapevine-traits simulate --queue /shared/sweep.sqlite --output-root /shared/sims   # once, submits the tasks
+    grapevine-traits worker --queue /shared/sweep.sqlite --jobs 8                        # on each host
+"""
+
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+
+from grapevine_stomatal_traits.sims.sites import SITES, select_scenarios, count_sampled_hours
+from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits
+
+
+def _parse_jobs(value: str):
+    return value if value == 'auto' else int(value)
+
+
+def _add_scenario_filters(parser: ArgumentParser, is_trait: bool = True):
+    parser.add_argument('--site', nargs='+', choices=list(SITES), help='site names (default: all)')
+    parser.add_argument('--clim', nargs='+', choices=('historical', 'rcp45', 'rcp85'),
+                        help='climate scenarios (default: all)')
+    parser.add_argument('--orient', nargs='+', choices=[s.name for s in ScenariosRowAngle],
+                        help='row orientations (default: all)')
+    if is_trait:
+        parser.add_argument('--trait', nargs='+', choices=[s.name for s in ScenariosTraits],
+                            help='stomatal trait scenarios (default: all)')
+    parser.add_argument('--jobs', type=_parse_jobs, default=1,
+                        help="number of worker processes (default: 1), or 'auto' to start as many as the available "
+                             "memory and cores allow")
+    parser.add_argument('--dry-run', action='store_true', help='list the selected scenarios and estimate their cost')
+    parser.add_argument('--sec-per-hour', type=float, default=None,
+                        help='measured wall time per simulated hour, used to estimate the runtime in dry-run mode')
+    pass
+
+
+def build_parser() -> ArgumentParser:
+    parser = ArgumentParser(prog='grapevine-traits', description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_preprocess = subparsers.add_parser('preprocess', help='build mockups and preprocess static/dynamic inputs')
+    _add_scenario_filters(parser_preprocess, is_trait=False)
+    parser_preprocess.add_argument('--leaf-lod', default=None, choices=('quad', 'hexagon', 'octagon'),
+                                   help='simplified leaf shapes for irradiance (default: detailed leaves)')
+    parser_preprocess.add_argument('--row-plants', type=int, default=None,
+                                   help='also compute the irradiance of each plant of a row of this number of plants '
+                                        '(row-scale mode, default: single plant)')
+    parser_preprocess.add_argument('--reuse-form-factors', action='store_true',
+                                   help='preprocess all row orientations of a site and climate in one task, from '
+                                        'one mockup whose form factors are computed for the first orientation only '
+                                        '(assumes they are invariant under rotation, default: one task and mockup '
+                                        'per orientation)')
+    parser_preprocess.add_argument('--time-step', type=int, default=1, choices=(1, 2, 3, 4, 6, 8, 12, 24),
+                                   help='[h] interval between hours at which irradiance is computed, for screening '
+                                        'runs simulated with the same --time-step and --night-time-step (default: 1)')
+    parser_preprocess.add_argument('--night-time-step', type=int, default=None, choices=(1, 2, 3, 4, 6, 8, 12, 24),
+                                   help='[h] interval between night hours at which irradiance is computed '
+                                        '(default: --time-step)')
+
+    parser_simulate = subparsers.add_parser('simulate', help='run HydroShoot simulations')
+    _add_scenario_filters(parser_simulate)
+    parser_simulate.add_argument('--output-root', type=Path, default=None,
+                                 help='root directory of simulation outputs (default: the cluster data directory)')
+    parser_simulate.add_argument('--queue', type=Path, default=None,
+                                 help='submit the scenarios to this SQLite work queue instead of running them')
+    parser_simulate.add_argument('--memory-profile', action='store_true',
+                                 help='measure memory use per simulation phase (memory_report.json per scenario, '
+                                      'aggregated into memory_reports.csv under the output root)')
+    parser_simulate.add_argument('--no-time-series', action='store_true',
+                                 help='write only the scenario summaries (summary.json), not the hourly time series')
+    parser_simulate.add_argument('--cpu-profile', action='store_true',
+                                 help='run each scenario under cProfile (cpu_profile.prof per scenario, merged into '
+                                      'cpu_profile_merged.prof, cpu_profile_report.txt and cpu_profile_packages.csv '
+                                      'under the output root)')
+    parser_simulate.add_argument('--on-divergence', choices=('flag', 'abort', 'retry'), default='flag',
+                                 help='handling of solver divergence or hydraulic failure: record and continue, stop '
+                                      'the scenario, or retry the hour with tighter settings then stop (outcomes '
+                                      'are appended to manifest.jsonl under the output root, default: flag)')
+    parser_simulate.add_argument('--time-step', type=int, default=1, choices=(1, 2, 3, 4, 6, 8, 12, 24),
+                                 help='[h] interval between simulated hours, for screening runs (default: 1)')
+    parser_simulate.add_argument('--night-time-step', type=int, default=None, choices=(1, 2, 3, 4, 6, 8, 12, 24),
+                                 help='[h] interval between simulated night hours (daylight-weighted sampling, '
+                                      'default: --time-step)')
+    parser_simulate.add_argument('--row-scale', action='store_true',
+                                 help='simulate every plant of rows preprocessed with --row-plants (per-plant '
+                                      'outputs)')
+
+    parser_worker = subparsers.add_parser('worker', help='run scenarios claimed from a work queue')
+    parser_worker.add_argument('--queue', type=Path, required=True, help='SQLite work queue file')
+    parser_worker.add_argument('--jobs', type=int, default=1, help='number of worker processes (default: 1)')
+    parser_worker.add_argument('--stale-after', type=float, default=600.,
+                               help='[s] delay without heartbeat after which a claimed scenario is reclaimed')
+    parser_worker.add_argument('--status', action='store_true', help='print the queue status and exit')
+
+    parser_analyse = subparsers.add_parser('analyse', help='plot simulation outputs')
+    parser_analyse.add_argument('--output-root', type=Path, required=True,
+                                help='root directory of simulation outputs (site/clim/orient/trait/time_series.csv)')
+    parser_analyse.add_argument('--fig-dir', type=Path, default=Path('figs'), help='output directory of figures')
+    parser_analyse.add_argument('--rebuild-cubes', action='store_true',
+                                help='rebuild the summary cubes (summary_cubes.sqlite) even if up to date')
+    return parser
+
+
+def estimate_cost(scenarios: list, nb_jobs: int, sec_per_hour: float = None, time_step: int = 1,
+                  night_time_step: int = None) -> None:
+    total_hours = 0
+    for site, scenario_dates, scenario_angle, scenario_traits in scenarios:
+        nb_hours = count_sampled_hours(scenario_dates[1], time_step=time_step, night_time_step=night_time_step,
+                                       path_weather=site.get_path_weather(scenario_dates[0]))
+        total_hours += nb_hours
+        print(f'{site.name}\t{scenario_dates[0]}\t{scenario_angle.name}\t{scenario_traits.name}\t{nb_hours} h')
+    print(f'{len(scenarios)} scenarios, {total_hours} simulated hours, {nb_jobs} worker(s)')
+    if sec_per_hour is not None:
+        nb_jobs = cpu_count() if nb_jobs == 'auto' else nb_jobs
+        runtime = total_hours * sec_per_hour / min(nb_jobs, max(len(scenarios), 1))
+        print(f'estimated wall time: {runtime / 3600.:.1f} h (at {sec_per_hour} s per simulated hour)')
+    pass
+
+
+def _run_pool(func, args: list, nb_jobs, tasks: list = None) -> None:
+    """Runs `func(*arg)` for each of `args`, in `nb_jobs` processes or, if `nb_jobs` is 'auto', with the
+    memory-aware scheduler (`tasks` are then the scheduler tasks, default: one group with the default estimate, of
+    which at most `MAX_UNMEASURED_TASKS` run before a peak RSS is measured).
+
+    Raises:
+        SystemExit: if any task failed (non-zero exit status)
+    """
+    if nb_jobs == 'auto':
+        from grapevine_stomatal_traits.sims.scheduler import (MemoryAwareScheduler, BASE_RSS, MAX_UNMEASURED_TASKS,
+                                                               count_failures)
+
+        nb_failed = count_failures(
+            MemoryAwareScheduler(max_unmeasured=None if tasks else MAX_UNMEASURED_TASKS).run(
+                func=func, tasks=tasks or [('default', tuple(arg), BASE_RSS) for arg in args]))
+        if nb_failed:
+            raise SystemExit(f'{nb_failed} of {len(args)} tasks failed')
+    elif nb_jobs > 1:
+        with Pool(nb_jobs) as p:
+            p.starmap(func, args)
+    else:
+        for arg in args:
+            func(*arg)
+    pass
+
+
+def preprocess(args: Namespace) -> None:
+    scenarios = select_scenarios(sites=args.site, climates=args.clim, orientations=args.orient,
+                                 traits=[ScenariosTraits.baseline.name])
+    if args.dry_run:
+        estimate_cost(scenarios=scenarios, nb_jobs=args.jobs, sec_per_hour=args.sec_per_hour,
+                      time_step=args.time_step, night_time_step=args.night_time_step)
+    else:
+        from grapevine_stomatal_traits.sims.preprocess_functions import preprocess_scenarios
+
+        # with --reuse-form-factors, all orientations of a site and climate are preprocessed in one task, from one
+        # mockup and its form factors; otherwise each orientation is a task of its own, with its own mockup
+        grouped = {}
+        for site, scenario_dates, scenario_angle, _ in scenarios:
+            key = (site.name, scenario_dates[0]) + (() if args.reuse_form_factors else (scenario_angle.name,))
+            grouped.setdefault(key, (site, scenario_dates, []))[2].append(scenario_angle)
+        _run_pool(
+            func=preprocess_scenarios,
+            args=[(site.path_root, site.get_site_data(scenario_dates[1]), scenario_dates[0], scenario_angles,
+                   args.reuse_form_factors, args.leaf_lod, args.row_plants, (),
+                   args.time_step, args.night_time_step)
+                  for site, scenario_dates, scenario_angles in grouped.values()],
+            nb_jobs=args.jobs)
+    pass
+
+
+def simulate(args: Namespace) -> None:
+    scenarios = select_scenarios(sites=args.site, climates=args.clim, orientations=args.orient, traits=args.trait)
+    if args.dry_run:
+        estimate_cost(scenarios=scenarios, nb_jobs=args.jobs, sec_per_hour=args.sec_per_hour,
+                      time_step=args.time_step, night_time_step=args.night_time_step)
+    elif args.queue is not None:
+        from grapevine_stomatal_traits.sims.work_queue import WorkQueue
+
+        queue = WorkQueue(path_db=args.queue)
+        nb_added = queue.submit({
+            '/'.join((site.name, scenario_dates[0], scenario_angle.name, scenario_traits.name)): {
+                'site': site.name,
+                'clim': scenario_dates[0],
+                'orient': scenario_angle.name,
+                'trait': scenario_traits.name,
+                'output_root': None if args.output_root is None else str(args.output_root.resolve()),
+                'is_memory_profile': args.memory_profile,
+                'is_write_time_series': not args.no_time_series,
+                'is_cpu_profile': args.cpu_profile,
+                'divergence_policy': args.on_divergence,
+                'time_step': args.time_step,
+                'night_time_step': args.night_time_step,
+                'is_row_scale': args.row_scale}
+            for site, scenario_dates, scenario_angle, scenario_traits in scenarios})
+        print(f'{nb_added} scenarios added to {args.queue}: {queue.count()}')
+    else:
+        from grapevine_stomatal_traits.sims.sim_functions import PATH_OUTPUT_ROOT_DEFAULT, run_simulations
+
+        path_output_root = PATH_OUTPUT_ROOT_DEFAULT if args.output_root is None else args.output_root
+        sim_args = [(site.path_root, scenario_dates, scenario_angle, scenario_traits, args.output_root,
+                     None, args.memory_profile, not args.no_time_series, args.cpu_profile,
+                     args.on_divergence, args.time_step, args.night_time_step, args.row_scale)
+                    for site, scenario_dates, scenario_angle, scenario_traits in scenarios]
+        tasks = None
+        if args.jobs == 'auto':
+            from pandas import read_csv
+
+            from grapevine_stomatal_traits.sims.scheduler import build_simulation_tasks
+
+            path_memory_reports = path_output_root / 'memory_reports.csv'
+            tasks = build_simulation_tasks(
+                sim_args=sim_args,
+                memory_reports=read_csv(path_memory_reports, sep=';', decimal='.')
+                if path_memory_reports.exists() else None)
+        time_on = datetime.now()
+        _run_pool(func=run_simulations, args=sim_args, nb_jobs=args.jobs, tasks=tasks)
+        if args.memory_profile:
+            from grapevine_stomatal_traits.simulator.memory import aggregate_memory_reports
+
+            aggregate_memory_reports(path_root=path_output_root).to_csv(
+                path_output_root / 'memory_reports.csv', sep=';', decimal='.', index=False)
+        if args.cpu_profile:
+            from grapevine_stomatal_traits.simulator.profiling import merge_cpu_profiles
+
+            merge_cpu_profiles(path_root=path_output_root, since=time_on.timestamp())
+    pass
+
+
+def _run_worker(path_db: Path, stale_after: float) -> int:
+    from grapevine_stomatal_traits.sims.sim_functions import run_scenario
+    from grapevine_stomatal_traits.sims.work_queue import run_worker
+
+    return run_worker(path_db=path_db, func=run_scenario, stale_after=stale_after,
+                      heartbeat_interval=min(30., stale_after / 4.))
+
+
+def worker(args: Namespace) -> None:
+    from grapevine_stomatal_traits.sims.work_queue import WorkQueue
+
+    if args.status:
+        queue = WorkQueue(path_db=args.queue)
+        print(queue.count())
+        for key, status, worker_id, attempts, _, error in queue.get_tasks():
+            if status != 'done':
+                print(f'{key}\t{status}\t{worker_id}\t{attempts}\t{(error or "").strip().splitlines()[-1:]}')
+    else:
+        _run_pool(func=_run_worker, args=[(args.queue, args.stale_after)] * args.jobs, nb_jobs=args.jobs)
+    pass
+
+
+def analyse(args: Namespace) -> None:
+    from grapevine_stomatal_traits.analysis.plots import plot_all
+
+    plot_all(path_time_series=args.output_root, path_fig=args.fig_dir, is_rebuild_cubes=args.rebuild_cubes)
+    pass
+
+
+def main(argv: list = None) -> None:
+    args = build_parser().parse_args(argv)
+    time_on = datetime.now()
+    {'preprocess': preprocess, 'simulate': simulate, 'worker': worker, 'analyse': analyse}[args.command](args)
+    time_off = datetime.now()
+    print(f"--- Total runtime: {(time_off - time_on).seconds} sec ---")
+    pass
+
+
+if __name__ == '__main__':
+    main()
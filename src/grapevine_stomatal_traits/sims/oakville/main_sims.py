@@ -1,26 +1,30 @@
+import sys
 from datetime import datetime
 from itertools import product
-from multiprocessing import Pool
 from pathlib import Path
 from typing import Iterable
 
 from grapevine_stomatal_traits.sims.oakville.config import ScenariosDatesOakville
+from grapevine_stomatal_traits.sims.scheduler import MemoryAwareScheduler, build_simulation_tasks, count_failures
 from grapevine_stomatal_traits.sims.sim_functions import run_simulations
 from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits
 
 
-def run_sims(args):
-    return run_simulations(*args)
+def mp(sim_args: Iterable, nb_cpu: int = None) -> int:
+    """Runs the simulations on as many cores as the available memory allows (at most `nb_cpu`, default: all).
 
-
-def mp(sim_args: Iterable, nb_cpu: int = 2):
-    with Pool(nb_cpu) as p:
-        p.map(run_sims, sim_args)
+    Returns:
+        the number of failed simulations
+    """
+    return count_failures(
+        MemoryAwareScheduler(max_workers=nb_cpu).run(func=run_simulations, tasks=build_simulation_tasks(sim_args)))
 
 
 if __name__ == '__main__':
     time_on = datetime.now()
-    mp(sim_args=product([Path(__file__).parent.resolve()], ScenariosDatesOakville, ScenariosRowAngle, ScenariosTraits),
-       nb_cpu=12)
+    nb_failed = mp(
+        sim_args=product([Path(__file__).parent.resolve()], ScenariosDatesOakville, ScenariosRowAngle, ScenariosTraits))
     time_off = datetime.now()
     print(f"--- Total runtime: {(time_off - time_on).seconds} sec ---")
+    if nb_failed:
+        sys.exit(f'{nb_failed} simulations failed')
@@ -1,23 +1,54 @@
+from copy import deepcopy
 from json import dump, load
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from hydroshoot import io, initialisation
 from hydroshoot.architecture import vine_orientation, mtg_save_geometry, save_mtg
-from hydroshoot.display import visu
 from openalea.mtg import mtg
-from openalea.plantgl.scenegraph import Scene
 
-from grapevine_stomatal_traits.sources.config import SiteData
+from grapevine_stomatal_traits.simulator.canopy import LeafIndex, LeafIrradiance, LeafStaticInputs, calc_file_checksum
+from grapevine_stomatal_traits.simulator.clustering import LeafClusters
+from grapevine_stomatal_traits.simulator.output_writer import AsyncWriter
+from grapevine_stomatal_traits.simulator.row import RowLayout, build_row_scene
+from grapevine_stomatal_traits.simulator.time_step import TimeSampling
+from grapevine_stomatal_traits.simulator.weather import HourlyForcing
+from grapevine_stomatal_traits.sources.config import SiteData, ScenariosRowAngle, ScenariosTraits
+from grapevine_stomatal_traits.sources.mockups.leaf_lod import build_radiation_scene, use_radiation_geometry
 from grapevine_stomatal_traits.sources.mockups.main_mockups import build_mtg
 
+if TYPE_CHECKING:
+    from openalea.plantgl.scenegraph import Scene
+
 PATH_PARAMS_BASE = Path(__file__).parent / 'params_base.json'
 
 FMT_DATES = '%Y-%m-%d %H:%M:%S'
 
 
 def preprocess_inputs(grapevine_mtg: mtg.MTG, path_project_dir: Path, path_preprocessed_inputs_dir: Path,
-                      path_weather: Path, psi_soil: float, scene: Scene, is_write_hourly_dynamic: bool = False,
-                      **kwargs):
+                      path_weather: Path, psi_soil: float, scene: 'Scene', is_write_hourly_dynamic: bool = False,
+                      nb_leaf_clusters: tuple = (), time_sampling: TimeSampling = None,
+                      nb_row_plants: int = None, **kwargs) -> LeafStaticInputs:
+    """Computes and writes the static (form factors, nitrogen) and dynamic (leaf irradiance) inputs of a mockup, and
+    its initialised mtg ('initial_mtg.pckl').
+
+    Leaf irradiance is computed with the leaf level of detail of the mockup, if any (see `sources.mockups.leaf_lod`).
+
+    Args:
+        scene: detailed scene of the mockup
+        nb_leaf_clusters: numbers of leaf clusters for which the reduced-canopy clusters are computed and written
+            ('leaf_clusters_<n>.npz'), see `simulator.clustering`
+        time_sampling: hours at which leaf irradiance is computed (default: all), for coarse time-step screening
+            runs using the same sampling (see `simulator.time_step`)
+        nb_row_plants: if provided, irradiance is computed for a row of this number of plants instancing the mockup
+            (see `simulator.row`), the leaf irradiance of the plants other than the reference (middle) one being
+            written to 'dynamic_plant_<i>.json' and the layout of the row to 'row_layout.json'; the infinite-canopy
+            lattice then replicates the whole row
+        kwargs: passed to `io.HydroShootInputs`, e.g. precomputed `form_factors`, which are then not recomputed
+
+    Returns:
+        static inputs of the mockup
+    """
     path_preprocessed_inputs_dir.mkdir(parents=True, exist_ok=True)
 
     inputs = io.HydroShootInputs(
@@ -31,39 +62,100 @@ def preprocess_inputs(grapevine_mtg: mtg.MTG, path_project_dir: Path, path_prepr
     io.verify_inputs(g=grapevine_mtg, inputs=inputs)
     grapevine_mtg = initialisation.init_model(g=grapevine_mtg, inputs=inputs)
 
-    static_data = {'form_factors': {s: grapevine_mtg.property(s) for s in ('ff_sky', 'ff_leaves', 'ff_soil')}}
-    static_data.update({'Na': grapevine_mtg.property('Na')})
+    save_mtg(g=grapevine_mtg, scene=scene, file_path=path_preprocessed_inputs_dir, filename='initial_mtg.pckl')
 
-    with open(path_preprocessed_inputs_dir / 'static.json', mode='w') as f:
-        dump(static_data, f, indent=2)
+    mtg_checksum = calc_file_checksum(path_preprocessed_inputs_dir / 'initial_mtg.pckl')
+    static_inputs = LeafStaticInputs.from_mtg(g=grapevine_mtg)
+    static_inputs.save(path_file=path_preprocessed_inputs_dir / 'static.npz', mtg_checksum=mtg_checksum)
 
-    save_mtg(g=grapevine_mtg, scene=scene, file_path=path_preprocessed_inputs_dir, filename='initial_mtg.pckl')
+    # irradiance is computed on simplified leaves (leaf level of detail) and, in row-scale mode, on the whole row
+    radiation_scene = build_radiation_scene(g=grapevine_mtg, scene=scene)
+    radiation_properties = None
+    radiation_params = inputs.params
+    row_layout = None
+    if nb_row_plants is not None:
+        with open(path_project_dir / 'params.json', mode='r') as f:
+            row_layout = RowLayout.from_params(g=grapevine_mtg, nb_plants=nb_row_plants, params=load(f))
+        radiation_scene = build_row_scene(scene=radiation_scene, layout=row_layout)
+        radiation_properties = {'label': row_layout.mirror(grapevine_mtg.property('label'))}
+        # HydroShoot replicates the scene on a lattice set from the planting spacing (infinite canopy): the spacing on
+        # the row is stretched to the row extent so that the explicit neighbours are not replicated on top of the
+        # neighbours of the lattice (see `simulator.row`)
+        radiation_params = deepcopy(inputs.params)
+        radiation_params.planting.spacing_on_row = row_layout.calc_pattern_spacing(
+            spacing_on_row=inputs.params.planting.spacing_on_row)
 
-    dynamic_data = {}
+    dynamic_data = None
+    row_dynamic_data = {}
+    date_range = inputs.params.simulation.date_range
+    forcing = HourlyForcing(weather=inputs.weather, dates=date_range)
+    samples, _ = (TimeSampling() if time_sampling is None else time_sampling).sample(
+        dates=date_range, is_night=forcing.is_night)
     inputs_hourly = io.HydroShootHourlyInputs(psi_soil=inputs.psi_soil_forced, sun2scene=inputs.sun2scene)
-    for date_sim in inputs.params.simulation.date_range:
-        print(date_sim)
-        inputs_hourly.update(
-            g=grapevine_mtg, date_sim=date_sim, hourly_weather=inputs.weather[inputs.weather.index == date_sim],
-            psi_pd=inputs.psi_pd, params=inputs.params)
 
-        grapevine_mtg, diffuse_to_total_irradiance_ratio = initialisation.init_hourly(
-            g=grapevine_mtg, inputs_hourly=inputs_hourly, leaf_ppfd=inputs.leaf_ppfd,
-            params=inputs.params)
+    # pending writes are drained and the writer thread stopped also when the hourly loop fails
+    with AsyncWriter() as writer, use_radiation_geometry(
+            g=grapevine_mtg, scene=radiation_scene, properties=radiation_properties):
+        for i_date in samples.tolist():
+            date_sim = date_range[i_date]
+            print(date_sim)
+            inputs_hourly.update(
+                g=grapevine_mtg, date_sim=date_sim, hourly_weather=forcing.get_weather(i_date),
+                psi_pd=inputs.psi_pd, params=inputs.params)
+
+            # the sky and sun discretisation is rebuilt by HydroShoot at each hour: it is cheap next to the scene
+            # projection, and `init_hourly` takes no precomputed sky, so it is not cached per site
+            grapevine_mtg, diffuse_to_total_irradiance_ratio = initialisation.init_hourly(
+                g=grapevine_mtg, inputs_hourly=inputs_hourly, leaf_ppfd=inputs.leaf_ppfd, params=radiation_params)
+
+            if row_layout is not None:
+                # irradiance of neighbour plants is split from that of the reference plant, which stays on the mtg
+                row_values = {}
+                for name in ('Ei', 'Eabs'):
+                    prop = grapevine_mtg.property(name)
+                    row_values[name] = row_layout.split(prop)
+                    prop.clear()
+                    prop.update(row_values[name].pop(row_layout.reference_plant))
+                for plant in row_values['Ei']:
+                    if plant not in row_dynamic_data:
+                        row_dynamic_data[plant] = LeafIrradiance.empty(
+                            leaf_index=LeafIndex(vids=grapevine_mtg.property('Ei').keys()),
+                            dates=[d.strftime('%Y%m%d%H%M%S') for d in date_range[samples]])
+                    row_dynamic_data[plant].set_hour(
+                        date=grapevine_mtg.date,
+                        diffuse_to_total_irradiance_ratio=diffuse_to_total_irradiance_ratio,
+                        Ei=row_values['Ei'][plant],
+                        Eabs=row_values['Eabs'][plant])
+
+            if dynamic_data is None:
+                dynamic_data = LeafIrradiance.empty(
+                    leaf_index=LeafIndex(vids=grapevine_mtg.property('Ei').keys()),
+                    dates=[d.strftime('%Y%m%d%H%M%S') for d in date_range[samples]])
+            dynamic_data.set_hour(
+                date=grapevine_mtg.date,
+                diffuse_to_total_irradiance_ratio=diffuse_to_total_irradiance_ratio,
+                Ei=grapevine_mtg.property('Ei'),
+                Eabs=grapevine_mtg.property('Eabs'))
 
-        dynamic_data_per_date = {
-            'diffuse_to_total_irradiance_ratio': diffuse_to_total_irradiance_ratio,
-            'Ei': grapevine_mtg.property('Ei'),
-            'Eabs': grapevine_mtg.property('Eabs')}
+            if is_write_hourly_dynamic:
+                writer.write_json(path_file=path_preprocessed_inputs_dir / f'dynamic_{grapevine_mtg.date}.json',
+                                  data=dynamic_data[grapevine_mtg.date], indent=2)
 
-        if is_write_hourly_dynamic:
-            with open(path_preprocessed_inputs_dir / f'dynamic_{grapevine_mtg.date}.json', mode='w') as f:
-                dump(dynamic_data_per_date, f, indent=2)
+        writer.write_json(path_file=path_preprocessed_inputs_dir / f'dynamic.json', data=dynamic_data.to_dict(),
+                          indent=2)
+        if row_layout is not None:
+            writer.write_json(path_file=path_preprocessed_inputs_dir / 'row_layout.json', data=row_layout.to_dict(),
+                              indent=2)
+        for plant, plant_dynamic_data in row_dynamic_data.items():
+            writer.write_json(path_file=path_preprocessed_inputs_dir / f'dynamic_plant_{plant}.json',
+                              data=plant_dynamic_data.to_dict(), indent=2)
 
-        dynamic_data.update({grapevine_mtg.date: dynamic_data_per_date})
+    for nb_clusters in nb_leaf_clusters:
+        LeafClusters.from_inputs(
+            g=grapevine_mtg, static_inputs=static_inputs, leaf_irradiance=dynamic_data, nb_clusters=nb_clusters
+        ).save(path_file=path_preprocessed_inputs_dir / f'leaf_clusters_{nb_clusters}.npz', mtg_checksum=mtg_checksum)
 
-    with open(path_preprocessed_inputs_dir / f'dynamic.json', mode='w') as f:
-        dump(dynamic_data, f, indent=2)
+    return static_inputs
 
 
 def prepare_params(site_data: SiteData, stomatal_params: dict, scene_rotation: float) -> dict:
@@ -105,21 +197,59 @@ def set_initial_predawn_soil_water_potential(path_project_dir: Path, site_data:
     pass
 
 
-def prepare_mtg(path_digit: Path, training_system: str, rotation_angle: float, is_leaf_follow_cordon: bool = True):
-    g = build_mtg(
-        path_csv=path_digit,
-        training_system_name=training_system,
-        is_cordon_preferential_orientation=is_leaf_follow_cordon)
+def copy_mtg(g: mtg.MTG) -> mtg.MTG:
+    """Returns a copy of the mockup: topology and properties are deep-copied, except for PlantGL shapes, which are
+    cloned by PlantGL instead of being walked through by `deepcopy`."""
+    geometry = g.property('geometry')
+    g_copy = deepcopy(g, memo={id(geometry): {}})
+    g_copy.properties()['geometry'] = {vid: shape.deepcopy() for vid, shape in geometry.items()}
+    return g_copy
+
+
+def rotate_mtg(g: mtg.MTG, rotation_angle: float) -> mtg.MTG:
+    """Rotates, in place, the whole mockup about the vertical axis."""
     for v in mtg.traversal.iter_mtg2(g, g.root):
         vine_orientation(g, v, rotation_angle, local_rotation=False)
     return g
 
 
+def prepare_mtg(path_digit: Path, training_system: str, rotation_angle: float, is_leaf_follow_cordon: bool = True,
+                leaf_lod: str = None):
+    g = build_mtg(
+        path_csv=path_digit,
+        training_system_name=training_system,
+        is_cordon_preferential_orientation=is_leaf_follow_cordon,
+        leaf_lod=leaf_lod)
+    return rotate_mtg(g=g, rotation_angle=rotation_angle)
+
+
+def get_path_digit(path_root: Path, training_system: str) -> Path:
+    return path_root.parents[1] / f'sources/mockups/{training_system}/virtual_digit.csv'
+
+
 def preprocess_inputs_and_params(path_root: Path, path_preprocessed_dir: Path,
                                  site_data: SiteData, weather_file_name: str,
-                                 stomatal_params: dict, row_angle_from_south: float):
+                                 stomatal_params: dict, row_angle_from_south: float,
+                                 grapevine_mtg: mtg.MTG = None, form_factors: dict = None,
+                                 leaf_lod: str = None, nb_row_plants: int = None,
+                                 nb_leaf_clusters: tuple = (), time_sampling: TimeSampling = None) -> LeafStaticInputs:
+    """Writes the parameters and preprocessed inputs of one scenario.
+
+    Args:
+        grapevine_mtg: mockup already rotated by `row_angle_from_south` (default: built from the training system)
+        form_factors: precomputed form factors of `grapevine_mtg` (default: computed)
+        leaf_lod: leaf level of detail for irradiance, when the mockup is built here (otherwise that of
+            `grapevine_mtg`), see `sources.mockups.leaf_lod`
+        nb_row_plants: if provided, irradiance is also computed for the plants of a row of this size (see
+            `simulator.row`)
+        nb_leaf_clusters: numbers of leaf clusters for which reduced-canopy clusters are written (see
+            `simulator.clustering`)
+        time_sampling: hours at which leaf irradiance is computed (default: all), see `simulator.time_step`
+
+    Returns:
+        static inputs of the mockup
+    """
     training_system = site_data.training_system
-    path_digit = path_root.parents[1] / f'sources/mockups/{training_system}/virtual_digit.csv'
 
     path_preprocessed_dir.mkdir(parents=True, exist_ok=True)
 
@@ -131,14 +261,18 @@ def preprocess_inputs_and_params(path_root: Path, path_preprocessed_dir: Path,
     set_initial_predawn_soil_water_potential(
         path_project_dir=path_preprocessed_dir,
         site_data=site_data)
-    grapevine_mtg = prepare_mtg(
-        path_digit=path_digit,
-        training_system=training_system,
-        rotation_angle=row_angle_from_south)
+    if grapevine_mtg is None:
+        grapevine_mtg = prepare_mtg(
+            path_digit=get_path_digit(path_root=path_root, training_system=training_system),
+            training_system=training_system,
+            rotation_angle=row_angle_from_south,
+            leaf_lod=leaf_lod)
+    from hydroshoot.display import visu
+    from openalea.plantgl.scenegraph import Scene
     scene = visu(grapevine_mtg, def_elmnt_color_dict=True, scene=Scene(), view_result=False)
     mtg_save_geometry(scene=scene, file_path=path_preprocessed_dir)
 
-    preprocess_inputs(
+    return preprocess_inputs(
         grapevine_mtg=grapevine_mtg,
         path_project_dir=path_preprocessed_dir,
         path_preprocessed_inputs_dir=path_preprocessed_dir,
@@ -146,4 +280,71 @@ def preprocess_inputs_and_params(path_root: Path, path_preprocessed_dir: Path,
         gdd_since_budbreak=site_data.gdd_since_budbreak,
         psi_soil=0,
         scene=scene,
-        is_write_hourly_dynamic=True)
+        is_write_hourly_dynamic=True,
+        nb_row_plants=nb_row_plants,
+        nb_leaf_clusters=nb_leaf_clusters,
+        time_sampling=time_sampling,
+        **({} if form_factors is None else {'form_factors': form_factors}))
+
+
+def preprocess_scenarios(path_root: Path, site_data: SiteData, climate_scenario: str, scenario_angles: list,
+                         is_reuse_form_factors: bool = False, leaf_lod: str = None, nb_row_plants: int = None,
+                         nb_leaf_clusters: tuple = (), time_step: int = 1, night_time_step: int = None):
+    """Preprocesses all row orientations of a climate scenario from a single mockup.
+
+    The mockup is built once, then copied (`copy_mtg`) and rotated about the vertical axis for each orientation, so
+    that all orientations given here share the same (randomly generated) mockup. This differs from preprocessing each
+    orientation separately (`preprocess_scenario`), where each one gets its own random mockup: differences between
+    orientations then no longer include differences between mockups. The site scripts and the command line keep one
+    call, hence one mockup, per orientation unless form factors are reused.
+
+    Under an isotropic sky, sky, leaf and soil form factors of an isolated plant do not depend on its orientation, and
+    can then be computed for the first orientation only and reused for the others, whose preprocessing is reduced to
+    irradiance (and leaf nitrogen, which depends on it). This is not the default: HydroShoot computes form factors
+    within a canopy replicated on a lattice fixed to the scene axes (`irradiance.pattern`, from the planting
+    spacing), so that rotating the plant moves it relative to its neighbours and may change its form factors. The
+    reuse is only exact for a lattice with the symmetry of the rotation, which has not been checked.
+
+    Args:
+        scenario_angles: row orientation scenarios
+        is_reuse_form_factors: if True, form factors of the first orientation are reused for the others
+        leaf_lod: leaf level of detail for irradiance, e.g. 'quad' (default: detailed leaves), see
+            `sources.mockups.leaf_lod`
+        nb_row_plants: if provided, irradiance is also computed for the plants of a row of this size, which
+            instance the mockup (see `simulator.row`)
+        nb_leaf_clusters: numbers of leaf clusters for which reduced-canopy clusters are written (see
+            `simulator.clustering`)
+        time_step: [h] interval between the hours at which leaf irradiance is computed, for screening runs
+            simulated with the same sampling (see `simulator.time_step`)
+        night_time_step: [h] interval between night hours at which leaf irradiance is computed (default: `time_step`)
+    """
+    base_mtg = build_mtg(
+        path_csv=get_path_digit(path_root=path_root, training_system=site_data.training_system),
+        training_system_name=site_data.training_system,
+        is_cordon_preferential_orientation=True,
+        leaf_lod=leaf_lod)
+
+    form_factors = None
+    for scenario_angle in scenario_angles:
+        path_preprocessed_dir = path_root / 'preprocessed_inputs' / climate_scenario / scenario_angle.name
+        static_inputs = preprocess_inputs_and_params(
+            path_root=path_root,
+            path_preprocessed_dir=path_preprocessed_dir,
+            site_data=site_data,
+            weather_file_name=f'weather_{path_root.stem}_{climate_scenario}.csv',
+            stomatal_params=ScenariosTraits.baseline.value,
+            row_angle_from_south=scenario_angle.value,
+            grapevine_mtg=rotate_mtg(g=copy_mtg(base_mtg), rotation_angle=scenario_angle.value),
+            form_factors=form_factors,
+            nb_row_plants=nb_row_plants,
+            nb_leaf_clusters=nb_leaf_clusters,
+            time_sampling=TimeSampling(step=time_step, night_step=night_time_step))
+        if is_reuse_form_factors:
+            form_factors = static_inputs.form_factors
+    pass
+
+
+def preprocess_scenario(path_root: Path, site_data: SiteData, climate_scenario: str,
+                        scenario_angle: ScenariosRowAngle):
+    preprocess_scenarios(path_root=path_root, site_data=site_data, climate_scenario=climate_scenario,
+                         scenario_angles=[scenario_angle])
@@ -0,0 +1,185 @@
+"""Memory-aware scheduling of scenarios over the cores of one node.
+
+Instead of a fixed pool size, each scenario is started in its own process only when its estimated peak resident
+memory (RSS) fits in the memory currently available, after reserving the expected further growth of the scenarios
+already running. Estimates start from past memory reports or from the size of the preprocessed inputs, and are
+updated per scenario group (e.g. site, hence mockup type) with the peak RSS measured in each finished process.
+
+Example:
+    scheduler = MemoryAwareScheduler()
+    results = scheduler.run(func=run_simulations, tasks=build_simulation_tasks(sim_args))
+    if count_failures(results):
+        sys.exit(1)
+"""
+
+import resource
+import traceback
+from multiprocessing import Process, Pipe, cpu_count
+from os import sysconf
+from pathlib import Path
+from time import sleep
+from typing import Callable, Iterable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
+
+BASE_RSS = 400.  # [MB] interpreter, HydroShoot and PlantGL imports
+JSON_MEMORY_FACTOR = 6.  # [-] in-memory size of JSON-loaded inputs relative to their file size
+PICKLE_MEMORY_FACTOR = 4.  # [-] in-memory size of unpickled mtgs relative to their file size
+MAX_UNMEASURED_TASKS = 4  # [-] concurrent tasks of a group whose estimate is a guess, until one has been measured
+
+
+def get_available_memory() -> float:
+    """Returns the memory available for new processes [MB]."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+    return sysconf('SC_AVPHYS_PAGES') * sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+def get_process_rss(pid: int) -> float:
+    """Returns the current RSS of process `pid` [MB], or 0 if it cannot be read."""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        return 0.
+
+
+def estimate_peak_rss(path_preprocessed_dir: Path, memory_reports: 'DataFrame' = None, group: str = None) -> float:
+    """Estimates the peak RSS of a simulation [MB].
+
+    Args:
+        path_preprocessed_dir: preprocessed inputs of the scenario
+        memory_reports: aggregated memory reports of past runs (see `simulator.memory.aggregate_memory_reports`),
+            whose largest peak RSS for `group` is used when available
+        group: scenario group, matched against the 'site' column of `memory_reports`
+
+    Returns:
+        the estimated peak RSS, from past reports or else from the size of the preprocessed inputs
+    """
+    if memory_reports is not None and group is not None and not memory_reports.empty:
+        observed = memory_reports.loc[memory_reports['site'] == group, 'rss_peak']
+        if not observed.empty:
+            return float(observed.max())
+
+    def _size(file_name: str) -> float:
+        path_file = Path(path_preprocessed_dir) / file_name
+        return path_file.stat().st_size / 2 ** 20 if path_file.exists() else 0.
+
+    return (BASE_RSS + JSON_MEMORY_FACTOR * (_size('dynamic.json') + _size('static.json')) +
+            PICKLE_MEMORY_FACTOR * (_size('initial_mtg.pckl') + _size('geometry.bgeom')))
+
+
+def build_simulation_tasks(sim_args: Iterable, memory_reports: 'DataFrame' = None) -> list:
+    """Returns the scheduler tasks of `run_simulations` arguments (path_root, scenario_dates, scenario_angle, ...),
+    grouped by site."""
+    res = []
+    for args in sim_args:
+        path_root, scenario_dates, scenario_angle = args[:3]
+        res.append((path_root.name, tuple(args), estimate_peak_rss(
+            path_preprocessed_dir=path_root / 'preprocessed_inputs' / scenario_dates[0] / scenario_angle.name,
+            memory_reports=memory_reports,
+            group=path_root.name)))
+    return res
+
+
+def count_failures(results: list) -> int:
+    """Returns the number of failed tasks among `MemoryAwareScheduler.run` results."""
+    return sum(error is not None for *_, error in results)
+
+
+def _run_task(func: Callable, args: tuple, conn):
+    error = None
+    try:
+        func(*args)
+    except Exception:
+        error = traceback.format_exc()
+    conn.send((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10, error))
+    conn.close()
+    pass
+
+
+class MemoryAwareScheduler(object):
+    def __init__(self, max_workers: int = None, memory_reserve: float = 1024., safety_factor: float = 1.2,
+                 poll_interval: float = 5., max_unmeasured: int = None):
+        """
+        Args:
+            max_workers: maximum number of concurrent processes (default: number of cores)
+            memory_reserve: [MB] memory left free for the system and the scheduler
+            safety_factor: [-] multiplier of peak RSS estimates
+            poll_interval: [s] delay between two checks of running processes and available memory
+            max_unmeasured: maximum number of concurrent processes of a group for which no peak RSS has been measured
+                yet (default: `max_workers`), for tasks whose estimates are rough (e.g. `BASE_RSS` only)
+        """
+        self.max_workers = cpu_count() if max_workers is None else max_workers
+        self.memory_reserve = memory_reserve
+        self.safety_factor = safety_factor
+        self.poll_interval = poll_interval
+        self.max_unmeasured = max_unmeasured
+        self.estimates = {}
+
+    def _get_estimate(self, group: str, default: float) -> float:
+        return self.estimates.get(group, default)
+
+    def _is_capped(self, group: str, running: dict) -> bool:
+        """Returns True if no further process of `group` may start before its peak RSS is measured."""
+        return (self.max_unmeasured is not None and group not in self.estimates and
+                sum(g == group for _, _, g, _, _ in running.values()) >= self.max_unmeasured)
+
+    def _calc_free_memory(self, running: dict) -> float:
+        """Returns the available memory minus the expected further growth of running processes."""
+        growth = sum(max(0., self._get_estimate(group, estimate) * self.safety_factor - get_process_rss(p.pid))
+                     for p, _, group, estimate, _ in running.values())
+        return get_available_memory() - self.memory_reserve - growth
+
+    def run(self, func: Callable, tasks: list) -> list:
+        """Runs `func(*args)` for each (group, args, estimated peak RSS [MB]) task.
+
+        Tasks are started in order, a later task being started first if an earlier one does not fit in memory. A
+        task is always started when no other is running, whatever its estimate. The traceback of failed tasks is
+        printed.
+
+        Returns:
+            (group, args, measured peak RSS [MB], error traceback or None) of each task, in completion order
+        """
+        pending = list(tasks)
+        running = {}
+        res = []
+        while pending or running:
+            for key, (p, conn, group, estimate, args) in list(running.items()):
+                if not p.is_alive() or conn.poll():
+                    peak_rss, error = conn.recv() if conn.poll() else (None, f'process exited with code {p.exitcode}')
+                    p.join()
+                    del running[key]
+                    if peak_rss is not None:
+                        self.estimates[group] = max(self.estimates.get(group, 0.), peak_rss)
+                    res.append((group, args, peak_rss, error))
+                    print(f'[scheduler] {group} {"failed" if error else "done"} (peak RSS '
+                          f'{"n/a" if peak_rss is None else f"{peak_rss:.0f}"} MB), {len(running)} running, '
+                          f'{len(pending)} pending')
+                    if error:
+                        print(error)
+
+            while pending and len(running) < self.max_workers:
+                free_memory = self._calc_free_memory(running)
+                i_next = next((i for i, (group, _, estimate) in enumerate(pending) if not running or (
+                    not self._is_capped(group=group, running=running) and
+                    self._get_estimate(group, estimate) * self.safety_factor <= free_memory)), None)
+                if i_next is None:
+                    break
+                group, args, estimate = pending.pop(i_next)
+                conn_parent, conn_child = Pipe(duplex=False)
+                p = Process(target=_run_task, args=(func, args, conn_child))
+                p.start()
+                conn_child.close()
+                running[p.pid] = (p, conn_parent, group, estimate, args)
+                print(f'[scheduler] {group} started (estimated peak RSS '
+                      f'{self._get_estimate(group, estimate) * self.safety_factor:.0f} MB, '
+                      f'{free_memory:.0f} MB free), {len(running)} running')
+            sleep(self.poll_interval if running else 0.)
+        return res
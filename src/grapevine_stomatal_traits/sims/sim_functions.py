@@ -1,66 +1,284 @@
+from datetime import datetime
 from json import load, dump
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from hydroshoot.architecture import load_mtg
 from openalea.mtg.mtg import MTG
-from openalea.plantgl.scenegraph import Scene
 
 from grapevine_stomatal_traits.simulator import hydroshoot_wrapper
+from grapevine_stomatal_traits.simulator.canopy import LeafIrradiance, LeafStaticInputs, calc_file_checksum
+from grapevine_stomatal_traits.simulator.clustering import LeafClusters, reduce_canopy
+from grapevine_stomatal_traits.simulator.convergence import DivergenceMonitor, SimulationDiverged
+from grapevine_stomatal_traits.simulator.memory import MemoryProfiler
+from grapevine_stomatal_traits.simulator.output_writer import append_jsonl
+from grapevine_stomatal_traits.simulator.profiling import CpuProfiler, CPU_PROFILE_FILE_NAME
+from grapevine_stomatal_traits.simulator.summary import default_summary
+from grapevine_stomatal_traits.simulator.time_step import TimeSampling
 from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits
 
+PATH_OUTPUT_ROOT_DEFAULT = Path.home() / '../../mnt/data/hydroshoot/project_megan/simulation_results'
+MANIFEST_FILE_NAME = 'manifest.jsonl'
 
-def _run_simulations(g: MTG, scene: Scene, path_root: Path, path_preprocessed_dir: Path,
+if TYPE_CHECKING:
+    from openalea.plantgl.scenegraph import Scene
+
+
+def get_mtg_checksum(path_preprocessed_dir: Path) -> str:
+    """Returns the checksum of the initial mtg of a preprocessed directory ('initial_mtg.pckl')."""
+    return calc_file_checksum(path_preprocessed_dir / 'initial_mtg.pckl')
+
+
+def load_preprocessed_mtg(path_preprocessed_dir: Path) -> (MTG, 'Scene'):
+    """Reads the initial mtg of a preprocessed directory ('initial_mtg.pckl') and its geometry ('geometry.bgeom').
+
+    Returns:
+        the mtg and its scene
+    """
+    return load_mtg(path_mtg=str(path_preprocessed_dir / 'initial_mtg.pckl'),
+                    path_geometry=str(path_preprocessed_dir / 'geometry.bgeom'))
+
+
+def load_static_inputs(path_preprocessed_dir: Path, g: MTG = None) -> LeafStaticInputs:
+    """Reads the static inputs of a preprocessed directory and checks they match its initial mtg (and `g`).
+
+    Directories preprocessed before the binary format was introduced ('static.json') are read without checks.
+    """
+    path_static = path_preprocessed_dir / 'static.npz'
+    if path_static.exists():
+        static_inputs = LeafStaticInputs.load(
+            path_file=path_static,
+            mtg_checksum=get_mtg_checksum(path_preprocessed_dir=path_preprocessed_dir))
+        if g is not None:
+            static_inputs.validate(g=g)
+    else:
+        with open(path_preprocessed_dir / 'static.json') as f:
+            static_inputs = LeafStaticInputs.from_dict(load(f))
+    return static_inputs
+
+
+def load_leaf_clusters(path_preprocessed_dir: Path, g: MTG, static_inputs: LeafStaticInputs,
+                       leaf_irradiance: LeafIrradiance, nb_clusters: int) -> LeafClusters:
+    """Reads the leaf clusters written at preprocessing ('leaf_clusters_<n>.npz'), or computes them if missing."""
+    path_clusters = path_preprocessed_dir / f'leaf_clusters_{nb_clusters}.npz'
+    if path_clusters.exists():
+        return LeafClusters.load(
+            path_file=path_clusters,
+            mtg_checksum=get_mtg_checksum(path_preprocessed_dir=path_preprocessed_dir))
+    return LeafClusters.from_inputs(g=g, static_inputs=static_inputs, leaf_irradiance=leaf_irradiance,
+                                    nb_clusters=nb_clusters)
+
+
+def load_row_leaf_ppfd(path_preprocessed_dir: Path, leaf_irradiance: LeafIrradiance) -> (dict, int):
+    """Reads the leaf irradiance of the plants of a row preprocessed in row-scale mode ('dynamic_plant_<i>.json'), the
+    plants of the row and its reference plant being read from 'row_layout.json'.
+
+    Args:
+        path_preprocessed_dir: preprocessed inputs directory
+        leaf_irradiance: leaf irradiance of the reference plant ('dynamic.json')
+
+    Returns:
+        the leaf irradiance of each plant (key=plant index) and the index of the reference plant
+
+    Raises:
+        FileNotFoundError: if the directory was not preprocessed in row-scale mode
+        ValueError: if the plant irradiance files do not match the row layout (e.g. left by a former preprocessing)
+    """
+    path_layout = path_preprocessed_dir / 'row_layout.json'
+    if not path_layout.exists():
+        raise FileNotFoundError(f'no row-scale inputs in "{path_preprocessed_dir}" (preprocess with `nb_row_plants`)')
+    with open(path_layout) as f:
+        layout = load(f)
+    reference_plant = layout['reference_plant']
+
+    paths = {int(path_file.stem.split('_')[-1]): path_file
+             for path_file in path_preprocessed_dir.glob('dynamic_plant_*.json')}
+    neighbours = set(range(layout['nb_plants'])) - {reference_plant}
+    if set(paths) != neighbours:
+        raise ValueError(f'the plant irradiance files of "{path_preprocessed_dir}" (plants {sorted(paths)}) do not '
+                         f'match its row layout (plants {sorted(neighbours)} besides the reference plant '
+                         f'{reference_plant})')
+
+    res = {reference_plant: leaf_irradiance}
+    for plant, path_file in paths.items():
+        with open(path_file) as f:
+            res[plant] = LeafIrradiance.from_dict(load(f), leaf_index=leaf_irradiance.leaf_index)
+    return res, reference_plant
+
+
+def get_path_output(path_root: Path, climate_scenario: list, row_angle_scenario: ScenariosRowAngle,
+                    stomatal_traits_scenario: ScenariosTraits, path_output_root: Path = None) -> Path:
+    """Returns the output directory of a scenario."""
+    path_data = (PATH_OUTPUT_ROOT_DEFAULT if path_output_root is None else path_output_root) / path_root.name
+    return path_data / climate_scenario[0] / row_angle_scenario.name / stomatal_traits_scenario.name
+
+
+def _run_simulations(g: MTG, scene: 'Scene', path_root: Path, path_preprocessed_dir: Path,
                      row_angle_scenario: ScenariosRowAngle, climate_scenario: list,
-                     stomatal_traits_scenario: ScenariosTraits):
-    path_data = path_root.home() / '../../mnt/data/hydroshoot/project_megan/simulation_results' / path_root.name
-    path_output = path_data / climate_scenario[0] / row_angle_scenario.name / stomatal_traits_scenario.name
+                     stomatal_traits_scenario: ScenariosTraits, path_output_root: Path = None,
+                     nb_leaf_clusters: int = None, memory_profiler: MemoryProfiler = None,
+                     is_write_time_series: bool = True, divergence_policy: str = 'flag',
+                     time_sampling: TimeSampling = None, is_row_scale: bool = False):
+    if is_row_scale and nb_leaf_clusters is not None:
+        raise ValueError('the row-scale mode cannot be combined with leaf clusters')
+    path_output = get_path_output(
+        path_root=path_root, climate_scenario=climate_scenario, row_angle_scenario=row_angle_scenario,
+        stomatal_traits_scenario=stomatal_traits_scenario, path_output_root=path_output_root)
     path_output.mkdir(exist_ok=True, parents=True)
+    if memory_profiler is None:
+        memory_profiler = MemoryProfiler(is_enabled=False)
 
-    with open(path_preprocessed_dir / 'static.json') as f:
-        static_inputs = load(f)
-    with open(path_preprocessed_dir / 'dynamic.json') as f:
-        dynamic_inputs = load(f)
+    with memory_profiler.phase('load_static_inputs'):
+        static_inputs = load_static_inputs(path_preprocessed_dir=path_preprocessed_dir, g=g)
+    with memory_profiler.phase('load_dynamic_inputs'):
+        with open(path_preprocessed_dir / 'dynamic.json') as f:
+            dynamic_inputs = LeafIrradiance.from_dict(load(f), leaf_index=static_inputs.leaf_index)
+    if nb_leaf_clusters is not None:
+        with memory_profiler.phase('reduce_canopy'):
+            leaf_clusters = load_leaf_clusters(
+                path_preprocessed_dir=path_preprocessed_dir, g=g, static_inputs=static_inputs,
+                leaf_irradiance=dynamic_inputs, nb_clusters=nb_leaf_clusters)
+            g, static_inputs, dynamic_inputs = reduce_canopy(
+                g=g, static_inputs=static_inputs, leaf_irradiance=dynamic_inputs, leaf_clusters=leaf_clusters)
     with open(path_preprocessed_dir / 'params.json', mode='r') as f:
         params = load(f)
 
     params['exchange']['par_gs'].update(stomatal_traits_scenario.value)
 
-    hydroshoot_wrapper.run(
+    summary = default_summary()
+    divergence_monitor = DivergenceMonitor(policy=divergence_policy)
+    scenario_metadata = dict(
+        site=path_root.name,
+        clim=climate_scenario[0],
+        orient=row_angle_scenario.name,
+        trait=stomatal_traits_scenario.name)
+    run_kwargs = dict(
         g=g,
         wd=path_preprocessed_dir,
         params=params,
         path_weather=path_root / f'weather_{path_root.stem}_{climate_scenario[0]}.csv',
         scene=scene,
+        write_result=is_write_time_series,
         path_output=path_output / 'time_series.csv',
         gdd_since_budbreak=climate_scenario[1].gdd_since_budbreak,
-        form_factors=static_inputs['form_factors'],
-        leaf_nitrogen=static_inputs['Na'],
-        leaf_ppfd=dynamic_inputs,
+        static_inputs=static_inputs,
         drip_rate=3.8,
         replacement_fraction=0.6,
-        irrigation_freq=7)
+        irrigation_freq=7,
+        memory_profiler=memory_profiler,
+        summary=summary,
+        divergence_monitor=divergence_monitor,
+        time_sampling=time_sampling)
+    time_on = datetime.now()
+    try:
+        if is_row_scale:
+            row_leaf_ppfd, reference_plant = load_row_leaf_ppfd(
+                path_preprocessed_dir=path_preprocessed_dir, leaf_irradiance=dynamic_inputs)
+            hydroshoot_wrapper.run_row(row_leaf_ppfd=row_leaf_ppfd, reference_plant=reference_plant, **run_kwargs)
+        else:
+            hydroshoot_wrapper.run(leaf_ppfd=dynamic_inputs, **run_kwargs)
+    except SimulationDiverged as e:
+        print(f'scenario aborted: {e}')
+    append_jsonl(path_file=path_output.parents[3] / MANIFEST_FILE_NAME, record={
+        **scenario_metadata, 'path_output': str(path_output), 'date': time_on.isoformat(),
+        'runtime': (datetime.now() - time_on).total_seconds(), **divergence_monitor.to_dict()})
+    if divergence_monitor.is_aborted:
+        return
 
+    with open(path_output / 'summary.json', mode='w') as f:
+        dump(summary.to_dict(**scenario_metadata), f, indent=2)
+
+    memory_profiler.write_report(
+        path_file=path_output / 'memory_report.json',
+        **scenario_metadata,
+        nb_leaves=len(static_inputs.leaf_index),
+        nb_hours=len(dynamic_inputs))
     pass
 
 
 def run_simulations(path_root: Path, scenario_dates: list, scenario_angle: ScenariosRowAngle,
-                    scenario_traits: ScenariosTraits):
+                    scenario_traits: ScenariosTraits, path_output_root: Path = None, nb_leaf_clusters: int = None,
+                    is_memory_profile: bool = False, is_write_time_series: bool = True, is_cpu_profile: bool = False,
+                    divergence_policy: str = 'flag', time_step: int = 1, night_time_step: int = None,
+                    is_row_scale: bool = False):
+    """Runs one scenario.
+
+    Args:
+        is_memory_profile: if True, memory use is measured per phase and written to 'memory_report.json' next to
+            the simulation outputs (see `simulator.memory.aggregate_memory_reports`)
+        is_write_time_series: if False, only the scenario summary ('summary.json', see `simulator.summary`) is
+            written, not the hourly 'time_series.csv'
+        is_cpu_profile: if True, the scenario is run under cProfile and its statistics are written to
+            'cpu_profile.prof' next to the simulation outputs (see `simulator.profiling.merge_cpu_profiles`)
+        divergence_policy: handling of solver divergence and hydraulic failure, one of 'flag', 'abort' or 'retry'
+            (see `simulator.convergence.DivergenceMonitor`), the outcome of each scenario being appended to
+            'manifest.jsonl' in the output root
+        time_step: [h] interval between simulated hours, for screening runs (see `simulator.time_step`)
+        night_time_step: [h] interval between simulated night hours (default: `time_step`)
+        is_row_scale: if True, all plants of a row preprocessed in row-scale mode are simulated (see
+            `simulator.row`), hourly outputs holding a 'plant' column and the summary being that of the reference
+            plant
+    """
     print('-' * 30)
     print(f'climate scenario: {scenario_dates[0]}\nrow orientation: {scenario_angle.name}')
 
     path_preprocessed_dir = path_root / 'preprocessed_inputs' / scenario_dates[0] / scenario_angle.name
 
-    g, scene = load_mtg(
-        path_mtg=str(path_preprocessed_dir / 'initial_mtg.pckl'),
-        path_geometry=str(path_preprocessed_dir / 'geometry.bgeom'))
+    memory_profiler = MemoryProfiler(is_enabled=is_memory_profile)
+    cpu_profiler = CpuProfiler(is_enabled=is_cpu_profile)
+    try:
+        with cpu_profiler:
+            with memory_profiler.phase('load_mtg'):
+                g, scene = load_preprocessed_mtg(path_preprocessed_dir=path_preprocessed_dir)
 
-    _run_simulations(
-        g=g,
-        scene=scene,
-        path_root=path_root,
-        path_preprocessed_dir=path_preprocessed_dir,
-        row_angle_scenario=scenario_angle,
-        climate_scenario=scenario_dates,
-        stomatal_traits_scenario=scenario_traits)
+            _run_simulations(
+                g=g,
+                scene=scene,
+                path_root=path_root,
+                path_preprocessed_dir=path_preprocessed_dir,
+                row_angle_scenario=scenario_angle,
+                climate_scenario=scenario_dates,
+                stomatal_traits_scenario=scenario_traits,
+                path_output_root=path_output_root,
+                nb_leaf_clusters=nb_leaf_clusters,
+                memory_profiler=memory_profiler,
+                is_write_time_series=is_write_time_series,
+                divergence_policy=divergence_policy,
+                time_sampling=TimeSampling(step=time_step, night_step=night_time_step),
+                is_row_scale=is_row_scale)
+    finally:
+        memory_profiler.stop()
+    cpu_profiler.write(path_file=get_path_output(
+        path_root=path_root, climate_scenario=scenario_dates, row_angle_scenario=scenario_angle,
+        stomatal_traits_scenario=scenario_traits, path_output_root=path_output_root) / CPU_PROFILE_FILE_NAME)
 
     pass
+
+
+def run_scenario(site: str, clim: str, orient: str, trait: str, output_root: str = None,
+                 is_memory_profile: bool = False, is_write_time_series: bool = True,
+                 is_cpu_profile: bool = False, divergence_policy: str = 'flag', time_step: int = 1,
+                 night_time_step: int = None, is_row_scale: bool = False, nb_leaf_clusters: int = None) -> dict:
+    """Runs one scenario identified by names, as queued by `grapevine-traits simulate --queue`."""
+    from grapevine_stomatal_traits.sims.sites import get_site
+
+    site_scenarios = get_site(site)
+    path_output_root = None if output_root is None else Path(output_root)
+    run_simulations(
+        path_root=site_scenarios.path_root,
+        scenario_dates=site_scenarios.get_scenario_dates(clim),
+        scenario_angle=ScenariosRowAngle[orient],
+        scenario_traits=ScenariosTraits[trait],
+        path_output_root=path_output_root,
+        nb_leaf_clusters=nb_leaf_clusters,
+        is_memory_profile=is_memory_profile,
+        is_write_time_series=is_write_time_series,
+        is_cpu_profile=is_cpu_profile,
+        divergence_policy=divergence_policy,
+        time_step=time_step,
+        night_time_step=night_time_step,
+        is_row_scale=is_row_scale)
+    return {'path_output': str(get_path_output(
+        path_root=site_scenarios.path_root, climate_scenario=site_scenarios.get_scenario_dates(clim),
+        row_angle_scenario=ScenariosRowAngle[orient], stomatal_traits_scenario=ScenariosTraits[trait],
+        path_output_root=path_output_root))}
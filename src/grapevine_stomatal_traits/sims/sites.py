@@ -0,0 +1,95 @@
+from pathlib import Path
+
+from grapevine_stomatal_traits.sims.fresno.config import SiteDataFresno, ScenariosDatesFresno
+from grapevine_stomatal_traits.sims.oakville.config import SiteDataOakville, ScenariosDatesOakville
+from grapevine_stomatal_traits.sources.config import ScenariosRowAngle, ScenariosTraits, PhenoData, SiteData
+
+
+class SiteScenarios(object):
+    def __init__(self, name: str, site_data_class: type, scenarios_dates: list):
+        self.name = name
+        self.site_data_class = site_data_class
+        self.scenarios_dates = scenarios_dates
+        self.path_root = Path(__file__).parent / name
+
+    def get_site_data(self, pheno_data: PhenoData) -> SiteData:
+        return self.site_data_class(pheno_data)
+
+    def get_scenario_dates(self, climate_scenario: str) -> tuple:
+        for scenario_dates in self.scenarios_dates:
+            if scenario_dates[0] == climate_scenario:
+                return scenario_dates
+        raise KeyError(f'unknown climate scenario for site "{self.name}": "{climate_scenario}"')
+
+    def get_path_weather(self, climate_scenario: str) -> Path:
+        return self.path_root / f'weather_{self.name}_{climate_scenario}.csv'
+
+
+SITES = {
+    'fresno': SiteScenarios(name='fresno', site_data_class=SiteDataFresno, scenarios_dates=ScenariosDatesFresno),
+    'oakville': SiteScenarios(name='oakville', site_data_class=SiteDataOakville, scenarios_dates=ScenariosDatesOakville)
+}
+
+
+def get_site(site_name: str) -> SiteScenarios:
+    try:
+        return SITES[site_name]
+    except KeyError:
+        raise KeyError(f'unknown site name: "{site_name}"')
+
+
+def select_scenarios(sites: list = None, climates: list = None, orientations: list = None,
+                     traits: list = None) -> list:
+    """Returns the (site, scenario_dates, row angle scenario, traits scenario) combinations that match the filters.
+
+    Args:
+        sites: site names (all sites if None)
+        climates: climate scenario names, e.g. 'historical', 'rcp45' (all if None)
+        orientations: names of `ScenariosRowAngle` members (all if None)
+        traits: names of `ScenariosTraits` members (all if None)
+
+    Returns:
+        list of (SiteScenarios, (climate name, PhenoData), ScenariosRowAngle, ScenariosTraits) tuples
+    """
+    res = []
+    for site_name in (SITES if sites is None else sites):
+        site = get_site(site_name)
+        for scenario_dates in site.scenarios_dates:
+            if climates is not None and scenario_dates[0] not in climates:
+                continue
+            for scenario_angle in ScenariosRowAngle:
+                if orientations is not None and scenario_angle.name not in orientations:
+                    continue
+                for scenario_traits in ScenariosTraits:
+                    if traits is not None and scenario_traits.name not in traits:
+                        continue
+                    res.append((site, scenario_dates, scenario_angle, scenario_traits))
+    return res
+
+
+def count_simulated_hours(pheno_data: PhenoData) -> int:
+    return int((pheno_data.date_end_sim - pheno_data.date_start_sim).total_seconds() // 3600) + 1
+
+
+def count_sampled_hours(pheno_data: PhenoData, time_step: int = 1, night_time_step: int = None,
+                        path_weather: Path = None) -> int:
+    """Returns the number of hours simulated with a coarse time step (see `simulator.time_step`).
+
+    Args:
+        path_weather: weather file of the scenario, whose global radiation sets the night hours, required if
+            `night_time_step` differs from `time_step`
+    """
+    if time_step == 1 and night_time_step in (None, 1):
+        return count_simulated_hours(pheno_data)
+
+    from pandas import date_range, read_csv
+    from grapevine_stomatal_traits.simulator.time_step import TimeSampling
+
+    time_sampling = TimeSampling(step=time_step, night_step=night_time_step)
+    dates = date_range(pheno_data.date_start_sim, pheno_data.date_end_sim, freq='h')
+    is_night = None
+    if time_sampling.night_step != time_sampling.step:
+        weather = read_csv(path_weather, sep=';', decimal='.', index_col='time', parse_dates=True,
+                           usecols=['time', 'Rg'])
+        is_night = weather['Rg'].reindex(dates).to_numpy() <= 0
+    return len(time_sampling.sample(dates=dates, is_night=is_night)[0])
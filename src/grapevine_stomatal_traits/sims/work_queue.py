@@ -0,0 +1,191 @@
+"""SQLite-based work queue to spread a simulation sweep over any number of worker processes and hosts.
+
+The queue is a single SQLite file on storage shared by all workers. Workers claim pending tasks inside an exclusive
+transaction, send heartbeats while running them, and record their result or error. Claims whose heartbeat is older
+than `stale_after` seconds (crashed worker, lost host) are put back to pending and claimed again.
+
+SQLite relies on file locks: on network file systems make sure locking is enabled (e.g. NFS with lockd); the default
+rollback journal is used, not WAL, which does not work over network file systems.
+"""
+
+import sqlite3
+import socket
+import traceback
+from contextlib import closing
+from json import dumps, loads
+from os import getpid
+from pathlib import Path
+from threading import Event, Thread
+from time import time, sleep
+from typing import Callable
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    heartbeat_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status);
+"""
+
+
+class WorkQueue(object):
+    def __init__(self, path_db: Path, stale_after: float = 600., max_attempts: int = 3):
+        """
+        Args:
+            path_db: path to the SQLite queue file (created if missing)
+            stale_after: [s] delay without heartbeat after which a running task is reclaimed
+            max_attempts: number of claims after which a failing or repeatedly stale task is marked as failed
+        """
+        self.path_db = Path(path_db)
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        with closing(self._connect()) as con:
+            con.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(str(self.path_db), timeout=120., isolation_level=None)
+
+    def submit(self, tasks: dict) -> int:
+        """Adds {key: payload} tasks, payloads being JSON-serialisable dicts. Already known keys are ignored.
+
+        Returns:
+            number of added tasks
+        """
+        with closing(self._connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            nb_before = con.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            con.executemany('INSERT OR IGNORE INTO tasks (key, payload) VALUES (?, ?)',
+                            [(key, dumps(payload)) for key, payload in tasks.items()])
+            nb_after = con.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            con.execute('COMMIT')
+        return nb_after - nb_before
+
+    def _reclaim_stale(self, con: sqlite3.Connection) -> int:
+        deadline = time() - self.stale_after
+        con.execute('UPDATE tasks SET status = ?, error = ? WHERE status = ? AND heartbeat_at < ? AND attempts >= ?',
+                    (FAILED, 'stale claim (max attempts reached)', RUNNING, deadline, self.max_attempts))
+        return con.execute('UPDATE tasks SET status = ?, worker = NULL WHERE status = ? AND heartbeat_at < ?',
+                           (PENDING, RUNNING, deadline)).rowcount
+
+    def reclaim_stale(self) -> int:
+        """Puts back to pending the running tasks whose heartbeat is too old. Returns their number."""
+        with closing(self._connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            nb_reclaimed = self._reclaim_stale(con)
+            con.execute('COMMIT')
+        return nb_reclaimed
+
+    def claim(self, worker_id: str) -> (int, str, dict):
+        """Claims the oldest pending task, after reclaiming stale ones.
+
+        Returns:
+            (task id, key, payload), or None if no task is pending
+        """
+        with closing(self._connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            self._reclaim_stale(con)
+            row = con.execute('SELECT id, key, payload FROM tasks WHERE status = ? ORDER BY id LIMIT 1',
+                              (PENDING,)).fetchone()
+            if row is not None:
+                con.execute('UPDATE tasks SET status = ?, worker = ?, heartbeat_at = ?, attempts = attempts + 1 '
+                            'WHERE id = ?', (RUNNING, worker_id, time(), row[0]))
+            con.execute('COMMIT')
+        return None if row is None else (row[0], row[1], loads(row[2]))
+
+    def heartbeat(self, task_id: int, worker_id: str) -> bool:
+        """Refreshes a claim. Returns False if the task is no longer claimed by `worker_id` (it was reclaimed)."""
+        with closing(self._connect()) as con:
+            return con.execute('UPDATE tasks SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = ?',
+                               (time(), task_id, worker_id, RUNNING)).rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str, result: dict = None) -> bool:
+        with closing(self._connect()) as con:
+            return con.execute('UPDATE tasks SET status = ?, result = ?, error = NULL WHERE id = ? AND worker = ?',
+                               (DONE, dumps(result), task_id, worker_id)).rowcount == 1
+
+    def fail(self, task_id: int, worker_id: str, error: str) -> bool:
+        """Records an error. The task goes back to pending unless it has reached `max_attempts`."""
+        with closing(self._connect()) as con:
+            return con.execute(
+                'UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, error = ? '
+                'WHERE id = ? AND worker = ?',
+                (self.max_attempts, FAILED, PENDING, error, task_id, worker_id)).rowcount == 1
+
+    def count(self) -> dict:
+        with closing(self._connect()) as con:
+            return dict(con.execute('SELECT status, COUNT(*) FROM tasks GROUP BY status').fetchall())
+
+    def get_tasks(self, status: str = None) -> list:
+        """Returns (key, status, worker, attempts, result, error) rows."""
+        query = 'SELECT key, status, worker, attempts, result, error FROM tasks'
+        with closing(self._connect()) as con:
+            if status is None:
+                return con.execute(query).fetchall()
+            return con.execute(f'{query} WHERE status = ?', (status,)).fetchall()
+
+
+def _send_heartbeats(queue: WorkQueue, task_id: int, worker_id: str, interval: float, stop: Event):
+    while not stop.wait(interval):
+        if not queue.heartbeat(task_id=task_id, worker_id=worker_id):
+            print(f'[{worker_id}] lost the claim on task {task_id}')
+            break
+    pass
+
+
+def run_worker(path_db: Path, func: Callable, worker_id: str = None, heartbeat_interval: float = 30.,
+               stale_after: float = 600., poll_interval: float = 30., max_attempts: int = 3) -> int:
+    """Claims and runs tasks as `func(**payload)` until no task is pending nor running.
+
+    Args:
+        path_db: path to the SQLite queue file
+        func: function to which task payloads are passed as keyword arguments, its return value (if any) must be
+            JSON-serialisable
+        worker_id: unique worker name (default: '<host>:<pid>')
+        heartbeat_interval: [s] delay between two heartbeats, must be well below `stale_after`
+        stale_after: [s] delay without heartbeat after which a running task is reclaimed
+        poll_interval: [s] waiting delay when no task is pending but others are still running
+        max_attempts: number of claims after which a task is marked as failed
+
+    Returns:
+        number of tasks run by this worker
+    """
+    worker_id = f'{socket.gethostname()}:{getpid()}' if worker_id is None else worker_id
+    queue = WorkQueue(path_db=path_db, stale_after=stale_after, max_attempts=max_attempts)
+    nb_tasks = 0
+    while True:
+        task = queue.claim(worker_id=worker_id)
+        if task is None:
+            if queue.count().get(RUNNING, 0) == 0:
+                break
+            sleep(poll_interval)
+            continue
+
+        task_id, key, payload = task
+        print(f'[{worker_id}] running task {key}')
+        stop = Event()
+        heartbeat = Thread(target=_send_heartbeats, args=(queue, task_id, worker_id, heartbeat_interval, stop),
+                           daemon=True)
+        heartbeat.start()
+        try:
+            result = func(**payload)
+        except Exception:
+            queue.fail(task_id=task_id, worker_id=worker_id, error=traceback.format_exc())
+        else:
+            queue.complete(task_id=task_id, worker_id=worker_id, result=result)
+        finally:
+            stop.set()
+            heartbeat.join()
+        nb_tasks += 1
+    return nb_tasks
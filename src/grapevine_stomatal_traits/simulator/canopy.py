@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""This module provides array-backed views of per-leaf quantities.
+
+Leaf vertices of an mtg are mapped once to a contiguous index, so that per-leaf inputs (form factors, nitrogen
+content, irradiance) and outputs can be held in NumPy arrays instead of dicts keyed by vertex id. The dicts expected by
+HydroShoot are only rebuilt where HydroShoot reads them.
+"""
+from collections.abc import Mapping
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from hydroshoot.architecture import get_leaves
+from openalea.mtg.mtg import MTG
+
+FORM_FACTOR_NAMES = ('ff_sky', 'ff_leaves', 'ff_soil')
+STATIC_FORMAT_VERSION = 1
+
+
+def calc_file_checksum(path_file: Path) -> str:
+    """Returns the sha256 hex digest of a file."""
+    h = sha256()
+    with open(path_file, mode='rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class LeafIndex(object):
+    """Maps mtg vertex ids to contiguous array positions."""
+    __slots__ = ('vids', '_position')
+
+    def __init__(self, vids: Iterable):
+        self.vids = np.array(sorted({int(vid) for vid in vids}), dtype=np.int64)
+        self._position = {vid: i for i, vid in enumerate(self.vids.tolist())}
+
+    @classmethod
+    def from_mtg(cls, g: MTG, leaf_lbl_prefix: str = 'L') -> 'LeafIndex':
+        return cls(vids=get_leaves(g=g, leaf_lbl_prefix=leaf_lbl_prefix))
+
+    def __len__(self) -> int:
+        return len(self.vids)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LeafIndex) and np.array_equal(self.vids, other.vids)
+
+    def position(self, vid) -> int:
+        return self._position[int(vid)]
+
+    def to_array(self, values: dict, default: float = np.nan) -> np.ndarray:
+        """Orders a {vertex id: value} dict along the index. Integer and string (JSON) keys are both accepted."""
+        res = np.full(len(self), default, dtype=float)
+        for vid, value in values.items():
+            i = self._position.get(int(vid))
+            if i is not None:
+                res[i] = value
+        return res
+
+    def to_dict(self, values: np.ndarray) -> dict:
+        return dict(zip(self._position, np.asarray(values, dtype=float).tolist()))
+
+    def gather(self, g: MTG, property_name: str, default: float = np.nan) -> np.ndarray:
+        """Reads an mtg property into an array ordered along the index."""
+        prop = g.property(property_name)
+        return np.fromiter((prop.get(vid, default) for vid in self.vids.tolist()), dtype=float, count=len(self))
+
+
+class LeafStaticInputs(object):
+    """Time-invariant leaf inputs: form factors and nitrogen content per area."""
+    __slots__ = ('leaf_index', 'ff_sky', 'ff_leaves', 'ff_soil', 'na')
+
+    def __init__(self, leaf_index: LeafIndex, ff_sky: np.ndarray, ff_leaves: np.ndarray, ff_soil: np.ndarray,
+                 na: np.ndarray):
+        self.leaf_index = leaf_index
+        self.ff_sky = ff_sky
+        self.ff_leaves = ff_leaves
+        self.ff_soil = ff_soil
+        self.na = na
+
+    @classmethod
+    def from_mtg(cls, g: MTG, leaf_index: LeafIndex = None) -> 'LeafStaticInputs':
+        if leaf_index is None:
+            leaf_index = LeafIndex(vids=g.property('ff_sky').keys())
+        return cls(leaf_index=leaf_index,
+                   na=leaf_index.gather(g=g, property_name='Na'),
+                   **{s: leaf_index.gather(g=g, property_name=s) for s in FORM_FACTOR_NAMES})
+
+    @classmethod
+    def from_dict(cls, static_data: dict, leaf_index: LeafIndex = None) -> 'LeafStaticInputs':
+        """Reads the {'form_factors': {...}, 'Na': {...}} layout of 'static.json'."""
+        form_factors = static_data['form_factors']
+        if leaf_index is None:
+            leaf_index = LeafIndex(vids=form_factors['ff_sky'].keys())
+        return cls(leaf_index=leaf_index,
+                   na=leaf_index.to_array(static_data['Na']),
+                   **{s: leaf_index.to_array(form_factors[s]) for s in FORM_FACTOR_NAMES})
+
+    @property
+    def form_factors(self) -> dict:
+        return {s: self.leaf_index.to_dict(getattr(self, s)) for s in FORM_FACTOR_NAMES}
+
+    @property
+    def leaf_nitrogen(self) -> dict:
+        return self.leaf_index.to_dict(self.na)
+
+    def to_dict(self) -> dict:
+        return {'form_factors': self.form_factors, 'Na': self.leaf_nitrogen}
+
+    def save(self, path_file: Path, mtg_checksum: str):
+        """Writes the inputs as aligned binary arrays, tied to the checksum of the mtg they were computed from."""
+        with open(path_file, mode='wb') as f:
+            np.savez(f, format_version=STATIC_FORMAT_VERSION, mtg_checksum=mtg_checksum, vid=self.leaf_index.vids,
+                     Na=self.na, **{s: getattr(self, s) for s in FORM_FACTOR_NAMES})
+        pass
+
+    @classmethod
+    def load(cls, path_file: Path, mtg_checksum: str = None) -> 'LeafStaticInputs':
+        """Reads inputs written by `save`.
+
+        Raises:
+            ValueError: if the file format is unknown or `mtg_checksum` differs from the one stored in the file
+        """
+        with np.load(path_file, allow_pickle=False) as data:
+            if int(data['format_version']) != STATIC_FORMAT_VERSION:
+                raise ValueError(f'unsupported static inputs format version in "{path_file}"')
+            if mtg_checksum is not None and str(data['mtg_checksum']) != mtg_checksum:
+                raise ValueError(f'"{path_file}" was computed from a different mtg than the one provided (stale file?)')
+            return cls(leaf_index=LeafIndex(vids=data['vid']), na=data['Na'],
+                       **{s: data[s] for s in FORM_FACTOR_NAMES})
+
+    def validate(self, g: MTG, leaf_lbl_prefix: str = 'L'):
+        """Checks that the indexed vertices are exactly the leaves of `g`.
+
+        Raises:
+            ValueError: if leaf vertex ids differ
+        """
+        if self.leaf_index != LeafIndex.from_mtg(g=g, leaf_lbl_prefix=leaf_lbl_prefix):
+            raise ValueError('leaf vertex ids of static inputs do not match those of the mtg')
+        pass
+
+
+class LeafIrradiance(Mapping):
+    """Incident (Ei) and absorbed (Eabs) PPFD of each leaf per simulated hour, held as (hour x leaf) arrays.
+
+    Behaves as the {date: {'diffuse_to_total_irradiance_ratio': .., 'Ei': {..}, 'Eabs': {..}}} mapping read by
+    HydroShoot as `leaf_ppfd`, where dates are formatted as '%Y%m%d%H%M%S' (mtg.date). Per-hour dicts are built on
+    access only, and those of the last accessed hour are kept, since HydroShoot reads the same hour several times
+    (`init_hourly` reads the diffuse ratio, Ei and Eabs separately).
+    """
+    __slots__ = ('leaf_index', 'dates', 'diffuse_to_total_irradiance_ratio', 'ei', 'eabs', '_row', '_last_hour')
+
+    def __init__(self, leaf_index: LeafIndex, dates: list, diffuse_to_total_irradiance_ratio: np.ndarray,
+                 ei: np.ndarray, eabs: np.ndarray):
+        self.leaf_index = leaf_index
+        self.dates = list(dates)
+        self.diffuse_to_total_irradiance_ratio = diffuse_to_total_irradiance_ratio
+        self.ei = ei
+        self.eabs = eabs
+        self._row = {date: i for i, date in enumerate(self.dates)}
+        self._last_hour = None
+
+    @classmethod
+    def empty(cls, leaf_index: LeafIndex, dates: list) -> 'LeafIrradiance':
+        shape = (len(dates), len(leaf_index))
+        return cls(leaf_index=leaf_index, dates=dates, diffuse_to_total_irradiance_ratio=np.full(len(dates), np.nan),
+                   ei=np.full(shape, np.nan), eabs=np.full(shape, np.nan))
+
+    @classmethod
+    def from_dict(cls, leaf_ppfd: dict, leaf_index: LeafIndex = None) -> 'LeafIrradiance':
+        """Reads the layout of 'dynamic.json' (or of any `leaf_ppfd` dict)."""
+        dates = list(leaf_ppfd.keys())
+        if leaf_index is None:
+            leaf_index = LeafIndex(vids=leaf_ppfd[dates[0]]['Ei'].keys())
+        res = cls.empty(leaf_index=leaf_index, dates=dates)
+        for date, hourly_data in leaf_ppfd.items():
+            res.set_hour(date=date, **hourly_data)
+        return res
+
+    def set_hour(self, date: str, diffuse_to_total_irradiance_ratio: float, Ei: dict, Eabs: dict):
+        i = self._row[date]
+        self.diffuse_to_total_irradiance_ratio[i] = diffuse_to_total_irradiance_ratio
+        self.ei[i, :] = self.leaf_index.to_array(Ei)
+        self.eabs[i, :] = self.leaf_index.to_array(Eabs)
+        self._last_hour = None
+        pass
+
+    def __getitem__(self, date: str) -> dict:
+        if self._last_hour is None or self._last_hour[0] != date:
+            i = self._row[date]
+            self._last_hour = (date, {
+                'diffuse_to_total_irradiance_ratio': float(self.diffuse_to_total_irradiance_ratio[i]),
+                'Ei': self.leaf_index.to_dict(self.ei[i, :]),
+                'Eabs': self.leaf_index.to_dict(self.eabs[i, :])})
+        return self._last_hour[1]
+
+    def __iter__(self):
+        return iter(self.dates)
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def to_dict(self) -> dict:
+        return {date: self[date] for date in self.dates}
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""This module provides a reduced-canopy mode, in which leaves are grouped into clusters of similar irradiance, form
+factors, hydraulic position and nitrogen content, and only one representative leaf per cluster is simulated.
+
+Each representative carries the total area of its cluster (its geometry is scaled accordingly) and the area-weighted
+mean inputs of its members, so that whole-plant fluxes are conserved to first order. Since it then carries the
+transpiration of its whole cluster, the hydraulic conductance of the segments leading only to it (its petiole) is
+multiplied by the same area ratio, so that their pressure drop, hence leaf water potential, stays that of a single
+member leaf. The number of clusters sets the accuracy/speed trade-off, see `benchmarks/leaf_clustering.py`.
+
+The mode is experimental: its error and speedup against the full canopy have not been measured yet, so it is only
+available from Python (`run_simulations(nb_leaf_clusters=...)`) and not from the command line.
+"""
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from openalea.mtg import traversal
+from openalea.mtg.mtg import MTG
+
+from grapevine_stomatal_traits.simulator.canopy import (LeafIndex, LeafIrradiance, LeafStaticInputs,
+                                                        FORM_FACTOR_NAMES)
+
+CLUSTERS_FORMAT_VERSION = 1
+
+
+def calc_leaf_area(g: MTG, leaf_index: LeafIndex) -> np.ndarray:
+    """Returns the area of each leaf, in the mtg length unit squared."""
+    from openalea.plantgl.all import surface
+
+    return np.array([surface(g.node(vid).geometry) for vid in leaf_index.vids.tolist()])
+
+
+def calc_path_length(g: MTG, leaf_index: LeafIndex) -> np.ndarray:
+    """Returns the cumulative length of hydraulic segments between the collar and each leaf."""
+    vid_collar = g.node(g.root).vid_collar
+    length = g.property('length')
+    path_length = {vid_collar: 0.}
+    for vid in traversal.pre_order2(g, vid_collar):
+        if vid != vid_collar:
+            path_length[vid] = path_length[g.parent(vid)] + length.get(vid, 0.)
+    return leaf_index.to_array(path_length)
+
+
+def iter_leaf_segments(g: MTG, vid: int) -> Iterator[int]:
+    """Yields the hydraulic segments leading only to leaf `vid` (e.g. its petiole), upwards from the leaf."""
+    vid_collar = g.node(g.root).vid_collar
+    parent = g.parent(vid)
+    while parent is not None and parent != vid_collar and len(g.children(parent)) == 1:
+        yield parent
+        parent = g.parent(parent)
+
+
+def calc_mean_diurnal_profile(leaf_irradiance: LeafIrradiance) -> np.ndarray:
+    """Returns the (leaf x hour of the day) mean absorbed irradiance."""
+    hours = np.array([int(date[8:10]) for date in leaf_irradiance.dates])
+    return np.stack([leaf_irradiance.eabs[hours == hour, :].mean(axis=0)
+                     for hour in np.unique(hours)], axis=1)
+
+
+def _standardise(values: np.ndarray) -> np.ndarray:
+    std = values.std()
+    return (values - values.mean(axis=0)) / (std if std > 0 else 1.)
+
+
+def build_features(g: MTG, static_inputs: LeafStaticInputs, leaf_irradiance: LeafIrradiance) -> np.ndarray:
+    """Returns the (leaf x feature) clustering table: absorbed irradiance diurnal profile, sky form factor, path
+    length to the collar and nitrogen content. Each of the four groups is standardised to unit total variance, so
+    that they weigh equally whatever the number of hours in the profile."""
+    leaf_index = static_inputs.leaf_index
+    eabs_profile = calc_mean_diurnal_profile(leaf_irradiance)
+    if leaf_irradiance.leaf_index != leaf_index:
+        eabs_profile = np.stack([leaf_index.to_array(leaf_irradiance.leaf_index.to_dict(column))
+                                 for column in eabs_profile.T], axis=1)
+    eabs_profile = _standardise(eabs_profile) / np.sqrt(eabs_profile.shape[1])
+    return np.column_stack([
+        np.nan_to_num(eabs_profile),
+        _standardise(static_inputs.ff_sky),
+        _standardise(calc_path_length(g=g, leaf_index=leaf_index)),
+        _standardise(static_inputs.na)])
+
+
+def calc_kmeans(features: np.ndarray, weights: np.ndarray, nb_clusters: int, max_iter: int = 100,
+                random_state: int = 0) -> np.ndarray:
+    """Weighted k-means (k-means++ initialisation, Lloyd iterations).
+
+    Returns:
+        cluster label of each row of `features`
+    """
+    rng = np.random.default_rng(random_state)
+    nb_rows = features.shape[0]
+    nb_clusters = min(nb_clusters, nb_rows)
+
+    centers = [features[rng.choice(nb_rows, p=weights / weights.sum())]]
+    dist = ((features - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, nb_clusters):
+        p = dist * weights
+        i = rng.choice(nb_rows, p=p / p.sum()) if p.sum() > 0 else rng.integers(nb_rows)
+        centers.append(features[i])
+        dist = np.minimum(dist, ((features - features[i]) ** 2).sum(axis=1))
+    centers = np.array(centers)
+
+    labels = np.full(nb_rows, -1)
+    squared_norms = (features ** 2).sum(axis=1, keepdims=True)
+    for _ in range(max_iter):
+        new_labels = (squared_norms - 2 * features @ centers.T + (centers ** 2).sum(axis=1)).argmin(axis=1)
+        if np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        for k in range(nb_clusters):
+            is_member = labels == k
+            if is_member.any():
+                centers[k] = np.average(features[is_member], axis=0, weights=weights[is_member])
+    return labels
+
+
+class LeafClusters(object):
+    """Assignment of leaves to clusters and the representative leaf of each cluster."""
+    __slots__ = ('leaf_index', 'labels', 'representatives', 'leaf_area')
+
+    def __init__(self, leaf_index: LeafIndex, labels: np.ndarray, representatives: np.ndarray,
+                 leaf_area: np.ndarray):
+        """
+        Args:
+            leaf_index: index of all leaves
+            labels: cluster of each leaf, along `leaf_index`
+            representatives: vertex id of the representative leaf of each cluster
+            leaf_area: area of each leaf, along `leaf_index`
+        """
+        self.leaf_index = leaf_index
+        self.labels = labels
+        self.representatives = representatives
+        self.leaf_area = leaf_area
+
+    @classmethod
+    def from_inputs(cls, g: MTG, static_inputs: LeafStaticInputs, leaf_irradiance: LeafIrradiance,
+                    nb_clusters: int, random_state: int = 0) -> 'LeafClusters':
+        """Clusters leaves and picks, as representative of each cluster, the member closest to its centroid."""
+        leaf_index = static_inputs.leaf_index
+        leaf_area = calc_leaf_area(g=g, leaf_index=leaf_index)
+        features = build_features(g=g, static_inputs=static_inputs, leaf_irradiance=leaf_irradiance)
+        labels = calc_kmeans(features=features, weights=leaf_area, nb_clusters=nb_clusters,
+                             random_state=random_state)
+
+        clusters = np.unique(labels)
+        labels = np.searchsorted(clusters, labels)
+        representatives = []
+        for k in range(len(clusters)):
+            members = np.flatnonzero(labels == k)
+            centroid = np.average(features[members], axis=0, weights=leaf_area[members])
+            representatives.append(members[((features[members] - centroid) ** 2).sum(axis=1).argmin()])
+        return cls(leaf_index=leaf_index, labels=labels, representatives=leaf_index.vids[representatives],
+                   leaf_area=leaf_area)
+
+    def __len__(self) -> int:
+        return len(self.representatives)
+
+    @property
+    def representative_index(self) -> LeafIndex:
+        return LeafIndex(vids=self.representatives)
+
+    def _calc_weighted_means(self, values: np.ndarray) -> np.ndarray:
+        """Returns the area-weighted cluster means of (... x leaf) `values`, along `representative_index`."""
+        order = np.argsort(self.representatives)
+        weights = np.zeros((len(self), len(self.leaf_index)))
+        weights[self.labels, np.arange(len(self.leaf_index))] = self.leaf_area
+        weights /= weights.sum(axis=1, keepdims=True)
+        return (values @ weights.T)[..., order]
+
+    def reduce_static_inputs(self, static_inputs: LeafStaticInputs) -> LeafStaticInputs:
+        if static_inputs.leaf_index != self.leaf_index:
+            raise ValueError('static inputs and clusters are indexed on different leaves')
+        return LeafStaticInputs(
+            leaf_index=self.representative_index,
+            na=self._calc_weighted_means(static_inputs.na),
+            **{s: self._calc_weighted_means(getattr(static_inputs, s)) for s in FORM_FACTOR_NAMES})
+
+    def reduce_irradiance(self, leaf_irradiance: LeafIrradiance) -> LeafIrradiance:
+        if leaf_irradiance.leaf_index != self.leaf_index:
+            raise ValueError('leaf irradiance and clusters are indexed on different leaves')
+        return LeafIrradiance(
+            leaf_index=self.representative_index,
+            dates=leaf_irradiance.dates,
+            diffuse_to_total_irradiance_ratio=leaf_irradiance.diffuse_to_total_irradiance_ratio,
+            ei=self._calc_weighted_means(leaf_irradiance.ei),
+            eabs=self._calc_weighted_means(leaf_irradiance.eabs))
+
+    def reduce_mtg(self, g: MTG) -> MTG:
+        """Removes, in place, all leaves but the representatives, whose geometry is scaled about its center to the
+        total area of their cluster and whose own segments (see `iter_leaf_segments`) have their hydraulic
+        conductance multiplied by the same area ratio. Petioles of removed leaves are kept (they carry no flux).
+
+        HydroShoot computes the pressure drop of a segment as proportional to its length over its conductivity, the
+        conductance is hence scaled through the segment length, whatever the conductivity-diameter relationship.
+        """
+        from openalea.plantgl.all import BoundingBox, Scaled, Translated, Vector3
+
+        cluster_area = np.bincount(self.labels, weights=self.leaf_area)
+        representatives = set(self.representatives.tolist())
+        for i, vid in enumerate(self.leaf_index.vids.tolist()):
+            if vid not in representatives:
+                g.remove_vertex(vid)
+            else:
+                area_ratio = float(cluster_area[self.labels[i]] / self.leaf_area[i])
+                scale = np.sqrt(area_ratio)
+                geometry = g.node(vid).geometry
+                center = BoundingBox(geometry).getCenter()
+                g.node(vid).geometry = Translated(center, Scaled(Vector3(scale, scale, scale),
+                                                                 Translated(-center, geometry)))
+                for vid_segment in iter_leaf_segments(g=g, vid=vid):
+                    g.node(vid_segment).length = g.node(vid_segment).length / area_ratio
+        return g
+
+    def save(self, path_file: Path, mtg_checksum: str):
+        with open(path_file, mode='wb') as f:
+            np.savez(f, format_version=CLUSTERS_FORMAT_VERSION, mtg_checksum=mtg_checksum,
+                     vid=self.leaf_index.vids, labels=self.labels, representatives=self.representatives,
+                     leaf_area=self.leaf_area)
+        pass
+
+    @classmethod
+    def load(cls, path_file: Path, mtg_checksum: str = None) -> 'LeafClusters':
+        """Reads clusters written by `save`.
+
+        Raises:
+            ValueError: if the file format is unknown or `mtg_checksum` differs from the one stored in the file
+        """
+        with np.load(path_file, allow_pickle=False) as data:
+            if int(data['format_version']) != CLUSTERS_FORMAT_VERSION:
+                raise ValueError(f'unsupported leaf clusters format version in "{path_file}"')
+            if mtg_checksum is not None and str(data['mtg_checksum']) != mtg_checksum:
+                raise ValueError(f'"{path_file}" was computed from a different mtg than the one provided (stale file?)')
+            return cls(leaf_index=LeafIndex(vids=data['vid']), labels=data['labels'],
+                       representatives=data['representatives'], leaf_area=data['leaf_area'])
+
+
+def reduce_canopy(g: MTG, static_inputs: LeafStaticInputs, leaf_irradiance: LeafIrradiance,
+                  leaf_clusters: LeafClusters) -> (MTG, LeafStaticInputs, LeafIrradiance):
+    """Returns the reduced mtg (modified in place) and the reduced inputs of `leaf_clusters`."""
+    return (leaf_clusters.reduce_mtg(g),
+            leaf_clusters.reduce_static_inputs(static_inputs),
+            leaf_clusters.reduce_irradiance(leaf_irradiance))
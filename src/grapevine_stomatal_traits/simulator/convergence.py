@@ -0,0 +1,195 @@
+"""Control and monitoring of the coupled hydraulic/energy fixed-point iteration solved every hour by
+`solver.solve_interactions`:
+    - numerical tolerances overriding the 'numerical_resolution' user parameters (`SolverSettings`);
+    - per-hour iteration counting (`IterationCounter`), reported by `hydroshoot_wrapper.run` with the solver runtime;
+    - detection of divergence and hydraulic failure after each hour, and their handling by policy
+      (`DivergenceMonitor`, raising `SimulationDiverged`).
+
+The initial guess of the iteration is not controlled (no warm start): `solve_interactions` resets the xylem water
+potential of all vertices to the soil water potential before iterating, so that fields seeded into the mtg beforehand
+are overwritten.
+"""
+from copy import deepcopy
+from datetime import datetime
+from typing import Callable
+
+import numpy as np
+from openalea.mtg.mtg import MTG
+
+from grapevine_stomatal_traits.simulator.canopy import LeafIndex
+
+TOLERANCE_NAMES = ('max_iter', 'psi_step', 'psi_error_threshold', 't_step', 't_error_threshold')
+
+
+class SolverSettings(object):
+    def __init__(self, **tolerances):
+        """
+        Args:
+            tolerances: overrides of the 'numerical_resolution' user parameters, any of `TOLERANCE_NAMES`
+        """
+        unknown = set(tolerances) - set(TOLERANCE_NAMES)
+        if unknown:
+            raise KeyError(f'unknown numerical resolution parameters: {sorted(unknown)}')
+        self.tolerances = tolerances
+
+    def update_params(self, params: dict) -> dict:
+        """Returns a copy of user params in which 'numerical_resolution' values are overridden by `tolerances`."""
+        params = deepcopy(params)
+        params.setdefault('numerical_resolution', {}).update(self.tolerances)
+        return params
+
+
+class IterationCounter(object):
+    """Wraps the collar water potential function, which `solver.solve_interactions` calls once per hydraulic
+    iteration, to count iterations."""
+    __slots__ = ('func', 'count')
+
+    def __init__(self, func: Callable):
+        self.func = func
+        self.count = 0
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.func(*args, **kwargs)
+
+    def reset(self) -> int:
+        """Returns the number of iterations counted since the last reset."""
+        count, self.count = self.count, 0
+        return count
+
+
+DIVERGENCE_POLICIES = ('flag', 'abort', 'retry')
+RETRYABLE_ISSUES = ('non_finite', 'iteration_cap', 'leaf_temperature_bounds')
+
+
+class SimulationDiverged(RuntimeError):
+    """Raised by `hydroshoot_wrapper.run` when a divergence is detected under the 'abort' or 'retry' policy."""
+
+    def __init__(self, records: list):
+        self.records = records
+        super().__init__(f'simulation diverged: {records[-1] if records else ""}')
+
+
+class DivergenceMonitor(object):
+    """Detects, after each hourly solve, a diverged or physically failed simulation:
+        - 'non_finite': non-finite collar flux, collar water potential, leaf water potential or leaf temperature;
+        - 'iteration_cap': the hydraulic iterations reached their bound: `numerical_resolution.max_iter` per hydraulic
+          loop, the hydraulic loop being nested in the leaf temperature loop (itself bounded by `max_iter`) when the
+          energy budget is solved;
+        - 'hydraulic_failure': soil water potential reached `hydraulic.psi_min`;
+        - 'leaf_temperature_bounds': leaf temperature out of `leaf_temperature_bounds`;
+        - 'stalled_soil_water': soil water potential unchanged for `stalled_soil_hours` transpiring hours.
+
+    The first occurrence of each issue is recorded, together with the number of hours it was detected, and issues
+    are then handled by the policy: 'flag' (continue), 'abort' (stop the simulation)
+    or 'retry' (solve the hour again from its initial state with `retry_tolerances`, aborting if it still fails;
+    physical failures, i.e. not in `RETRYABLE_ISSUES`, abort directly).
+    """
+
+    def __init__(self, policy: str = 'flag', leaf_temperature_bounds: tuple = (-10., 60.),
+                 psi_min_tolerance: float = 1.e-3, stalled_soil_hours: int = 48, retry_tolerances: dict = None):
+        """
+        Args:
+            policy: one of `DIVERGENCE_POLICIES`
+            leaf_temperature_bounds: [°C] plausible range of leaf temperature
+            psi_min_tolerance: [MPa] distance to `hydraulic.psi_min` below which hydraulic failure is detected
+            stalled_soil_hours: number of consecutive transpiring hours with unchanged soil water potential after
+                which soil water depletion is considered stalled (not checked if soil water potential is forced)
+            retry_tolerances: factors applied to the 'numerical_resolution' parameters for the retry, default:
+                halved relaxation steps and doubled maximum number of iterations
+        """
+        if policy not in DIVERGENCE_POLICIES:
+            raise KeyError(f'unknown divergence policy: "{policy}"')
+        self.policy = policy
+        self.leaf_temperature_bounds = leaf_temperature_bounds
+        self.psi_min_tolerance = psi_min_tolerance
+        self.stalled_soil_hours = stalled_soil_hours
+        self.retry_tolerances = ({'max_iter': 2, 'psi_step': 0.5, 't_step': 0.5} if retry_tolerances is None
+                                 else retry_tolerances)
+        self.records = []
+        self.counts = {}
+        self.nb_retries = 0
+        self.is_aborted = False
+        self._snapshot = None
+        self._psi_soil_previous = None
+        self._nb_stalled_hours = 0
+
+    @property
+    def status(self) -> str:
+        """One of 'ok', 'flagged' (issues detected, simulation completed) or 'aborted'."""
+        return 'aborted' if self.is_aborted else 'flagged' if self.records else 'ok'
+
+    def snapshot(self, g: MTG):
+        """Saves the initial state of the hour (before solving), restored by `restore` before a retry."""
+        if self.policy == 'retry':
+            self._snapshot = {name: dict(g.property(name)) for name in ('psi_head', 'Tlc')}
+        pass
+
+    def restore(self, g: MTG):
+        for name, values in self._snapshot.items():
+            g.property(name).update(values)
+        pass
+
+    def calc_retry_params(self, params) -> dict:
+        """Returns the 'numerical_resolution' values of the retry, from HydroShoot `params`."""
+        return {name: type(getattr(params.numerical_resolution, name))(
+            getattr(params.numerical_resolution, name) * factor) for name, factor in self.retry_tolerances.items()}
+
+    def check(self, g: MTG, date_sim: datetime, n_iter: int, psi_soil: float, params, leaf_index: LeafIndex,
+              is_psi_soil_forced: bool = False, is_retry: bool = False, is_energy_budget: bool = True) -> list:
+        """Returns (and records) the issues detected after solving `date_sim`.
+
+        Args:
+            n_iter: number of hydraulic iterations of the hour, summed over all hydraulic loops
+            is_energy_budget: whether the leaf energy budget was solved (hydraulic loops nested in the leaf
+                temperature loop), False at night in night mode
+        """
+        vid_collar = g.node(g.root).vid_collar
+        flux, psi_collar = g.node(vid_collar).Flux, g.node(vid_collar).psi_head
+        leaf_psi = leaf_index.gather(g=g, property_name='psi_head')
+        leaf_temperature = leaf_index.gather(g=g, property_name='Tlc')
+
+        issues = []
+        if not (np.isfinite([flux, psi_collar, psi_soil]).all() and np.isfinite(leaf_psi).all() and
+                np.isfinite(leaf_temperature).all()):
+            issues.append(('non_finite', None, None))
+        max_iter = (params.numerical_resolution.max_iter *
+                    (self.retry_tolerances.get('max_iter', 1) if is_retry else 1))
+        max_iter_total = max_iter ** 2 if is_energy_budget else max_iter
+        if n_iter >= max_iter_total:
+            issues.append(('iteration_cap', n_iter, max_iter_total))
+        if psi_soil <= params.hydraulic.psi_min + self.psi_min_tolerance:
+            issues.append(('hydraulic_failure', psi_soil, params.hydraulic.psi_min))
+        t_min, t_max = self.leaf_temperature_bounds
+        if np.isfinite(leaf_temperature).any() and not (
+                t_min <= np.nanmin(leaf_temperature) and np.nanmax(leaf_temperature) <= t_max):
+            issues.append(('leaf_temperature_bounds',
+                           [float(np.nanmin(leaf_temperature)), float(np.nanmax(leaf_temperature))], [t_min, t_max]))
+
+        if not is_retry and not is_psi_soil_forced:
+            if self._psi_soil_previous is not None and flux > 0 and abs(psi_soil - self._psi_soil_previous) < 1.e-9:
+                self._nb_stalled_hours += 1
+            else:
+                self._nb_stalled_hours = 0
+            self._psi_soil_previous = psi_soil
+            if self._nb_stalled_hours == self.stalled_soil_hours:
+                issues.append(('stalled_soil_water', self._nb_stalled_hours, self.stalled_soil_hours))
+
+        records = [{'date': date_sim.isoformat(), 'issue': issue, 'value': value, 'threshold': threshold,
+                    'is_retry': is_retry}
+                   for issue, value, threshold in issues]
+        for record in records:
+            key = (record['issue'], is_retry)
+            self.counts[key] = self.counts.get(key, 0) + 1
+            if self.counts[key] == 1:
+                self.records.append(record)
+        return records
+
+    def abort(self) -> SimulationDiverged:
+        self.is_aborted = True
+        return SimulationDiverged(records=self.records)
+
+    def to_dict(self) -> dict:
+        return {'status': self.status, 'policy': self.policy, 'nb_retries': self.nb_retries, 'issues': self.records,
+                'nb_hours_per_issue': {f'{issue}{"_retry" if is_retry else ""}': count
+                                       for (issue, is_retry), count in self.counts.items()}}
@@ -2,24 +2,77 @@
 """This module performs a complete comutation scheme: irradiance absorption, gas-exchange, hydraulic structure,
 energy-exchange, and soil water depletion, for each given time step.
 """
+from contextlib import nullcontext
 from copy import deepcopy
 from datetime import datetime, timedelta
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
 
 import numpy as np
 from hydroshoot import (architecture, solver, io, soil, constants)
 from hydroshoot.energy import calc_effective_sky_temperature
 from hydroshoot.initialisation import init_model, init_hourly, set_collar_water_potential_function
 from openalea.mtg.mtg import MTG
-from openalea.plantgl.all import Scene, surface
-from pandas import DataFrame
+from pandas import DataFrame, concat
 
+from grapevine_stomatal_traits.simulator.canopy import LeafIndex, LeafIrradiance, LeafStaticInputs
+from grapevine_stomatal_traits.simulator.convergence import (SolverSettings, IterationCounter, DivergenceMonitor,
+                                                              RETRYABLE_ISSUES)
 from grapevine_stomatal_traits.simulator.inputs import HydroShootHourlyInputs
-from grapevine_stomatal_traits.simulator.irrigation import handle_irrigation
+from grapevine_stomatal_traits.simulator.irrigation import IrrigationStrategy, FixedIntervalReplacement, WaterBalance
+from grapevine_stomatal_traits.simulator.memory import MemoryProfiler
+from grapevine_stomatal_traits.simulator.output_writer import AsyncWriter
+from grapevine_stomatal_traits.simulator.summary import SummaryStatistics
+from grapevine_stomatal_traits.simulator.time_step import TimeSampling
+from grapevine_stomatal_traits.simulator.weather import HourlyForcing
 
+if TYPE_CHECKING:
+    from openalea.plantgl.all import Scene
 
-def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None, write_result: bool = True,
-        path_output: Path = None, is_save_mtg: bool = True, **kwargs) -> DataFrame:
+
+def _set_night_leaf_ppfd(g: MTG, date_sim: datetime) -> dict:
+    """Returns a `leaf_ppfd` input holding null irradiance at `date_sim`, which saves the irradiance calculation."""
+    null_irradiance = dict.fromkeys(g.property('geometry').keys(), 0.)
+    return {date_sim.strftime('%Y%m%d%H%M%S'): {
+        'diffuse_to_total_irradiance_ratio': 1.,
+        'Ei': null_irradiance,
+        'Eabs': null_irradiance}}
+
+
+def _solve_hour(g: MTG, inputs_hourly: HydroShootHourlyInputs, params, calc_collar_water_potential: IterationCounter,
+                is_night: bool, memory_profiler: MemoryProfiler, numerical_resolution: dict = None) -> (int, float):
+    """Solves the coupled hydraulic/energy interactions of the current hour, without leaf energy balance at night,
+    with `numerical_resolution` values temporarily overriding those of `params` if provided.
+
+    Returns:
+        the number of hydraulic iterations and the solver runtime [s]
+    """
+    is_energy_budget = params.simulation.energy_budget
+    numerical_resolution_default = {k: getattr(params.numerical_resolution, k) for k in (numerical_resolution or {})}
+    params.simulation.energy_budget = is_energy_budget and not is_night
+    for k, v in (numerical_resolution or {}).items():
+        setattr(params.numerical_resolution, k, v)
+    solve_time_on = datetime.now()
+    try:
+        with memory_profiler.phase('solve'):
+            solver.solve_interactions(
+                g=g, meteo=inputs_hourly.weather.loc[inputs_hourly.date], psi_soil=inputs_hourly.psi_soil,
+                t_soil=inputs_hourly.soil_temperature, t_sky_eff=inputs_hourly.sky_temperature, params=params,
+                calc_collar_water_potential=calc_collar_water_potential)
+    finally:
+        params.simulation.energy_budget = is_energy_budget
+        for k, v in numerical_resolution_default.items():
+            setattr(params.numerical_resolution, k, v)
+    return calc_collar_water_potential.reset(), (datetime.now() - solve_time_on).total_seconds()
+
+
+def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: 'Scene' = None, write_result: bool = True,
+        path_output: Path = None, is_save_mtg: bool = True, static_inputs: LeafStaticInputs = None,
+        irrigation_strategy: IrrigationStrategy = None, is_night_mode: bool = False,
+        solver_settings: SolverSettings = None, memory_profiler: MemoryProfiler = None,
+        summary: SummaryStatistics = None, divergence_monitor: DivergenceMonitor = None,
+        time_sampling: TimeSampling = None, is_solver_diagnostics: bool = False, **kwargs) -> DataFrame:
     """Calculates leaf gas and energy exchange in addition to the hydraulic structure of an individual plant.
 
     Args:
@@ -30,6 +83,23 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
         write_result: if True then hourly plant-scale outputs are written into a CSV file
         path_output: summary data output file path
         is_save_mtg: True to save the mtg object (default False)
+        static_inputs: leaf form factors and nitrogen content, used instead of `form_factors` and `leaf_nitrogen`
+        irrigation_strategy: irrigation strategy, used instead of `drip_rate`, `replacement_fraction` and
+            `irrigation_freq`
+        is_night_mode: if True, hours with no global radiation are solved without irradiance calculation and
+            without leaf energy balance (leaf temperature is set to air temperature), see `benchmarks/night_mode.py`
+            for the resulting error
+        solver_settings: numerical tolerances of the hourly coupled solver
+        memory_profiler: if provided, memory use is measured per simulation phase (the report is written by the
+            caller)
+        summary: if provided, its accumulators are updated with the plant- and leaf-scale values of each hour (see
+            `simulator.summary` for the available values)
+        divergence_monitor: if provided, each solved hour is checked for divergence or hydraulic failure and issues
+            are handled according to its policy
+        time_sampling: simulated hours (default: all), for coarse time-step screening runs (see
+            `simulator.time_step`)
+        is_solver_diagnostics: if True, the number of solver iterations (n_iter) and the solver runtime (solve_time,
+            [s]) of each hour are added to the outputs (not by default, the runtime making outputs non-reproducible)
         kwargs: can include:
             psi_soil_init (float): [MPa] initial soil water potential
             psi_soil (float): [MPa] predawn soil water potential
@@ -37,7 +107,7 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
             sun2scene (Scene): PlantGl scene, when prodivided, a sun object (sphere) is added to it
             soil_size (float): [cm] length of squared mesh size
             leaf_nitrogen (dict): leaf nitrogen content per area (key=(int) mtg leaf vertex, value=(float) nitrogen content)
-            leaf_ppfd (dict of dict): incident and absorbed PPFD by each leaf per each simulated hour
+            leaf_ppfd (dict of dict or LeafIrradiance): incident and absorbed PPFD by each leaf per each simulated hour
                 key:(datetime) simulated datetime, value:
                     key:'Ei', value: (key: (int) mtg leaf vertex, value: (incident PPFD)),
                     key:'Eabs', value: (key: (int) mtg leaf vertex, value: (absorbed PPFD))
@@ -51,7 +121,9 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
 
     Returns:
         Absorbed whole plant global irradiance (Rg), net photosynthesis (An), transpiration (E) and
-            median leaf temperature (Tleaf)
+            median leaf temperature (Tleaf), in addition to the number of hours each simulated hour stands for
+            (duration, [h], 1 unless `time_sampling` is coarser than hourly) and, if `is_solver_diagnostics`, solver
+            diagnostics. 'irr' is the water applied since the previous simulated hour.
 
     """
     print('++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
@@ -59,16 +131,28 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
     print('++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++')
     time_on = datetime.now()
 
+    from openalea.plantgl.all import surface
+
+    if static_inputs is not None:
+        kwargs.update({'form_factors': static_inputs.form_factors, 'leaf_nitrogen': static_inputs.leaf_nitrogen})
+    if isinstance(kwargs.get('leaf_ppfd'), dict):
+        kwargs['leaf_ppfd'] = LeafIrradiance.from_dict(kwargs['leaf_ppfd'])
+    if solver_settings is not None:
+        params = solver_settings.update_params(params)
+    if memory_profiler is None:
+        memory_profiler = MemoryProfiler(is_enabled=False)
+
     # Read user parameters
-    inputs = io.HydroShootInputs(
-        path_project=wd,
-        path_weather=path_weather,
-        scene=scene,
-        user_params=params,
-        is_write_result=write_result,
-        path_output_file=path_output,
-        **kwargs)
-    io.verify_inputs(g=g, inputs=inputs)
+    with memory_profiler.phase('read_inputs'):
+        inputs = io.HydroShootInputs(
+            path_project=wd,
+            path_weather=path_weather,
+            scene=scene,
+            user_params=params,
+            is_write_result=write_result,
+            path_output_file=path_output,
+            **kwargs)
+        io.verify_inputs(g=g, inputs=inputs)
     params = inputs.params
 
     # ==============================================================================
@@ -76,22 +160,21 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
     # ==============================================================================
     time_conv = params.simulation.conv_to_second
     io.print_sim_infos(inputs=inputs)
-    g = init_model(g=g, inputs=inputs)
+    with memory_profiler.phase('init_model'):
+        g = init_model(g=g, inputs=inputs)
 
     irrigation_rate = 0.
-    irrigation_remain = 0.
-    if any([k in kwargs for k in ('irrigation_freq', 'drip_rate', 'replacement_fraction')]):
-        is_irrigation = True
-        drip_rate = kwargs['drip_rate']
-        replacement_fraction = kwargs['replacement_fraction']
-        irrigation_freq = kwargs['irrigation_freq']
-        date_start_irrigation = params.simulation.date_beg + timedelta(days=irrigation_freq)
-    else:
-        is_irrigation = False
-        drip_rate = None
-        replacement_fraction = None
-        irrigation_freq = None
-        date_start_irrigation = None
+    if irrigation_strategy is None and any([k in kwargs for k in ('irrigation_freq', 'drip_rate',
+                                                                    'replacement_fraction')]):
+        irrigation_strategy = FixedIntervalReplacement(
+            drip_rate=kwargs['drip_rate'],
+            replacement_fraction=kwargs['replacement_fraction'],
+            irrigation_freq=kwargs['irrigation_freq'],
+            date_start=params.simulation.date_beg + timedelta(days=kwargs['irrigation_freq']))
+    is_irrigation = irrigation_strategy is not None
+    if is_irrigation:
+        irrigation_strategy = deepcopy(irrigation_strategy)
+    water_balance = WaterBalance(window_size=irrigation_strategy.window_size if is_irrigation else 24)
 
     is_psi_soil_forced = True if inputs.psi_soil_forced is not None else False
     if is_psi_soil_forced:
@@ -101,7 +184,20 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
     else:
         psi_soil = None
 
-    calc_collar_water_potential = set_collar_water_potential_function(params=params)
+    calc_collar_water_potential = IterationCounter(func=set_collar_water_potential_function(params=params))
+
+    leaf_index = LeafIndex.from_mtg(g=g, leaf_lbl_prefix=params.mtg_api.leaf_lbl_prefix)
+    leaf_area = np.array([surface(g.node(vid).geometry) for vid in leaf_index.vids.tolist()]) * (
+            params.simulation.conv_to_meter ** 2)
+    vid_collar = g.node(g.root).vid_collar
+    if summary is not None:
+        summary.leaf_vids = leaf_index.vids
+
+    # Weather-only forcing is prepared for the whole simulated period
+    with memory_profiler.phase('prepare_weather'):
+        forcing = HourlyForcing(weather=inputs.weather, dates=params.simulation.date_range)
+    samples, durations = (TimeSampling() if time_sampling is None else time_sampling).sample(
+        dates=params.simulation.date_range, is_night=forcing.is_night)
 
     # ==============================================================================
     # Simulations
@@ -115,121 +211,194 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
     psi_collar_ls = []
     psi_leaf_ls = []
     theta_soil = []
-    leaf_temperature_dict = {}
-
-    # The time loop +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    inputs_hourly = HydroShootHourlyInputs(
-        psi_soil=psi_soil, sun2scene=inputs.sun2scene, is_psi_soil_forced=is_psi_soil_forced)
-
-    for date in params.simulation.date_range:
-        print("=" * 72)
-        print(f'Date: {date}\n')
-        if is_irrigation:
-            if date >= date_start_irrigation:
-                irrigation_rate, irrigation_remain = handle_irrigation(
-                    date_sim=date,
-                    date_start_irrigation=date_start_irrigation,
-                    irrigation_freq=irrigation_freq,
-                    sapflow=sapflow,
-                    drip_rate=drip_rate,
-                    replacement_fraction=replacement_fraction,
-                    irrigation_to_apply=irrigation_remain)
-            else:
-                irrigation_rate = 0
-                irrigation_remain = 0
-        irrigation_ls.append(irrigation_rate)
-
-        inputs_hourly.update(g=g, date_sim=date, hourly_weather=inputs.weather[inputs.weather.index == date],
-                             psi_pd=inputs.psi_pd, params=params, water_input=irrigation_rate)
-
-        g, diffuse_to_total_irradiance_ratio = init_hourly(
-            g=g, inputs_hourly=inputs_hourly, leaf_ppfd=inputs.leaf_ppfd, params=params)
-
-        inputs_hourly.sky_temperature = calc_effective_sky_temperature(
-            diffuse_to_total_irradiance_ratio=diffuse_to_total_irradiance_ratio,
-            temperature_cloud=params.energy.t_cloud,
-            temperature_sky=params.energy.t_sky)
-
-        solver.solve_interactions(
-            g=g, meteo=inputs_hourly.weather.loc[date], psi_soil=inputs_hourly.psi_soil,
-            t_soil=inputs_hourly.soil_temperature, t_sky_eff=inputs_hourly.sky_temperature, params=params,
-            calc_collar_water_potential=calc_collar_water_potential)
-
-        # Write mtg to an external file
-        if is_save_mtg and (scene is not None):
-            architecture.save_mtg(g=g, scene=scene, file_path=inputs.path_output_dir)
-
-        # Plot stuff..
-        sapflow.append(g.node(g.node(g.root).vid_collar).Flux)
-        # sapEast.append(g.node(arm_vid['arm1']).Flux)
-        # sapWest.append(g.node(arm_vid['arm2']).Flux)
-
-        # Trace intercepted irradiance on each time step
-        rg_ls.append(
-            sum([g.node(vid).Ei / (0.48 * 4.6) * surface(g.node(vid).geometry) * (params.simulation.conv_to_meter ** 2)
-                 for vid in g.property('geometry') if g.node(vid).label.startswith('L')]))
-
-        an_ls.append(g.node(g.node(g.root).vid_collar).FluxC)
-
-        psi_soil_ls.append(inputs_hourly.psi_soil)
-        psi_collar_ls.append(g.node(g.node(g.root).vid_collar).psi_head)
-        psi_leaf_ls.append(np.median([g.node(vid).psi_head for vid in g.property("gs").keys()]))
-        theta_soil.append(soil.calc_volumetric_water_content_from_water_potential(
-            constants.water_density * constants.gravitational_acceleration * inputs_hourly.psi_soil,
-            *soil.SOIL_PROPS[params.soil.soil_class][:-1]))
-
-        leaf_temperature_dict[date] = deepcopy(g.property('Tlc'))
-
-        print('---------------------------')
-        print(f'psi_soil {inputs_hourly.psi_soil:.4f}')
-        print(f'psi_collar {g.node(g.node(g.root).vid_collar).psi_head:.4f}')
-        print(f'psi_leaf {np.median([g.node(vid).psi_head for vid in g.property("gs").keys()]):.4f}')
-        print('')
-        # print('Rdiff/Rglob ', RdRsH_ratio)
-        # print('t_sky_eff ', t_sky_eff)
-        print(f'gs: {np.median(list(g.property("gs").values())):.4f}')
-        print(f'flux H2O {g.node(g.node(g.root).vid_collar).Flux * 1000. * time_conv:.4f}')
-        print(f'flux C2O {g.node(g.node(g.root).vid_collar).FluxC}')
-        print(f'Tleaf {np.median([g.node(vid).Tlc for vid in g.property("gs").keys()]):.2f}', ' ',
-              f'Tair {inputs_hourly.weather.loc[date, "Tac"]:.2f}')
-        print('')
-        print(f'irrigation: {irrigation_rate}')
-        print('')
-        print("=" * 72)
-
-    # End time loop +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-
-    # Write output
-    # Plant total transpiration
-    sapflow = [flow * time_conv * 1000. for flow in sapflow]
-
-    # sapEast, sapWest = [np.array(flow) * time_conv * 1000. for i, flow in enumerate((sapEast, sapWest))]
-
-    # Median leaf temperature
-    t_ls = [np.median(list(leaf_temperature_dict[date].values())) for date in params.simulation.date_range]
-
-    # Intercepted global radiation
-    rg_ls = np.array(rg_ls) / (params.planting.spacing_on_row * params.planting.spacing_between_rows)
-
-    # Results DataFrame
-    results_df = DataFrame({
-        'Rg': rg_ls,
-        'An': an_ls,
-        'E': sapflow,
-        # 'sapEast': sapEast,
-        # 'sapWest': sapWest,
-        'Tleaf': t_ls,
-        'irr': irrigation_ls,
-        'psi_soil': psi_soil_ls,
-        'psi_collar': psi_collar_ls,
-        'psi_leaf': psi_leaf_ls,
-        'theta_soil': theta_soil
-    },
-        index=params.simulation.date_range)
-
-    # Write
-    if write_result:
-        results_df.to_csv(inputs.path_output_file, sep=';', decimal='.')
+    n_iter_ls = []
+    solve_time_ls = []
+    t_ls = []
+
+    # Outputs are written by a background thread; hourly mtg files are first saved to fast local storage. The writer
+    # is closed (pending writes drained) before the staging directory is removed, also when the time loop fails
+    with (TemporaryDirectory(prefix='hydroshoot_mtg_') if is_save_mtg and (scene is not None) else nullcontext()) as \
+            path_mtg_staging, AsyncWriter() as writer:
+        path_mtg_staging = None if path_mtg_staging is None else Path(path_mtg_staging)
+
+        # The time loop +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+        inputs_hourly = HydroShootHourlyInputs(
+            psi_soil=psi_soil, sun2scene=inputs.sun2scene, is_psi_soil_forced=is_psi_soil_forced)
+
+        i_previous = None
+        for i_date, duration in zip(samples.tolist(), durations.tolist()):
+            date = params.simulation.date_range[i_date]
+            print("=" * 72)
+            print(f'Date: {date}\n')
+            is_night = is_night_mode and forcing.is_night[i_date]
+
+            # Hours elapsed since the previous simulated hour hold its transpiration rate
+            irrigation_rate = 0.
+            irrigation_hour = 0.
+            for i_hour in range(i_date if i_previous is None else i_previous + 1, i_date + 1):
+                if is_irrigation:
+                    irrigation_hour = irrigation_strategy.step(
+                        date_sim=params.simulation.date_range[i_hour], water_balance=water_balance,
+                        psi_soil=inputs_hourly.psi_soil)
+                irrigation_rate += irrigation_hour
+                if i_hour != i_date:
+                    water_balance.add(transpiration=sapflow[-1] * time_conv, irrigation=irrigation_hour)
+            irrigation_ls.append(irrigation_rate)
+
+            with memory_profiler.phase('hourly_update'):
+                inputs_hourly.update(g=g, date_sim=date, hourly_weather=forcing.get_weather(i_date),
+                                     psi_pd=inputs.psi_pd, params=params, water_input=irrigation_rate,
+                                     is_update_scene=not is_night,
+                                     duration=1 if i_previous is None else i_date - i_previous)
+            i_previous = i_date
+
+            with memory_profiler.phase('init_hourly'):
+                g, diffuse_to_total_irradiance_ratio = init_hourly(
+                    g=g, inputs_hourly=inputs_hourly, params=params,
+                    leaf_ppfd=_set_night_leaf_ppfd(g=g, date_sim=date) if is_night else inputs.leaf_ppfd)
+
+            inputs_hourly.sky_temperature = calc_effective_sky_temperature(
+                diffuse_to_total_irradiance_ratio=diffuse_to_total_irradiance_ratio,
+                temperature_cloud=params.energy.t_cloud,
+                temperature_sky=params.energy.t_sky)
+
+            if divergence_monitor is not None:
+                divergence_monitor.snapshot(g=g)
+            n_iter, solve_time = _solve_hour(
+                g=g, inputs_hourly=inputs_hourly, params=params,
+                calc_collar_water_potential=calc_collar_water_potential, is_night=is_night,
+                memory_profiler=memory_profiler)
+
+            if divergence_monitor is not None:
+                issues = divergence_monitor.check(
+                    g=g, date_sim=date, n_iter=n_iter, psi_soil=inputs_hourly.psi_soil, params=params,
+                    leaf_index=leaf_index, is_psi_soil_forced=is_psi_soil_forced,
+                    is_energy_budget=params.simulation.energy_budget and not is_night)
+                if issues and divergence_monitor.policy == 'retry' and all(
+                        r['issue'] in RETRYABLE_ISSUES for r in issues):
+                    print(f'divergence detected ({", ".join(r["issue"] for r in issues)}), retrying')
+                    divergence_monitor.nb_retries += 1
+                    divergence_monitor.restore(g=g)
+                    n_iter_retry, solve_time_retry = _solve_hour(
+                        g=g, inputs_hourly=inputs_hourly, params=params,
+                        calc_collar_water_potential=calc_collar_water_potential, is_night=is_night,
+                        memory_profiler=memory_profiler,
+                        numerical_resolution=divergence_monitor.calc_retry_params(params))
+                    n_iter += n_iter_retry
+                    solve_time += solve_time_retry
+                    issues = divergence_monitor.check(
+                        g=g, date_sim=date, n_iter=n_iter_retry, psi_soil=inputs_hourly.psi_soil, params=params,
+                        leaf_index=leaf_index, is_psi_soil_forced=is_psi_soil_forced, is_retry=True,
+                        is_energy_budget=params.simulation.energy_budget and not is_night)
+                if issues and divergence_monitor.policy != 'flag':
+                    raise divergence_monitor.abort()
+
+            solve_time_ls.append(solve_time)
+            n_iter_ls.append(n_iter)
+
+            # Write mtg to an external file
+            if path_mtg_staging is not None:
+                path_mtg_staging_hour = path_mtg_staging / g.date
+                path_mtg_staging_hour.mkdir()
+                with memory_profiler.phase('save_mtg'):
+                    architecture.save_mtg(g=g, scene=scene, file_path=path_mtg_staging_hour)
+                writer.move_files(path_src_dir=path_mtg_staging_hour, path_dst_dir=Path(inputs.path_output_dir))
+
+            # Plot stuff..
+            sapflow.append(g.node(vid_collar).Flux)
+            water_balance.add(transpiration=sapflow[-1] * time_conv, irrigation=irrigation_hour)
+            # sapEast.append(g.node(arm_vid['arm1']).Flux)
+            # sapWest.append(g.node(arm_vid['arm2']).Flux)
+
+            # Trace intercepted irradiance on each time step
+            rg_ls.append((leaf_index.gather(g=g, property_name='Ei') / (0.48 * 4.6) * leaf_area).sum())
+
+            an_ls.append(g.node(vid_collar).FluxC)
+
+            leaf_temperature = leaf_index.gather(g=g, property_name='Tlc')
+            leaf_psi = leaf_index.gather(g=g, property_name='psi_head')
+            leaf_gs = leaf_index.gather(g=g, property_name='gs')
+            t_ls.append(np.median(leaf_temperature))
+            psi_leaf = np.median(leaf_psi)
+
+            psi_soil_ls.append(inputs_hourly.psi_soil)
+            psi_collar_ls.append(g.node(vid_collar).psi_head)
+            psi_leaf_ls.append(psi_leaf)
+            theta_soil.append(soil.calc_volumetric_water_content_from_water_potential(
+                constants.water_density * constants.gravitational_acceleration * inputs_hourly.psi_soil,
+                *soil.SOIL_PROPS[params.soil.soil_class][:-1]))
+
+            if summary is not None:
+                t_air = inputs_hourly.weather.loc[date, 'Tac']
+                summary.update(values={
+                    'Rg': rg_ls[-1] / (params.planting.spacing_on_row * params.planting.spacing_between_rows),
+                    'An': an_ls[-1],
+                    'An_mass': an_ls[-1] * 1.e-6 * constants.co2_molar_mass * 3600.,
+                    'E': sapflow[-1] * time_conv * 1000.,
+                    'Tleaf': t_ls[-1],
+                    'Tair': t_air,
+                    'Tleaf_excess': t_ls[-1] - t_air,
+                    'irr': irrigation_rate,
+                    'psi_soil': psi_soil_ls[-1],
+                    'psi_collar': psi_collar_ls[-1],
+                    'psi_leaf': psi_leaf,
+                    'leaf_temperature': leaf_temperature,
+                    'leaf_temperature_excess': leaf_temperature - t_air,
+                    'leaf_psi': leaf_psi,
+                    'leaf_gs': leaf_gs}, date_sim=date, duration=duration)
+
+            print('---------------------------')
+            print(f'psi_soil {inputs_hourly.psi_soil:.4f}')
+            print(f'psi_collar {g.node(vid_collar).psi_head:.4f}')
+            print(f'psi_leaf {psi_leaf:.4f}')
+            print('')
+            # print('Rdiff/Rglob ', RdRsH_ratio)
+            # print('t_sky_eff ', t_sky_eff)
+            print(f'gs: {np.median(leaf_gs):.4f}')
+            print(f'flux H2O {g.node(vid_collar).Flux * 1000. * time_conv:.4f}')
+            print(f'flux C2O {g.node(vid_collar).FluxC}')
+            print(f'Tleaf {t_ls[-1]:.2f}', ' ',
+                  f'Tair {inputs_hourly.weather.loc[date, "Tac"]:.2f}')
+            print('')
+            print(f'irrigation: {irrigation_rate}')
+            print(f'solver: {n_iter_ls[-1]} iterations, {solve_time_ls[-1]:.1f} s')
+            print('')
+            print("=" * 72)
+
+        # End time loop +++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
+
+        # Write output
+        # Plant total transpiration
+        sapflow = [flow * time_conv * 1000. for flow in sapflow]
+
+        # sapEast, sapWest = [np.array(flow) * time_conv * 1000. for i, flow in enumerate((sapEast, sapWest))]
+
+        # Intercepted global radiation
+        rg_ls = np.array(rg_ls) / (params.planting.spacing_on_row * params.planting.spacing_between_rows)
+
+        # Results DataFrame
+        results_df = DataFrame({
+            'Rg': rg_ls,
+            'An': an_ls,
+            'E': sapflow,
+            # 'sapEast': sapEast,
+            # 'sapWest': sapWest,
+            'Tleaf': t_ls,
+            'irr': irrigation_ls,
+            'psi_soil': psi_soil_ls,
+            'psi_collar': psi_collar_ls,
+            'psi_leaf': psi_leaf_ls,
+            'theta_soil': theta_soil,
+            'duration': durations
+        },
+            index=params.simulation.date_range[samples])
+        if is_solver_diagnostics:
+            results_df['n_iter'] = n_iter_ls
+            results_df['solve_time'] = solve_time_ls
+
+        # Write
+        if write_result:
+            writer.write_text(path_file=inputs.path_output_file, text=results_df.to_csv(sep=';', decimal='.'))
 
     time_off = datetime.now()
 
@@ -238,3 +407,43 @@ def run(g: MTG, wd: Path, params: dict, path_weather: Path, scene: Scene = None,
     print("end time", time_off)
     print(f"--- Total runtime: {(time_off - time_on).seconds} sec ---")
     return results_df
+
+
+def run_row(g: MTG, row_leaf_ppfd: dict, reference_plant: int, write_result: bool = True, path_output: Path = None,
+            summary: SummaryStatistics = None, divergence_monitor: DivergenceMonitor = None, **kwargs) -> DataFrame:
+    """Runs `run` for each plant of a row (see `simulator.row`), the plants sharing the topology, geometry and static
+    inputs of `g` but each having its own leaf irradiance.
+
+    Plants are solved one after the other, each on a copy of `g` sharing its leaf geometry, the reference plant first
+    (hourly mtgs are only saved for the reference plant).
+
+    Args:
+        g: mtg of the reference plant
+        row_leaf_ppfd: key=(int) plant index, value=(LeafIrradiance) leaf irradiance of the plant
+        reference_plant: index of the plant whose irradiance was computed on `g` itself, to which `summary` and
+            `divergence_monitor` apply
+        write_result: if True then the hourly outputs of all plants are written into a CSV file
+        path_output: output file path, also setting the directory of the hourly mtgs of the reference plant
+        kwargs: passed to `run`, except `leaf_ppfd`
+
+    Returns:
+        hourly outputs of `run`, with the plant index ('plant')
+    """
+    geometry = g.property('geometry')
+    is_save_mtg = kwargs.pop('is_save_mtg', True)
+    res = []
+    for plant in sorted(row_leaf_ppfd, key=lambda i: i != reference_plant):
+        is_reference = plant == reference_plant
+        g_plant = deepcopy(g, memo={id(shape): shape for shape in geometry.values()})
+        res.append(run(
+            g=g_plant, write_result=False, path_output=path_output, leaf_ppfd=row_leaf_ppfd[plant],
+            is_save_mtg=is_save_mtg and is_reference,
+            summary=summary if is_reference else None,
+            divergence_monitor=divergence_monitor if is_reference else None,
+            **kwargs).assign(plant=plant))
+        del g_plant
+
+    results_df = concat(res)
+    if write_result:
+        results_df.to_csv(path_output, sep=';', decimal='.')
+    return results_df
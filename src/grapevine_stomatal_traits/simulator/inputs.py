@@ -1,16 +1,18 @@
 from datetime import datetime
+from typing import TYPE_CHECKING
 
-from hydroshoot.display import visu
 from hydroshoot.energy import force_soil_temperature
 from hydroshoot.params import Params
 from hydroshoot.soil import update_soil_water_potential
 from openalea.mtg.mtg import MTG
-from openalea.plantgl.all import Scene
 from pandas import DataFrame
 
+if TYPE_CHECKING:
+    from openalea.plantgl.all import Scene
+
 
 class HydroShootHourlyInputs(object):
-    def __init__(self, psi_soil: float, sun2scene: Scene, is_psi_soil_forced: bool = False):
+    def __init__(self, psi_soil: float, sun2scene: 'Scene', is_psi_soil_forced: bool = False):
         self.date = None
         self.weather = None
         self.psi_soil = psi_soil
@@ -20,16 +22,26 @@ class HydroShootHourlyInputs(object):
         self.is_psi_soil_forced = is_psi_soil_forced
 
     def update(self, g: MTG, date_sim: datetime, hourly_weather: DataFrame, psi_pd: DataFrame, params: Params,
-               water_input: float = None):
+               water_input: float = None, is_update_scene: bool = True, duration: float = 1):
+        """Sets the inputs of `date_sim`.
+
+        Args:
+            water_input: [kg] water supplied since the previous simulated hour
+            is_update_scene: if False, the sun-to-scene representation is not rebuilt
+            duration: [h] time elapsed since the previous simulated hour, over which its transpiration rate is held
+        """
         self.date = date_sim
         self.weather = hourly_weather
-        self.calc_psi_soil(g=g, water_input=water_input, psi_pd=psi_pd, params=params)
-        self.sun2scene = visu(g, def_elmnt_color_dict=True, scene=Scene()) if self.sun2scene is not None else None
+        self.calc_psi_soil(g=g, water_input=water_input, psi_pd=psi_pd, params=params, duration=duration)
+        if self.sun2scene is not None and is_update_scene:
+            from hydroshoot.display import visu
+            from openalea.plantgl.all import Scene
+            self.sun2scene = visu(g, def_elmnt_color_dict=True, scene=Scene())
         self.soil_temperature = force_soil_temperature(self.weather)
 
         pass
 
-    def calc_psi_soil(self, g: MTG, water_input: float, psi_pd: DataFrame, params: Params):
+    def calc_psi_soil(self, g: MTG, water_input: float, psi_pd: DataFrame, params: Params, duration: float = 1):
         if not self.is_psi_soil_forced:
             if self.date.hour == 0:
                 try:
@@ -41,7 +53,8 @@ class HydroShootHourlyInputs(object):
                 self.psi_soil = update_soil_water_potential(
                     psi_soil_init=self.psi_soil,
                     water_withdrawal=(
-                            (g.node(g.node(g.root).vid_collar).Flux * params.simulation.conv_to_second) - water_input),
+                            (g.node(g.node(g.root).vid_collar).Flux * params.simulation.conv_to_second * duration) -
+                            water_input),
                     soil_class=params.soil.soil_class,
                     soil_total_volume=params.soil.soil_volume,
                     psi_min=params.hydraulic.psi_min)
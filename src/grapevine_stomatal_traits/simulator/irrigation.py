@@ -1,5 +1,11 @@
+from collections import deque
+from copy import deepcopy
 from datetime import datetime
 
+from hydroshoot.params import Params
+from hydroshoot.soil import update_soil_water_potential
+from pandas import DataFrame, Series
+
 
 def handle_irrigation(date_sim: datetime, date_start_irrigation: datetime, irrigation_freq: int, sapflow: list,
                       drip_rate: float, replacement_fraction: float, irrigation_to_apply: float = 0.) -> (float, float):
@@ -32,3 +38,215 @@ def handle_irrigation(date_sim: datetime, date_start_irrigation: datetime, irrig
         irrigation_applied = 0
         irrigation_remain = 0
     return irrigation_applied, irrigation_remain
+
+
+class WaterBalance(object):
+    """Running accumulators of plant transpiration and irrigation [kg], updated once per simulated time step."""
+    __slots__ = ('window_size', '_window', '_window_sum', 'transpiration_total', 'irrigation_total',
+                 'transpiration_since_event')
+
+    def __init__(self, window_size: int = 24):
+        """
+        Args:
+            window_size: number of time steps over which the moving sum of transpiration is kept
+        """
+        self.window_size = window_size
+        self._window = deque()
+        self._window_sum = 0.
+        self.transpiration_total = 0.
+        self.irrigation_total = 0.
+        self.transpiration_since_event = 0.
+
+    def add(self, transpiration: float, irrigation: float = 0.):
+        """
+        Args:
+            transpiration: [kg] plant transpiration over the time step
+            irrigation: [kg] water applied over the time step
+        """
+        self._window.append(transpiration)
+        self._window_sum += transpiration
+        if len(self._window) > self.window_size:
+            self._window_sum -= self._window.popleft()
+        self.transpiration_total += transpiration
+        self.irrigation_total += irrigation
+        self.transpiration_since_event += transpiration
+        pass
+
+    @property
+    def transpiration_window(self) -> float:
+        """[kg] transpiration over the last `window_size` time steps."""
+        return self._window_sum
+
+    def reset_event(self):
+        self.transpiration_since_event = 0.
+        pass
+
+
+class IrrigationStrategy(object):
+    """Base class of irrigation strategies.
+
+    At each time step, `step` adds the water demand decided by the strategy (`calc_demand`) to the irrigation backlog,
+    then applies the backlog at most at the drip rate. Irrigation is only applied from `date_start` on.
+    """
+    window_size = 24
+
+    def __init__(self, drip_rate: float, date_start: datetime, hour: int = 5):
+        """
+        Args:
+            drip_rate: [kg h-1] nominal rate of the dripper (one drip per vine is assumed)
+            date_start: date on which irrigation starts
+            hour: hour of the day at which irrigation events are decided
+        """
+        self.drip_rate = drip_rate
+        self.date_start = date_start
+        self.hour = hour
+        self.irrigation_remain = 0.
+
+    def calc_demand(self, date_sim: datetime, water_balance: WaterBalance, psi_soil: float) -> float:
+        """Returns the water amount [kg] to add to the irrigation backlog at `date_sim`."""
+        raise NotImplementedError
+
+    def step(self, date_sim: datetime, water_balance: WaterBalance, psi_soil: float) -> float:
+        """Returns the irrigation rate [kg h-1] applied at `date_sim`."""
+        if date_sim < self.date_start:
+            self.irrigation_remain = 0.
+            return 0.
+        demand = self.calc_demand(date_sim=date_sim, water_balance=water_balance, psi_soil=psi_soil)
+        if demand > 0:
+            water_balance.reset_event()
+        self.irrigation_remain += demand
+        irrigation_applied = min(self.irrigation_remain, self.drip_rate)
+        self.irrigation_remain = max(0.0, self.irrigation_remain - irrigation_applied)
+        return irrigation_applied
+
+
+class FixedIntervalReplacement(IrrigationStrategy):
+    """Replaces a fraction of the water transpired since the previous irrigation, every `irrigation_freq` days."""
+
+    def __init__(self, drip_rate: float, replacement_fraction: float, irrigation_freq: int, date_start: datetime,
+                 hour: int = 5):
+        """
+        Args:
+            replacement_fraction: [-] fraction of plant water requirements fulfillment (0 for no irrigation,
+                1 for complete fulfillment)
+            irrigation_freq: number of days between two consecutive irrigation applications
+        """
+        super(FixedIntervalReplacement, self).__init__(drip_rate=drip_rate, date_start=date_start, hour=hour)
+        self.replacement_fraction = replacement_fraction
+        self.irrigation_freq = irrigation_freq
+        self.window_size = 24 * irrigation_freq
+
+    def calc_demand(self, date_sim: datetime, water_balance: WaterBalance, psi_soil: float) -> float:
+        days_since_irrigation_start = (date_sim - self.date_start).days
+        if days_since_irrigation_start % self.irrigation_freq == 0 and date_sim.hour == self.hour:
+            return water_balance.transpiration_window * self.replacement_fraction
+        return 0.
+
+
+class SoilWaterPotentialThreshold(IrrigationStrategy):
+    """Replaces a fraction of the water transpired since the previous irrigation once soil water potential drops
+    below a threshold (checked once a day)."""
+
+    def __init__(self, drip_rate: float, psi_threshold: float, replacement_fraction: float, date_start: datetime,
+                 hour: int = 5):
+        """
+        Args:
+            psi_threshold: [MPa] soil water potential below which irrigation is triggered
+            replacement_fraction: [-] fraction of the water transpired since the previous irrigation to replace
+        """
+        super(SoilWaterPotentialThreshold, self).__init__(drip_rate=drip_rate, date_start=date_start, hour=hour)
+        self.psi_threshold = psi_threshold
+        self.replacement_fraction = replacement_fraction
+
+    def calc_demand(self, date_sim: datetime, water_balance: WaterBalance, psi_soil: float) -> float:
+        if date_sim.hour == self.hour and psi_soil is not None and psi_soil < self.psi_threshold:
+            return water_balance.transpiration_since_event * self.replacement_fraction
+        return 0.
+
+
+class DeficitTarget(IrrigationStrategy):
+    """Keeps the cumulative irrigation at a target fraction of the cumulative transpiration (regulated deficit),
+    topping it up every `irrigation_freq` days."""
+
+    def __init__(self, drip_rate: float, target_fraction: float, date_start: datetime, irrigation_freq: int = 1,
+                 hour: int = 5):
+        """
+        Args:
+            target_fraction: [-] targeted ratio of cumulative irrigation to cumulative transpiration
+            irrigation_freq: number of days between two consecutive irrigation applications
+        """
+        super(DeficitTarget, self).__init__(drip_rate=drip_rate, date_start=date_start, hour=hour)
+        self.target_fraction = target_fraction
+        self.irrigation_freq = irrigation_freq
+
+    def calc_demand(self, date_sim: datetime, water_balance: WaterBalance, psi_soil: float) -> float:
+        days_since_irrigation_start = (date_sim - self.date_start).days
+        if days_since_irrigation_start % self.irrigation_freq == 0 and date_sim.hour == self.hour:
+            return max(0., self.target_fraction * water_balance.transpiration_total - water_balance.irrigation_total -
+                       self.irrigation_remain)
+        return 0.
+
+
+def replay_irrigation(strategy: IrrigationStrategy, transpiration: Series, psi_soil_init: float,
+                      params: Params) -> DataFrame:
+    """Evaluates an irrigation strategy against a stored hourly transpiration response, using the soil model only.
+
+    The soil water balance follows `HydroShootHourlyInputs.calc_psi_soil`. Transpiration is taken as given, i.e. the
+    stomatal response to the resulting soil water potential is ignored: replays rank candidate strategies, the best
+    of which are then to be verified with a full simulation.
+
+    Args:
+        strategy: irrigation strategy, it is not modified (a copy is replayed)
+        transpiration: [kg h-1] hourly plant transpiration, indexed by datetime
+        psi_soil_init: [MPa] soil water potential at the first simulated hour
+        params: HydroShoot parameters of the simulation that produced `transpiration`
+
+    Returns:
+        hourly applied irrigation ('irr', kg h-1) and soil water potential ('psi_soil', MPa)
+    """
+    strategy = deepcopy(strategy)
+    water_balance = WaterBalance(window_size=strategy.window_size)
+    psi_soil = psi_soil_init
+    transpiration_previous = 0.
+    irrigation_ls = []
+    psi_soil_ls = []
+    for date_sim, transpiration_hourly in transpiration.items():
+        irrigation = strategy.step(date_sim=date_sim, water_balance=water_balance, psi_soil=psi_soil)
+        if date_sim.hour != 0:
+            psi_soil = update_soil_water_potential(
+                psi_soil_init=psi_soil,
+                water_withdrawal=transpiration_previous - irrigation,
+                soil_class=params.soil.soil_class,
+                soil_total_volume=params.soil.soil_volume,
+                psi_min=params.hydraulic.psi_min)
+        water_balance.add(transpiration=transpiration_hourly, irrigation=irrigation)
+        transpiration_previous = transpiration_hourly
+        irrigation_ls.append(irrigation)
+        psi_soil_ls.append(psi_soil)
+    return DataFrame({'irr': irrigation_ls, 'psi_soil': psi_soil_ls}, index=transpiration.index)
+
+
+def evaluate_irrigation_strategies(strategies: dict, time_series: DataFrame, params: Params,
+                                   psi_soil_stress: float = -1.) -> DataFrame:
+    """Replays several irrigation strategies against the transpiration of one simulation.
+
+    Args:
+        strategies: {name: IrrigationStrategy}
+        time_series: hourly outputs of `hydroshoot_wrapper.run` ('E' in g h-1, 'psi_soil' in MPa)
+        params: HydroShoot parameters of the simulation that produced `time_series`
+        psi_soil_stress: [MPa] soil water potential below which hours are counted as stressed
+
+    Returns:
+        total irrigation (kg), minimum and final soil water potential (MPa) and number of stressed hours per strategy
+    """
+    transpiration = time_series['E'] * 1.e-3
+    res = {}
+    for name, strategy in strategies.items():
+        replay = replay_irrigation(strategy=strategy, transpiration=transpiration,
+                                   psi_soil_init=time_series['psi_soil'].iloc[0], params=params)
+        res[name] = {
+            'irrigation_total': replay['irr'].sum(),
+            'psi_soil_min': replay['psi_soil'].min(),
+            'psi_soil_end': replay['psi_soil'].iloc[-1],
+            'stressed_hours': int((replay['psi_soil'] < psi_soil_stress).sum())}
+    return DataFrame.from_dict(res, orient='index').sort_values('irrigation_total')
@@ -0,0 +1,172 @@
+"""Opt-in memory instrumentation attributing allocations to simulation phases.
+
+Each phase (input loading, initialisation, hourly update, irradiance, solve, mtg saving...) is timed and measured by
+two means:
+    - tracemalloc: net Python allocations of the phase and peak traced memory reached during it, together with the
+      source files responsible for the largest allocation differences (on the first `nb_detailed_calls` calls only,
+      since snapshots are costly);
+    - resident set size (RSS) of the process, sampled by a background thread, which also covers allocations made by
+      C extensions (PlantGL scenes, NumPy arrays).
+Repeated phases (hourly ones) are aggregated by name. The report also holds the largest live allocations at the time
+it is written, which reveals accumulators growing along the time loop.
+
+Example:
+    profiler = MemoryProfiler()
+    with profiler.phase('load_inputs'):
+        ...
+    profiler.write_report(path_file=path_output / 'memory_report.json')
+    profiler.stop()
+"""
+
+import resource
+import tracemalloc
+from contextlib import contextmanager
+from json import dump, load
+from pathlib import Path
+from threading import Event, Thread
+from time import perf_counter
+
+from pandas import DataFrame
+
+
+def get_rss() -> float:
+    """Returns the current resident set size of the process [MB] (the peak one where /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+
+
+class MemoryProfiler(object):
+    def __init__(self, is_enabled: bool = True, nb_top: int = 10, nb_detailed_calls: int = 1,
+                 sampling_interval: float = 0.2):
+        """
+        Args:
+            is_enabled: if False, phases are not measured and no report is written (no overhead)
+            nb_top: number of source files reported per phase and in the final snapshot
+            nb_detailed_calls: number of calls of each phase for which allocating source files are reported
+            sampling_interval: [s] RSS sampling interval
+        """
+        self.is_enabled = is_enabled
+        self.nb_top = nb_top
+        self.nb_detailed_calls = nb_detailed_calls
+        self.sampling_interval = sampling_interval
+        self.phases = {}
+        self._active = []
+        self._stop = Event()
+        self._sampler = None
+        self._rss_start = None
+        self._rss_peak = None
+        self._is_tracing_owner = False
+        if is_enabled:
+            self.start()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._is_tracing_owner = True
+        self._rss_start = self._rss_peak = get_rss()
+        self._sampler = Thread(target=self._sample_rss, name='MemoryProfiler', daemon=True)
+        self._sampler.start()
+        pass
+
+    def stop(self):
+        """Stops RSS sampling and tracemalloc (if started by this profiler), which otherwise keeps slowing down
+        allocations of the process. Reports must be written before."""
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._is_tracing_owner:
+            tracemalloc.stop()
+            self._is_tracing_owner = False
+        pass
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.sampling_interval):
+            self._update_rss_peak(get_rss())
+        pass
+
+    def _update_rss_peak(self, rss: float):
+        self._rss_peak = max(self._rss_peak, rss)
+        for record in list(self._active):
+            record['rss_peak'] = max(record['rss_peak'], rss)
+        pass
+
+    @contextmanager
+    def phase(self, name: str):
+        """Measures the enclosed block as phase `name`. Phases may be nested."""
+        if not self.is_enabled:
+            yield
+            return
+
+        stats = self.phases.setdefault(name, {
+            'calls': 0, 'duration': 0., 'allocated_net': 0., 'traced_peak_increase': 0., 'rss_increase': 0.,
+            'rss_peak': 0., 'top_allocations': []})
+        is_detailed = stats['calls'] < self.nb_detailed_calls and self.nb_top > 0
+        snapshot = tracemalloc.take_snapshot() if is_detailed else None
+        traced_current, _ = tracemalloc.get_traced_memory()
+        if not self._active and hasattr(tracemalloc, 'reset_peak'):  # Python >= 3.9
+            tracemalloc.reset_peak()
+        rss = get_rss()
+        record = {'rss_peak': rss}
+        self._active.append(record)
+        time_on = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - time_on
+            self._active.remove(record)
+            rss_end = get_rss()
+            self._update_rss_peak(rss_end)
+            traced_end, traced_peak = tracemalloc.get_traced_memory()
+
+            stats['calls'] += 1
+            stats['duration'] += duration
+            stats['allocated_net'] += (traced_end - traced_current) / 2 ** 20
+            stats['traced_peak_increase'] = max(stats['traced_peak_increase'],
+                                                (traced_peak - traced_current) / 2 ** 20)
+            stats['rss_increase'] += rss_end - rss
+            stats['rss_peak'] = max(stats['rss_peak'], record['rss_peak'], rss_end)
+            if snapshot is not None:
+                stats['top_allocations'] = self._format_top(
+                    tracemalloc.take_snapshot().compare_to(snapshot, 'filename')[:self.nb_top])
+        pass
+
+    @staticmethod
+    def _format_top(statistics: list) -> list:
+        return [{'file': str(stat.traceback[0].filename),
+                 'size': getattr(stat, 'size_diff', stat.size) / 2 ** 20,
+                 'count': getattr(stat, 'count_diff', stat.count)} for stat in statistics]
+
+    def get_report(self) -> dict:
+        """Returns the phase statistics (sizes in MB, durations in s) and the largest live allocations."""
+        return {
+            'rss_start': self._rss_start,
+            'rss_peak': max(self._rss_peak, get_rss()),
+            'rss_end': get_rss(),
+            'phases': self.phases,
+            'top_live_allocations': self._format_top(
+                tracemalloc.take_snapshot().statistics('filename')[:self.nb_top])}
+
+    def write_report(self, path_file: Path, **metadata):
+        """Writes the report as JSON, with `metadata` (e.g. scenario identifiers and mockup size)."""
+        if self.is_enabled:
+            with open(path_file, mode='w') as f:
+                dump({**metadata, **self.get_report()}, f, indent=2)
+        pass
+
+
+def aggregate_memory_reports(path_root: Path, file_name: str = 'memory_report.json') -> DataFrame:
+    """Gathers all the reports found under `path_root` into one row per scenario and phase, with the scenario
+    metadata, the report-level RSS and the phase statistics (top allocations excluded)."""
+    res = []
+    for path_report in sorted(Path(path_root).rglob(file_name)):
+        with open(path_report) as f:
+            report = load(f)
+        metadata = {k: v for k, v in report.items() if k not in ('phases', 'top_live_allocations')}
+        for phase_name, stats in report['phases'].items():
+            res.append({'path': str(path_report.parent), **metadata, 'phase': phase_name,
+                        **{k: v for k, v in stats.items() if k != 'top_allocations'}})
+    return DataFrame(res)
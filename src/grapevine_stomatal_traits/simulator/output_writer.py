@@ -0,0 +1,149 @@
+"""Asynchronous output stage: files are serialised and written by a background thread while the next time step is
+being solved.
+
+Tasks are queued in a bounded queue, so that the compute loop blocks (back-pressure) instead of piling up outputs in
+memory when the storage is slower than the simulation. Each file is written to a temporary name, flushed, fsync-ed and
+then renamed, so that a file either holds its complete content or does not exist. `close` (or leaving the `with` block)
+waits for all pending writes and re-raises the first error met by the writer thread.
+
+Example:
+    with AsyncWriter() as writer:
+        for date in dates:
+            ...
+            writer.write_json(path_file=path_dir / f'dynamic_{date}.json', data=hourly_data, indent=2)
+"""
+
+import shutil
+from json import dumps
+from os import fsync, replace
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+from typing import Callable
+
+
+def write_file(path_file: Path, content: bytes):
+    """Writes `content` atomically and durably."""
+    path_file = Path(path_file)
+    path_temp = path_file.with_name(f'.{path_file.name}.tmp')
+    with open(path_temp, mode='wb') as f:
+        f.write(content)
+        f.flush()
+        fsync(f.fileno())
+    replace(path_temp, path_file)
+    pass
+
+
+def move_files(path_src_dir: Path, path_dst_dir: Path):
+    """Moves all the files of `path_src_dir` to `path_dst_dir` (fsync-ed), then removes `path_src_dir`."""
+    path_dst_dir.mkdir(parents=True, exist_ok=True)
+    for path_src in sorted(path_src_dir.iterdir()):
+        path_temp = path_dst_dir / f'.{path_src.name}.tmp'
+        shutil.copyfile(path_src, path_temp)
+        with open(path_temp, mode='rb+') as f:
+            fsync(f.fileno())
+        replace(path_temp, path_dst_dir / path_src.name)
+    shutil.rmtree(path_src_dir)
+    pass
+
+
+def append_jsonl(path_file: Path, record: dict):
+    """Appends `record` as one JSON line, under an exclusive lock so that concurrent processes (e.g. the scenarios of
+    a sweep sharing one manifest) do not interleave their lines."""
+    import fcntl
+
+    with open(path_file, mode='a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            f.write(dumps(record) + '\n')
+            f.flush()
+            fsync(f.fileno())
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    pass
+
+
+class AsyncWriter(object):
+    def __init__(self, max_pending: int = 8):
+        """
+        Args:
+            max_pending: maximum number of queued write tasks, above which `submit` blocks
+        """
+        self._queue = Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = Thread(target=self._drain, name='AsyncWriter', daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    break
+                func, args, kwargs = task
+                if self._error is None:
+                    func(*args, **kwargs)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+        pass
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError('asynchronous output writing failed') from error
+        pass
+
+    def submit(self, func: Callable, *args, **kwargs):
+        """Queues `func(*args, **kwargs)`, blocking while `max_pending` tasks are already queued. Arguments must not
+        be modified afterwards by the caller."""
+        self._raise_error()
+        if not self._thread.is_alive():
+            raise RuntimeError('the writer is closed')
+        self._queue.put((func, args, kwargs))
+        pass
+
+    def write_bytes(self, path_file: Path, content: bytes):
+        self.submit(write_file, path_file, content)
+        pass
+
+    def write_text(self, path_file: Path, text: str):
+        self.submit(write_file, path_file, text.encode('utf-8'))
+        pass
+
+    def write_json(self, path_file: Path, data, **kwargs):
+        """Serialises `data` in the writer thread (`kwargs` are passed to `json.dumps`)."""
+        self.submit(lambda: write_file(path_file, dumps(data, **kwargs).encode('utf-8')))
+        pass
+
+    def move_files(self, path_src_dir: Path, path_dst_dir: Path):
+        """Moves files staged (e.g. on fast local storage) in `path_src_dir` to `path_dst_dir`."""
+        self.submit(move_files, path_src_dir, path_dst_dir)
+        pass
+
+    def flush(self):
+        """Waits for all queued tasks to be written."""
+        self._queue.join()
+        self._raise_error()
+        pass
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+        pass
+
+    def __enter__(self) -> 'AsyncWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            try:
+                self.close()
+            except RuntimeError:
+                pass
+        pass
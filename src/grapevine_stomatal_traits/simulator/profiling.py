@@ -0,0 +1,121 @@
+"""Opt-in CPU profiling of scenarios, aggregated over the processes of a sweep.
+
+Each scenario is run under the deterministic profiler of the standard library (cProfile) and its statistics are
+written next to its outputs ('cpu_profile.prof'). At the end of a sweep, all files are merged into one profile, from
+which a text report and a breakdown of the time spent per package (HydroShoot solver, PlantGL geometry, MTG, this
+package's wrapper, NumPy/pandas...) are written. The merged '.prof' file can be browsed as an icicle/flame graph with
+e.g. snakeviz or flameprof.
+
+Example:
+    with CpuProfiler() as profiler:
+        run_simulations(...)
+    profiler.write(path_file=path_output / 'cpu_profile.prof')
+    ...
+    merge_cpu_profiles(path_root=path_output_root)
+"""
+
+import cProfile
+import pstats
+from io import StringIO
+from pathlib import Path
+
+from pandas import DataFrame
+
+CPU_PROFILE_FILE_NAME = 'cpu_profile.prof'
+
+# (package label, path fragment of its source files), the first match is used
+PACKAGES = (
+    ('hydroshoot', 'hydroshoot'),
+    ('plantgl', 'plantgl'),
+    ('mtg', 'openalea'),
+    ('grapevine_stomatal_traits', 'grapevine_stomatal_traits'),
+    ('numpy', 'numpy'),
+    ('scipy', 'scipy'),
+    ('pandas', 'pandas'),
+    ('other', 'site-packages'),
+    ('stdlib', 'lib/python'),
+)
+
+
+def get_package(file_name: str, function_name: str = '') -> str:
+    """Returns the package label of a profiled function from its source file or, for C functions (file name '~'),
+    from the module or type named in `function_name` (e.g. "<built-in method openalea.plantgl...>"), 'builtins' if
+    none is recognised."""
+    if file_name == '~' or file_name.startswith('<'):
+        return next((label for label, fragment in PACKAGES[:-2] if fragment in function_name), 'builtins')
+    file_name = file_name.replace('\\', '/')
+    return next((label for label, fragment in PACKAGES if fragment in file_name), 'other')
+
+
+class CpuProfiler(object):
+    def __init__(self, is_enabled: bool = True):
+        """
+        Args:
+            is_enabled: if False, nothing is profiled and no file is written (no overhead)
+        """
+        self.is_enabled = is_enabled
+        self._profile = cProfile.Profile() if is_enabled else None
+
+    def __enter__(self) -> 'CpuProfiler':
+        if self.is_enabled:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.is_enabled:
+            self._profile.disable()
+        pass
+
+    def write(self, path_file: Path):
+        if self.is_enabled:
+            self._profile.dump_stats(str(path_file))
+        pass
+
+
+def calc_package_breakdown(stats: pstats.Stats) -> DataFrame:
+    """Returns the own time (tottime) and number of calls per package, sorted by decreasing time."""
+    res = {}
+    for (file_name, _, function_name), (_, nb_calls, tottime, _, _) in stats.stats.items():
+        package = get_package(file_name, function_name)
+        time_package, calls_package = res.get(package, (0., 0))
+        res[package] = (time_package + tottime, calls_package + nb_calls)
+    df = DataFrame([(k, *v) for k, v in res.items()], columns=['package', 'tottime', 'calls'])
+    df['fraction'] = df['tottime'] / df['tottime'].sum()
+    return df.sort_values('tottime', ascending=False).reset_index(drop=True)
+
+
+def merge_cpu_profiles(path_root: Path, file_name: str = CPU_PROFILE_FILE_NAME, nb_lines: int = 50,
+                       since: float = None) -> pstats.Stats:
+    """Merges all the profiles found under `path_root` and writes, in `path_root`, the merged profile
+    ('cpu_profile_merged.prof'), a text report of the `nb_lines` functions of highest cumulative and own times
+    ('cpu_profile_report.txt') and the breakdown per package ('cpu_profile_packages.csv').
+
+    Args:
+        since: [s] if provided, profiles last modified before this time (since the epoch) are skipped, e.g. those
+            left by earlier sweeps sharing `path_root`
+
+    Raises:
+        FileNotFoundError: if no profile is found
+    """
+    path_root = Path(path_root)
+    paths = sorted(p for p in path_root.rglob(file_name) if p.parent != path_root and (
+            since is None or p.stat().st_mtime >= since))
+    if not paths:
+        raise FileNotFoundError(f'no "{file_name}" file found under "{path_root}"')
+
+    stream = StringIO()
+    stats = pstats.Stats(str(paths[0]), stream=stream)
+    for path_file in paths[1:]:
+        stats.add(str(path_file))
+    stats.dump_stats(str(path_root / 'cpu_profile_merged.prof'))
+
+    breakdown = calc_package_breakdown(stats)
+    breakdown.to_csv(path_root / 'cpu_profile_packages.csv', sep=';', decimal='.', index=False)
+
+    print(f'{len(paths)} merged profiles\n', file=stream)
+    print(breakdown.to_string(index=False), file=stream)
+    stats.sort_stats('cumulative').print_stats(nb_lines)
+    stats.sort_stats('tottime').print_stats(nb_lines)
+    with open(path_root / 'cpu_profile_report.txt', mode='w') as f:
+        f.write(stream.getvalue())
+    return stats
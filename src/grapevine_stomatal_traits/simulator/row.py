@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Row-scale mode: several plants along a row, sharing the geometry of one mockup.
+
+The irradiance of the row is computed on a scene in which the mockup is instanced along the row direction: each
+neighbour is made of PlantGL `Translated` nodes pointing to the shapes of the reference plant, so that leaf geometry
+is shared and the memory of the scene grows with the number of shapes wrappers only. The reference plant (the middle
+one) keeps the vertex ids of the mtg, while the shapes of the other plants get ids encoding their plant index (see
+`RowLayout.encode`), from which the hourly leaf irradiance of each plant is split. HydroShoot builds the irradiance
+scene from the 'geometry' property of the mtg, so that the row shapes, and the labels of neighbour shapes (read for
+their optical properties, see `RowLayout.mirror`), are set on the mtg while irradiance is computed (see
+`sources.mockups.leaf_lod.use_radiation_geometry`). Only the labels are mirrored onto the neighbour shapes: their
+geometry is not copied but instanced, and other properties are read from the reference plant vertices.
+
+HydroShoot computes irradiance on an infinite canopy, replicating the scene on a lattice set from the planting spacing.
+The explicit neighbours would otherwise be replicated on top of the lattice neighbours, their leaf area shading the
+reference plant twice: the spacing on the row of the lattice is therefore stretched to the extent of the row (see
+`RowLayout.calc_pattern_spacing`), the row being assumed to lie along the on-row axis of the lattice. In a row of
+identical plants so replicated, every plant sees the canopy of an isolated plant, and the Ei of the row plants should
+match that of the isolated plant (`benchmarks.row_scale` reports the deviations).
+
+Gas exchange, energy balance and hydraulics are then solved plant by plant on the same mtg topology, each plant with
+its own leaf irradiance (see `hydroshoot_wrapper.run_row`), so that per-plant results reflect neighbour shading
+within the row while only one plant mtg is held in memory at a time.
+"""
+from typing import TYPE_CHECKING
+
+import numpy as np
+from openalea.mtg.mtg import MTG
+
+if TYPE_CHECKING:
+    from openalea.plantgl.scenegraph import Scene
+
+SCENE_UNIT_TO_METER = {'mm': 1.e-3, 'cm': 1.e-2, 'dm': 1.e-1, 'm': 1.}
+
+
+def calc_row_direction(g: MTG) -> np.ndarray:
+    """Returns the horizontal unit vector of the main axis of the canopy (the row direction)."""
+    xy = np.array([(position[0], position[1]) for position in g.property('TopPosition').values()], dtype=float)
+    _, _, axes = np.linalg.svd(xy - xy.mean(axis=0), full_matrices=False)
+    return np.array([axes[0][0], axes[0][1], 0.])
+
+
+class RowLayout(object):
+    __slots__ = ('nb_plants', 'spacing', 'direction', 'plant_id_offset')
+
+    def __init__(self, nb_plants: int, spacing: float, direction: np.ndarray, max_vid: int):
+        """
+        Args:
+            nb_plants: number of plants of the row
+            spacing: distance between two plants on the row, in scene length units
+            direction: horizontal unit vector of the row
+            max_vid: largest vertex id of the mockup, above which the shape ids of neighbour plants are encoded
+
+        Raises:
+            ValueError: if the row has no plant
+        """
+        if nb_plants < 1:
+            raise ValueError(f'a row must have at least one plant, got {nb_plants}')
+        self.nb_plants = nb_plants
+        self.spacing = spacing
+        self.direction = np.asarray(direction, dtype=float) / np.linalg.norm(direction)
+        self.plant_id_offset = 10 ** len(str(int(max_vid)))
+
+    @classmethod
+    def from_mtg(cls, g: MTG, nb_plants: int, spacing: float) -> 'RowLayout':
+        return cls(nb_plants=nb_plants, spacing=spacing, direction=calc_row_direction(g=g), max_vid=max(g.vertices()))
+
+    @classmethod
+    def from_params(cls, g: MTG, nb_plants: int, params: dict) -> 'RowLayout':
+        """Returns the layout of a row of `nb_plants` plants spaced as set in user `params` (planting section)."""
+        spacing = params['planting']['spacing_on_row'] / SCENE_UNIT_TO_METER[params['simulation']['unit_scene_length']]
+        return cls.from_mtg(g=g, nb_plants=nb_plants, spacing=spacing)
+
+    def calc_pattern_spacing(self, spacing_on_row: float) -> float:
+        """Returns the spacing on the row of the infinite-canopy lattice that replicates the whole row, from the
+        `spacing_on_row` between plants (same unit)."""
+        return self.nb_plants * spacing_on_row
+
+    @property
+    def reference_plant(self) -> int:
+        return self.nb_plants // 2
+
+    @property
+    def plants(self) -> list:
+        """Plant indices, the reference plant first."""
+        return [self.reference_plant] + [i for i in range(self.nb_plants) if i != self.reference_plant]
+
+    def to_dict(self) -> dict:
+        """Returns the number of plants and the reference plant of the row, as written with the preprocessed inputs
+        ('row_layout.json')."""
+        return {'nb_plants': self.nb_plants, 'reference_plant': self.reference_plant}
+
+    def calc_offset(self, plant: int) -> np.ndarray:
+        return (plant - self.reference_plant) * self.spacing * self.direction
+
+    def encode(self, vid: int, plant: int) -> int:
+        """Returns the shape id of vertex `vid` of `plant`."""
+        if plant == self.reference_plant:
+            return vid
+        return vid + self.plant_id_offset * (plant + 1)
+
+    def decode(self, shape_id: int) -> (int, int):
+        """Returns the plant and vertex id of a shape id."""
+        rank = int(shape_id) // self.plant_id_offset
+        return (self.reference_plant, int(shape_id)) if rank == 0 else (rank - 1, int(shape_id) % self.plant_id_offset)
+
+    def mirror(self, values: dict) -> dict:
+        """Returns the {shape id: value} of the shapes of all plants but the reference one, from the {vertex id: value}
+        of the reference plant. Used for labels only, the geometry of neighbour shapes being instanced by
+        `build_row_scene`."""
+        return {self.encode(vid, plant): value for plant in self.plants[1:] for vid, value in values.items()}
+
+    def split(self, values: dict) -> dict:
+        """Splits {shape id: value} into {plant: {vertex id: value}}."""
+        res = {plant: {} for plant in range(self.nb_plants)}
+        for shape_id, value in values.items():
+            plant, vid = self.decode(shape_id)
+            res[plant][vid] = value
+        return res
+
+
+def build_row_scene(scene: 'Scene', layout: RowLayout) -> 'Scene':
+    """Returns the scene of the row: the shapes of `scene` (reference plant) and, for every other plant, translated
+    instances of the same geometries."""
+    from openalea.plantgl.all import Scene, Shape, Translated, Vector3
+
+    res = Scene([shape for shape in scene])
+    for plant in layout.plants[1:]:
+        offset = Vector3(*layout.calc_offset(plant).tolist())
+        for shape in scene:
+            res.add(Shape(Translated(offset, shape.geometry), shape.appearance, layout.encode(shape.id, plant)))
+    return res
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Streaming summary statistics of simulations.
+
+Accumulators are updated once per simulated hour with the plant-scale (scalars) and leaf-scale (arrays along the leaf
+index) hourly values provided by `hydroshoot_wrapper.run`, so that seasonal summaries (water use efficiency, hours
+above heat thresholds, daily minimum water potential, leaf-to-air temperature quantiles...) are obtained without
+keeping, or reading back, the full hourly series.
+
+Hourly values available to accumulators:
+    plant scale: 'Rg', 'An' [umol s-1], 'An_mass' [g(CO2) h-1], 'E' [g h-1], 'Tleaf' (median), 'Tair',
+        'Tleaf_excess' (Tleaf - Tair), 'irr', 'psi_soil', 'psi_collar', 'psi_leaf' (median)
+    leaf scale: 'leaf_temperature', 'leaf_temperature_excess', 'leaf_psi', 'leaf_gs'
+
+Example:
+    summary = default_summary()
+    hydroshoot_wrapper.run(..., summary=summary)
+    summary.to_dict()
+"""
+from datetime import datetime
+
+import numpy as np
+
+
+class Accumulator(object):
+    """Online statistic of hourly values (scalars or arrays of a constant shape). NaN values are ignored. In coarse
+    time-step runs, each value stands for `duration` hours, by which sums, means, exceedance hours and quantiles are
+    weighted."""
+
+    def __init__(self, variable: str):
+        self.variable = variable
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+    def _get(self, values: dict, variable: str = None) -> np.ndarray:
+        return np.asarray(values[self.variable if variable is None else variable], dtype=float)
+
+
+class Sum(Accumulator):
+    def __init__(self, variable: str):
+        super().__init__(variable=variable)
+        self.total = 0.
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        self.total = self.total + np.nan_to_num(self._get(values)) * duration
+        pass
+
+    def result(self):
+        return self.total
+
+
+class Mean(Accumulator):
+    def __init__(self, variable: str):
+        super().__init__(variable=variable)
+        self.count = 0
+        self.mean = 0.
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        value = self._get(values)
+        is_valid = ~np.isnan(value)
+        self.count = self.count + is_valid * duration
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean = self.mean + np.where(is_valid, (value - self.mean) * duration / self.count, 0.)
+        pass
+
+    def result(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+
+class Ratio(Accumulator):
+    """Ratio of the sums of two variables, e.g. water use efficiency."""
+
+    def __init__(self, numerator: str, denominator: str):
+        super().__init__(variable=numerator)
+        self.denominator = denominator
+        self.total_numerator = 0.
+        self.total_denominator = 0.
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        self.total_numerator = self.total_numerator + np.nan_to_num(self._get(values)) * duration
+        self.total_denominator = (self.total_denominator +
+                                  np.nan_to_num(self._get(values, self.denominator)) * duration)
+        pass
+
+    def result(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.divide(self.total_numerator, self.total_denominator)
+
+
+class Exceedance(Accumulator):
+    """Number of hours above (or below) a threshold."""
+
+    def __init__(self, variable: str, threshold: float, is_above: bool = True):
+        super().__init__(variable=variable)
+        self.threshold = threshold
+        self.is_above = is_above
+        self.count = 0
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        value = self._get(values)
+        is_exceeded = (value > self.threshold) if self.is_above else (value < self.threshold)
+        self.count = self.count + is_exceeded * duration
+        pass
+
+    def result(self):
+        return self.count
+
+
+class DailyExtremum(Accumulator):
+    """Daily minimum (or maximum) values, one per simulated day."""
+
+    def __init__(self, variable: str, is_min: bool = True):
+        super().__init__(variable=variable)
+        self.is_min = is_min
+        self.days = []
+        self.values = []
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        value = self._get(values)
+        day = date_sim.strftime('%Y-%m-%d')
+        if not self.days or self.days[-1] != day:
+            self.days.append(day)
+            self.values.append(value)
+        else:
+            self.values[-1] = (np.fmin if self.is_min else np.fmax)(self.values[-1], value)
+        pass
+
+    def result(self):
+        return dict(zip(self.days, self.values))
+
+
+class Quantile(Accumulator):
+    """Streaming quantile estimate (P² algorithm, Jain and Chlamtac 1985), whose memory does not depend on the number
+    of hours. Array values are treated as independent streams (e.g. one per leaf). NaN values are ignored once the
+    estimate is initialised from the first five values. A value standing for `duration` hours is added as many times
+    (rounded to whole hours, at least once)."""
+
+    def __init__(self, variable: str, q: float):
+        super().__init__(variable=variable)
+        if not 0 < q < 1:
+            raise ValueError(f'quantile must be in ]0, 1[, got {q}')
+        self.q = q
+        self._is_scalar = None
+        self._first = []
+        self._heights = None
+        self._positions = None
+        self._desired = None
+        self._increments = np.array([0., q / 2., q, (1. + q) / 2., 1.])[:, np.newaxis]
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        value = self._get(values)
+        for _ in range(max(int(round(duration)), 1)):
+            self._add(value)
+        pass
+
+    def _add(self, value: np.ndarray):
+        if self._heights is None:
+            self._is_scalar = value.ndim == 0
+            self._first.append(value)
+            if len(self._first) == 5:
+                self._heights = np.sort(np.atleast_2d(np.array(self._first).T), axis=1).T.astype(float)
+                self._positions = np.tile(np.arange(1., 6.)[:, np.newaxis], (1, self._heights.shape[1]))
+                self._desired = np.tile(np.array([1., 1. + 2 * self.q, 1. + 4 * self.q, 3. + 2 * self.q, 5.])[
+                                            :, np.newaxis], (1, self._heights.shape[1]))
+                self._first = []
+            return
+
+        x = np.atleast_1d(value)
+        is_valid = ~np.isnan(x)
+        x = np.where(is_valid, x, self._heights[2])
+        q, n = self._heights, self._positions
+        q[0] = np.where(is_valid, np.minimum(q[0], x), q[0])
+        q[4] = np.where(is_valid, np.maximum(q[4], x), q[4])
+        k = (x >= q[1:4]).sum(axis=0)
+        n += (np.arange(5)[:, np.newaxis] > k) * is_valid
+        self._desired += self._increments * is_valid
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            is_moved = (((d >= 1) & (n[i + 1] - n[i] > 1)) | ((d <= -1) & (n[i - 1] - n[i] < -1))) & is_valid
+            if not is_moved.any():
+                continue
+            d = np.sign(d)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                        (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                        (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                q_neighbour = np.where(d > 0, q[i + 1], q[i - 1])
+                n_neighbour = np.where(d > 0, n[i + 1], n[i - 1])
+                linear = q[i] + d * (q_neighbour - q[i]) / (n_neighbour - n[i])
+            new_height = np.where((q[i - 1] < parabolic) & (parabolic < q[i + 1]), parabolic, linear)
+            q[i] = np.where(is_moved, new_height, q[i])
+            n[i] = np.where(is_moved, n[i] + d, n[i])
+        pass
+
+    def result(self):
+        if self._heights is None:
+            return np.nanquantile(np.array(self._first), self.q, axis=0) if self._first else np.nan
+        return self._heights[2, 0] if self._is_scalar else self._heights[2].copy()
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {k: _to_json(v) for k, v in value.items()}
+    if isinstance(value, np.ndarray):
+        return value.item() if value.ndim == 0 else value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+class SummaryStatistics(object):
+    def __init__(self, accumulators: dict):
+        """
+        Args:
+            accumulators: key=(str) summary name, value=(Accumulator) accumulator
+        """
+        self.accumulators = accumulators
+        self.nb_hours = 0
+        self.leaf_vids = None
+
+    def update(self, values: dict, date_sim: datetime, duration: float = 1.):
+        for accumulator in self.accumulators.values():
+            accumulator.update(values=values, date_sim=date_sim, duration=duration)
+        self.nb_hours += duration
+        pass
+
+    def to_dict(self, **metadata) -> dict:
+        """Returns the summaries (leaf-scale ones as lists along the leaf index), with `metadata`."""
+        return _to_json({**metadata, 'nb_hours': self.nb_hours, 'leaf_vids': self.leaf_vids,
+                         **{name: accumulator.result() for name, accumulator in self.accumulators.items()}})
+
+
+def default_summary(heat_thresholds: tuple = (35., 40.), quantiles: tuple = (0.05, 0.5, 0.95)) -> SummaryStatistics:
+    """Returns the summaries used in the analysis of the scenarios sweep: seasonal carbon gain, transpiration and
+    water use efficiency (as `analysis.plots.calc_wue`), hours above leaf heat thresholds, daily minimum leaf water
+    potential and leaf-to-air temperature difference quantiles, at plant and leaf scales."""
+    accumulators = {
+        'An_sum': Sum('An_mass'),
+        'E_sum': Sum('E'),
+        'wue': Ratio(numerator='An_mass', denominator='E'),
+        'Tleaf_mean': Mean('Tleaf'),
+        'psi_leaf_daily_min': DailyExtremum('psi_leaf', is_min=True),
+        'leaf_psi_mean': Mean('leaf_psi'),
+        'leaf_temperature_mean': Mean('leaf_temperature')}
+    for threshold in heat_thresholds:
+        accumulators[f'hours_Tleaf_above_{threshold:g}'] = Exceedance('Tleaf', threshold=threshold)
+        accumulators[f'leaf_hours_above_{threshold:g}'] = Exceedance('leaf_temperature', threshold=threshold)
+    for q in quantiles:
+        accumulators[f'Tleaf_excess_q{q * 100:g}'] = Quantile('Tleaf_excess', q=q)
+        accumulators[f'leaf_temperature_excess_q{q * 100:g}'] = Quantile('leaf_temperature_excess', q=q)
+    return SummaryStatistics(accumulators=accumulators)
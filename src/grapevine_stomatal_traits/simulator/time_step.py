@@ -0,0 +1,77 @@
+"""Coarse time-step mode for screening runs.
+
+Only a subset of the hours of `params.simulation.date_range` is simulated (and preprocessed): every `step` hours, or,
+for daylight-weighted sampling, every `step` hours in daylight and every `night_step` hours at night, the first night
+hour after dusk and the first daylight hour after dawn being always simulated so that no sample stands for hours of
+both periods. Steps divide 24 and samples are aligned on midnight, so that the daily predawn reset of soil water
+potential (hour 0) is always simulated. Each sample stands for itself and the following non-simulated hours (its
+`duration`): fluxes are integrated as rates held over the duration of their sample, and the soil water balance and
+irrigation strategies are updated with the water transpired over each elapsed hour. See `benchmarks/time_step.py` for
+the accuracy against hourly simulations.
+"""
+import numpy as np
+from pandas import DataFrame, DatetimeIndex
+
+VALID_STEPS = (1, 2, 3, 4, 6, 8, 12, 24)
+INTERPOLATED_COLUMNS = ('Rg', 'An', 'E', 'Tleaf', 'psi_soil', 'psi_collar', 'psi_leaf', 'theta_soil')
+
+
+class TimeSampling(object):
+    __slots__ = ('step', 'night_step')
+
+    def __init__(self, step: int = 1, night_step: int = None):
+        """
+        Args:
+            step: [h] interval between two simulated hours (in daylight, if `night_step` is provided)
+            night_step: [h] interval between two simulated night hours (no global radiation), default: `step`
+
+        Raises:
+            ValueError: if a step does not divide 24 hours
+        """
+        night_step = step if night_step is None else night_step
+        for value in (step, night_step):
+            if value not in VALID_STEPS:
+                raise ValueError(f'time steps must divide 24 hours, one of {VALID_STEPS}, got {value}')
+        self.step = step
+        self.night_step = night_step
+
+    @property
+    def is_hourly(self) -> bool:
+        return self.step == 1 and self.night_step == 1
+
+    def sample(self, dates: DatetimeIndex, is_night: np.ndarray = None) -> (np.ndarray, np.ndarray):
+        """Selects the simulated hours of `dates`.
+
+        Args:
+            dates: hourly simulation dates
+            is_night: night flag of each of `dates`, required for daylight-weighted sampling
+
+        Returns:
+            positions of the simulated hours in `dates` and the number of hours each of them stands for
+        """
+        hours = DatetimeIndex(dates).hour.to_numpy()
+        if self.night_step == self.step:
+            is_sampled = hours % self.step == 0
+        else:
+            if is_night is None:
+                raise ValueError('night flags are required for daylight-weighted sampling')
+            is_night = np.asarray(is_night, dtype=bool)
+            is_sampled = np.where(is_night, hours % self.night_step == 0, hours % self.step == 0)
+            is_sampled[1:] |= is_night[1:] != is_night[:-1]  # dusk and dawn
+        if len(is_sampled) > 0:
+            is_sampled[0] = True
+        positions = np.flatnonzero(is_sampled)
+        return positions, np.diff(np.append(positions, len(hours)))
+
+
+def interpolate_to_hourly(results: DataFrame, dates: DatetimeIndex) -> DataFrame:
+    """Linearly interpolates in time the sampled outputs of `hydroshoot_wrapper.run` to hourly `dates` (held
+    constant after the last sample), e.g. to compare them with an hourly simulation."""
+    columns = [s for s in INTERPOLATED_COLUMNS if s in results.columns]
+    return results.loc[:, columns].reindex(DatetimeIndex(dates)).interpolate(method='time').ffill()
+
+
+def calc_totals(results: DataFrame) -> dict:
+    """Returns the seasonal net carbon assimilation ([umol s-1] x h) and transpiration [g] of sampled outputs."""
+    duration = results['duration'] if 'duration' in results.columns else 1.
+    return {'An': float((results['An'] * duration).sum()), 'E': float((results['E'] * duration).sum())}
@@ -0,0 +1,75 @@
+"""Weather preparation.
+
+Parsed weather tables are cached in binary form (`read_weather`) for the analysis, which reads the weather file of
+every site and climate scenario. Simulations and preprocessing do not go through the cache: `io.HydroShootInputs`
+takes the path of the weather file and parses it itself.
+
+For the time loop, the position of each simulated hour in the weather table and the night hours are computed once for
+the whole simulated period (`HourlyForcing`). No other forcing is precomputed: the soil temperature is left to
+HydroShoot's `force_soil_temperature`, called on the weather row of each simulated hour only, and the sky temperature
+depends on the irradiance ratio returned by `init_hourly`.
+"""
+from pathlib import Path
+
+from pandas import DataFrame, DatetimeIndex, read_csv, read_pickle
+
+from grapevine_stomatal_traits.simulator.canopy import calc_file_checksum
+
+WEATHER_CACHE_DIR_NAME = '.weather_cache'
+
+
+def read_weather(path_weather: Path, path_cache_dir: Path = None) -> DataFrame:
+    """Reads a weather file (';'-separated, 'time' index), through a binary cache keyed by the file checksum.
+
+    Args:
+        path_weather: weather CSV file
+        path_cache_dir: cache directory (default: '.weather_cache' next to the weather file)
+
+    Returns:
+        the weather table, indexed by time
+    """
+    path_weather = Path(path_weather)
+    if path_cache_dir is None:
+        path_cache_dir = path_weather.parent / WEATHER_CACHE_DIR_NAME
+    path_cache = Path(path_cache_dir) / f'{path_weather.stem}_{calc_file_checksum(path_weather)[:16]}.pkl'
+    if path_cache.exists():
+        return read_pickle(path_cache)
+
+    weather = read_csv(path_weather, sep=';', decimal='.', index_col='time', parse_dates=True)
+    try:
+        path_cache.parent.mkdir(parents=True, exist_ok=True)
+        path_cache_temp = path_cache.with_name(f'.{path_cache.name}.tmp')
+        weather.to_pickle(path_cache_temp)
+        path_cache_temp.replace(path_cache)
+    except OSError:
+        pass  # read-only location: the cache is an optimisation only
+    return weather
+
+
+class HourlyForcing(object):
+    """Weather-only forcing of each simulated hour."""
+    __slots__ = ('dates', 'weather', '_positions', 'is_night')
+
+    def __init__(self, weather: DataFrame, dates: DatetimeIndex):
+        """
+        Args:
+            weather: weather table indexed by time, holding all `dates`
+            dates: simulated hours
+
+        Raises:
+            KeyError: if simulated dates are missing from the weather data
+        """
+        self.dates = DatetimeIndex(dates)
+        self.weather = weather
+        self._positions = weather.index.get_indexer(self.dates)
+        if (self._positions < 0).any():
+            raise KeyError(f'simulated dates missing from weather data: {list(self.dates[self._positions < 0])[:5]}')
+        self.is_night = weather['Rg'].to_numpy()[self._positions] <= 0
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def get_weather(self, i_date: int) -> DataFrame:
+        """Returns the one-row weather table of the `i_date`-th simulated hour."""
+        i = self._positions[i_date]
+        return self.weather.iloc[i:i + 1]
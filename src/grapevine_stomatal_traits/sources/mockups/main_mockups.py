@@ -1,23 +1,34 @@
 from pathlib import Path
 from statistics import median
+from typing import TYPE_CHECKING
 
-from hydroshoot import architecture, display
-from matplotlib import pyplot, image, colors
+from hydroshoot import architecture
 from numpy import zeros, arange, array, quantile
 from openalea.mtg import traversal
 from openalea.mtg.mtg import MTG
-from openalea.plantgl.all import Scene
 from openalea.plantgl.all import surface as surf
 
+from grapevine_stomatal_traits.sources.mockups.leaf_lod import set_leaf_lod
 
-def build_mtg(path_csv: Path, training_system_name: str, is_cordon_preferential_orientation: bool = False) -> MTG:
+if TYPE_CHECKING:
+    from matplotlib import pyplot, image, colors
+
+
+def build_mtg(path_csv: Path, training_system_name: str, is_cordon_preferential_orientation: bool = False,
+              leaf_lod: str = None) -> MTG:
+    """Builds the mockup of a training system.
+
+    Args:
+        leaf_lod: level of detail of leaves for radiation interception, e.g. 'quad' (default: detailed leaves), see
+            `leaf_lod.LEAF_LOD_NB_VERTICES`
+    """
     g = architecture.vine_mtg(file_path=path_csv)
     cordon_vector = architecture.cordon_vector(g=g)[1] if is_cordon_preferential_orientation else None
     if training_system_name == 'sprawl':
         g = _build_mtg_sprawl(g=g, cordon_vector=cordon_vector)
     elif training_system_name == 'vsp':
         g = _build_mtg_vsp(g=g, cordon_vector=cordon_vector)
-    return g
+    return set_leaf_lod(g=g, leaf_lod=leaf_lod)
 
 
 def _build_mtg_sprawl(g: MTG, cordon_vector: list) -> MTG:
@@ -142,8 +153,10 @@ def get_leaf_area_density_from_ref(training_system_name: str):
     return res
 
 
-def plot_leaf_area_density(data: array, ax: pyplot.Subplot = None, norm: colors.Normalize = None,
-                           path_fig: Path = None) -> (pyplot.Subplot, image.AxesImage):
+def plot_leaf_area_density(data: array, ax: 'pyplot.Subplot' = None, norm: 'colors.Normalize' = None,
+                           path_fig: Path = None) -> ('pyplot.Subplot', 'image.AxesImage'):
+    from matplotlib import pyplot
+
     if ax is None:
         fig, ax = pyplot.subplots()
     else:
@@ -202,6 +215,7 @@ def compare_leaf_area_density(g: MTG, training_system_name: str, path_fig: Path)
     leaf_area_density_mtg, y_bounds, z_bounds = calc_leaf_area_density(g=g)
     leaf_area_density_ref = get_leaf_area_density_from_ref(training_system_name=training_system_name)
 
+    from matplotlib import pyplot, colors
     norm = colors.Normalize(0, vmax=10)
     fig, (ax_ref, ax_mtg, ax_cbar) = pyplot.subplots(ncols=3, gridspec_kw=dict(width_ratios=[10, 10, 1]))
     ax_ref, im_ref = plot_leaf_area_density(data=array(leaf_area_density_ref), norm=norm, ax=ax_ref)
@@ -228,6 +242,9 @@ def compare_leaf_area_density(g: MTG, training_system_name: str, path_fig: Path)
 
 
 if __name__ == '__main__':
+    from hydroshoot import display
+    from openalea.plantgl.all import Scene
+
     path_root = Path(__file__).parent
     for training_system in ('vsp', 'sprawl'):
         path_training = path_root / training_system